@@ -0,0 +1,497 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import normalize
+from threadpoolctl import threadpool_limits
+
+
+# Рядків на один np.argpartition у _row_top_k (обмежує int64 копію індексів)
+TOP_K_CHUNK_ROWS = 64
+
+
+class RandomProjectionLSH:
+    """
+    Approximate nearest neighbors для cosine метрики
+    (random-projection LSH / SimHash, тільки NumPy)
+
+    Має той самий інтерфейс, що й sklearn NearestNeighbors
+    (fit / kneighbors / metric / n_neighbors), тому підключається
+    в YachtRecommender замість точного індексу.
+
+    Recall / швидкість регулюються параметрами:
+        n_tables — більше таблиць → вищий recall, повільніше
+        n_bits — більше біт → менші bucket-и, швидше, нижчий recall
+        n_probes — скільки сусідніх bucket-ів (з 1 зміненим бітом) перевіряти в кожній таблиці
+    """
+
+    def __init__(self, n_neighbors=11, metric='cosine', n_tables=8, n_bits=10, n_probes=2,
+                 random_state=42):
+        if metric != 'cosine':
+            raise ValueError(f"RandomProjectionLSH підтримує тільки metric='cosine', отримано '{metric}'")
+
+        self.n_neighbors = n_neighbors
+        self.metric = metric
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probes = min(n_probes, n_bits)
+        self.random_state = random_state
+
+        self._X = None
+        self._planes = None
+        self._orders = None
+        self._sorted_codes = None
+
+    def fit(self, X):
+        """
+        Хешує всі рядки X у n_tables таблиць
+        """
+        rng = np.random.default_rng(self.random_state)
+
+        # Нормалізовані рядки: cosine similarity = скалярний добуток
+        self._X = normalize(X) if sp.issparse(X) else normalize(np.asarray(X, dtype=np.float32))
+        self._planes = rng.standard_normal(
+            (X.shape[1], self.n_tables * self.n_bits)
+        ).astype(np.float32)
+
+        codes, _ = self._hash(self._X)
+
+        # Для кожної таблиці: рядки, відсортовані за кодом bucket-а
+        self._orders = np.argsort(codes, axis=0, kind='stable').T
+        self._sorted_codes = np.take_along_axis(codes, self._orders.T, axis=0).T
+
+        return self
+
+    def _hash(self, X):
+        """
+        Returns:
+            codes: (n, n_tables) int64 — код bucket-а в кожній таблиці
+            margins: (n, n_tables, n_bits) — |проєкція|, наскільки впевнений кожен біт
+        """
+        projections = np.asarray(X @ self._planes, dtype=np.float32)
+        projections = projections.reshape(-1, self.n_tables, self.n_bits)
+
+        weights = np.left_shift(1, np.arange(self.n_bits, dtype=np.int64))
+        codes = (projections > 0).astype(np.int64) @ weights
+
+        return codes, np.abs(projections)
+
+    def _probe_codes(self, codes, margins):
+        """
+        Multi-probe: власний bucket + bucket-и з інвертованим найменш впевненим бітом
+
+        Returns:
+            (n, n_tables, 1 + n_probes) коди для перевірки
+        """
+        if self.n_probes == 0:
+            return codes[:, :, None]
+
+        weakest_bits = np.argsort(margins, axis=2)[:, :, :self.n_probes]
+        flipped = codes[:, :, None] ^ np.left_shift(1, weakest_bits)
+        return np.concatenate([codes[:, :, None], flipped], axis=2)
+
+    def kneighbors(self, X, n_neighbors=None, return_distance=True):
+        """
+        Наближені k сусідів. Кандидати з bucket-ів ранжуються точно;
+        якщо кандидатів менше за k — запит рахується brute force.
+
+        Returns:
+            (distances, indices) як у sklearn (distance = 1 - cosine similarity)
+        """
+        if self._X is None:
+            raise ValueError("Індекс не побудовано! Спочатку викличте .fit()")
+
+        n_neighbors = n_neighbors or self.n_neighbors
+        n_samples = self._X.shape[0]
+        n_neighbors = min(n_neighbors, n_samples)
+
+        queries = normalize(X) if sp.issparse(X) else normalize(np.asarray(X, dtype=np.float32))
+        codes, margins = self._hash(queries)
+        probes = self._probe_codes(codes, margins)
+
+        # Межі bucket-ів для всіх запитів однією searchsorted на таблицю
+        starts = np.empty(probes.shape, dtype=np.int64)
+        ends = np.empty(probes.shape, dtype=np.int64)
+        for table in range(self.n_tables):
+            starts[:, table] = np.searchsorted(self._sorted_codes[table], probes[:, table], side='left')
+            ends[:, table] = np.searchsorted(self._sorted_codes[table], probes[:, table], side='right')
+
+        # Запитів небагато — рахуємо їх dense навіть для CSR індексу
+        if sp.issparse(queries):
+            queries = queries.toarray()
+
+        n_queries = queries.shape[0]
+        distances = np.empty((n_queries, n_neighbors), dtype=np.float32)
+        indices = np.empty((n_queries, n_neighbors), dtype=np.int64)
+
+        for i in range(n_queries):
+            candidates = np.unique(np.concatenate([
+                self._orders[table][start:end]
+                for table in range(self.n_tables)
+                for start, end in zip(starts[i, table], ends[i, table])
+            ]))
+            if len(candidates) < n_neighbors:
+                candidates = np.arange(n_samples)
+
+            similarities = np.asarray(self._X[candidates] @ queries[i], dtype=np.float32).ravel()
+            top = np.argpartition(-similarities, n_neighbors - 1)[:n_neighbors]
+            top = top[np.argsort(-similarities[top], kind='stable')]
+
+            indices[i] = candidates[top]
+            distances[i] = 1 - similarities[top]
+
+        if return_distance:
+            return distances, indices
+        return indices
+
+
+class BlockedCosineIndex:
+    """
+    Точний top-k для cosine метрики для batch задач
+
+    Similarity рахується блоками запитів одним matrix multiply
+    (block_size × n_samples), top-k обирається через np.argpartition —
+    повна матриця n × n ніколи не створюється. Пам'ять на потік:
+    block_size × n_samples × 4 байти (float32 similarities перетворюються
+    на distances на місці; int64 індекси argpartition — тільки для
+    TOP_K_CHUNK_ROWS рядків за раз, див. _row_top_k).
+
+    Рядки X не копіюються (зберігаються тільки їх L2 норми), тому індекс
+    можна будувати поверх mmap масиву моделі.
+    """
+
+    def __init__(self, n_neighbors=11, metric='cosine', block_size=1024, n_threads=1):
+        if metric != 'cosine':
+            raise ValueError(f"BlockedCosineIndex підтримує тільки metric='cosine', отримано '{metric}'")
+
+        self.n_neighbors = n_neighbors
+        self.metric = metric
+        self.block_size = block_size
+        self.n_threads = n_threads
+
+        self._X = None
+        self._inv_norms = None
+
+    def fit(self, X):
+        self._X = X if sp.issparse(X) else np.asarray(X, dtype=np.float32)
+        self._inv_norms = _inverse_row_norms(self._X)
+        return self
+
+    def kneighbors(self, X, n_neighbors=None, return_distance=True):
+        """
+        Returns:
+            (distances, indices) як у sklearn (distance = 1 - cosine similarity)
+        """
+        if self._X is None:
+            raise ValueError("Індекс не побудовано! Спочатку викличте .fit()")
+
+        n_neighbors = min(n_neighbors or self.n_neighbors, self._X.shape[0])
+        if not sp.issparse(X):
+            X = np.asarray(X, dtype=np.float32)
+        query_inv_norms = _inverse_row_norms(X)
+
+        n_queries = X.shape[0]
+        distances = np.empty((n_queries, n_neighbors), dtype=np.float32)
+        indices = np.empty((n_queries, n_neighbors), dtype=np.int64)
+
+        def run_block(start):
+            end = min(start + self.block_size, n_queries)
+            queries = X[start:end]
+            if sp.issparse(queries):
+                queries = queries.toarray()
+            queries = queries * query_inv_norms[start:end, None]
+
+            # (block × n_samples) similarities для блоку запитів
+            block_distances = np.asarray((self._X @ queries.T).T, dtype=np.float32)
+            block_distances *= self._inv_norms[None, :]
+            np.subtract(1, block_distances, out=block_distances)
+
+            indices[start:end], distances[start:end] = _row_top_k(block_distances, n_neighbors)
+
+        starts = range(0, n_queries, self.block_size)
+        if self.n_threads > 1:
+            # Паралелимо по блоках (matmul відпускає GIL), BLAS — по одному потоку
+            with threadpool_limits(limits=1), ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                list(executor.map(run_block, starts))
+        else:
+            for start in starts:
+                run_block(start)
+
+        if return_distance:
+            return distances, indices
+        return indices
+
+
+class QuantizedCosineIndex:
+    """
+    Cosine top-k по квантизованих векторах (int8 або float16)
+
+    Рядки L2-нормалізуються і зберігаються як:
+        int8 — з окремим scale на кожну ознаку (4× менше за float32)
+        float16 — половина пам'яті float32
+    Scoring (блоками, як BlockedCosineIndex) йде по квантизованих даних.
+    Якщо rerank > 0, то rerank × k найкращих кандидатів переранжуються
+    точно по вихідному float32 X (він не копіюється — може бути mmap).
+    """
+
+    def __init__(self, n_neighbors=11, metric='cosine', dtype='int8', rerank=4,
+                 block_size=1024, item_block_size=65536):
+        if metric != 'cosine':
+            raise ValueError(f"QuantizedCosineIndex підтримує тільки metric='cosine', отримано '{metric}'")
+        if dtype not in ('int8', 'float16'):
+            raise ValueError(f"dtype має бути 'int8' або 'float16', отримано '{dtype}'")
+
+        self.n_neighbors = n_neighbors
+        self.metric = metric
+        self.dtype = dtype
+        self.rerank = rerank
+        self.block_size = block_size
+        self.item_block_size = item_block_size
+
+        self._codes = None
+        self._scales = None
+        self._X = None
+        self._inv_norms = None
+
+    @property
+    def codes(self):
+        return self._codes
+
+    @property
+    def scales(self):
+        return self._scales
+
+    @property
+    def inv_norms(self):
+        return self._inv_norms
+
+    @property
+    def nbytes(self):
+        """
+        Пам'ять квантизованих даних (без вихідного X для rerank)
+        """
+        return 0 if self._codes is None else self._codes.nbytes + self._scales.nbytes
+
+    def fit(self, X):
+        inv_norms = _inverse_row_norms(X)
+        n_samples, n_features = X.shape
+
+        # Квантизуємо блоками, щоб не тримати повну float32 нормалізовану копію
+        def normalized_rows(start):
+            rows = X[start:start + self.item_block_size]
+            rows = rows.toarray() if sp.issparse(rows) else np.asarray(rows, dtype=np.float32)
+            return rows * inv_norms[start:start + self.item_block_size, None]
+
+        starts = range(0, n_samples, self.item_block_size)
+
+        if self.dtype == 'int8':
+            max_abs = np.zeros(n_features, dtype=np.float32)
+            for start in starts:
+                np.maximum(max_abs, np.abs(normalized_rows(start)).max(axis=0, initial=0), out=max_abs)
+            self._scales = np.where(max_abs > 0, max_abs / 127, 1).astype(np.float32)
+
+            self._codes = np.empty((n_samples, n_features), dtype=np.int8)
+            for start in starts:
+                rows = normalized_rows(start) / self._scales
+                self._codes[start:start + len(rows)] = np.clip(np.rint(rows), -127, 127)
+        else:
+            self._scales = np.ones(n_features, dtype=np.float32)
+            self._codes = np.empty((n_samples, n_features), dtype=np.float16)
+            for start in starts:
+                rows = normalized_rows(start)
+                self._codes[start:start + len(rows)] = rows
+
+        if self.rerank:
+            self._X = X if sp.issparse(X) else np.asarray(X, dtype=np.float32)
+            self._inv_norms = inv_norms
+
+        return self
+
+    def fit_codes(self, X, codes, scales, inv_norms=None):
+        """
+        Індекс з уже квантизованих codes / scales (збережених save_model)
+        без повторної квантизації. codes можуть бути mmap — тоді кілька
+        процесів ділять ті самі сторінки.
+
+        Args:
+            X: вихідні float32 features (потрібні тільки для rerank; з mmap
+                читаються лише рядки кандидатів)
+            inv_norms: збережені 1 / ||x|| рядків X (None — рахуються, що
+                читає весь X)
+        """
+        if codes.dtype != np.dtype(self.dtype) or codes.shape != X.shape:
+            raise ValueError(
+                f"codes {codes.dtype} {codes.shape} не відповідають індексу ({self.dtype}, X {X.shape})"
+            )
+
+        self._codes = codes
+        self._scales = np.asarray(scales, dtype=np.float32)
+        if self.rerank:
+            self._X = X if sp.issparse(X) else np.asarray(X, dtype=np.float32)
+            self._inv_norms = _inverse_row_norms(X) if inv_norms is None else inv_norms
+        return self
+
+    def _quantized_scores(self, queries):
+        """
+        (block × n_samples) наближені similarities; X деквантизується по блоках items
+        """
+        # Per-dimension scale переносимо на запит: q · (codes * s) = (q * s) · codes
+        queries = queries * self._scales[None, :]
+        n_samples = self._codes.shape[0]
+        scores = np.empty((queries.shape[0], n_samples), dtype=np.float32)
+
+        for start in range(0, n_samples, self.item_block_size):
+            items = self._codes[start:start + self.item_block_size].astype(np.float32)
+            scores[:, start:start + len(items)] = queries @ items.T
+
+        return scores
+
+    def kneighbors(self, X, n_neighbors=None, return_distance=True):
+        """
+        Returns:
+            (distances, indices) як у sklearn (distance = 1 - cosine similarity)
+        """
+        if self._codes is None:
+            raise ValueError("Індекс не побудовано! Спочатку викличте .fit()")
+
+        n_samples = self._codes.shape[0]
+        n_neighbors = min(n_neighbors or self.n_neighbors, n_samples)
+        n_candidates = min(max(n_neighbors * self.rerank, n_neighbors), n_samples)
+
+        query_inv_norms = _inverse_row_norms(X)
+        n_queries = X.shape[0]
+        distances = np.empty((n_queries, n_neighbors), dtype=np.float32)
+        indices = np.empty((n_queries, n_neighbors), dtype=np.int64)
+
+        for start in range(0, n_queries, self.block_size):
+            end = min(start + self.block_size, n_queries)
+            queries = X[start:end]
+            queries = queries.toarray() if sp.issparse(queries) else np.asarray(queries, dtype=np.float32)
+            queries = queries * query_inv_norms[start:end, None]
+
+            # Мінус на місці: top-k найменших без копії scores
+            scores = self._quantized_scores(queries)
+            np.negative(scores, out=scores)
+            candidates, _ = _row_top_k(scores, n_candidates)
+
+            if self.rerank:
+                # Точний cosine по float32 тільки для кандидатів
+                rows = self._X[candidates.ravel()]
+                rows = rows.toarray() if sp.issparse(rows) else rows
+                rows = rows.reshape(len(queries), n_candidates, -1)
+                scores = np.einsum('qcd,qd->qc', rows, queries)
+                scores *= self._inv_norms[candidates]
+            else:
+                scores = -np.take_along_axis(scores, candidates, axis=1)
+
+            top = np.argpartition(-scores, n_neighbors - 1, axis=1)[:, :n_neighbors]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+
+            indices[start:end] = np.take_along_axis(np.take_along_axis(candidates, top, axis=1), order, axis=1)
+            distances[start:end] = 1 - np.take_along_axis(top_scores, order, axis=1)
+
+        if return_distance:
+            return distances, indices
+        return indices
+
+
+def _row_top_k(distances, k, chunk_rows=None):
+    """
+    k найменших значень кожного рядка, відсортовані: (indices, values)
+
+    np.argpartition повертає int64 індекси розміру всього масиву, тому
+    викликається по chunk_rows рядків — додаткова пам'ять
+    chunk_rows × n_columns × 8 байт замість 8 байт на кожен елемент блоку.
+    """
+    chunk_rows = chunk_rows or TOP_K_CHUNK_ROWS
+    n_rows = distances.shape[0]
+    top = np.empty((n_rows, k), dtype=np.int64)
+    for start in range(0, n_rows, chunk_rows):
+        chunk = distances[start:start + chunk_rows]
+        top[start:start + len(chunk)] = np.argpartition(chunk, k - 1, axis=1)[:, :k]
+
+    top_values = np.take_along_axis(distances, top, axis=1)
+    order = np.argsort(top_values, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_values, order, axis=1)
+
+
+def _inverse_row_norms(X):
+    """
+    1 / ||x|| для кожного рядка (нульові рядки → 0, similarity = 0)
+    """
+    if sp.issparse(X):
+        norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    else:
+        norms = np.linalg.norm(X, axis=1)
+    norms = norms.astype(np.float32)
+    return np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)
+
+
+INDEX_BACKENDS = {
+    'exact': NearestNeighbors,
+    'lsh': RandomProjectionLSH,
+    'blocked': BlockedCosineIndex,
+    'quantized': QuantizedCosineIndex,
+}
+
+
+def build_index(name='exact', n_neighbors=11, metric='cosine', **params):
+    """
+    Створює (ще не натренований) індекс сусідів за назвою backend-у
+
+    Args:
+        name: 'exact' (sklearn NearestNeighbors), 'lsh', 'blocked' або 'quantized'
+        params: параметри backend-у (напр. n_tables, n_bits для 'lsh';
+            block_size, n_threads для 'blocked'; dtype, rerank для 'quantized')
+    """
+    if name not in INDEX_BACKENDS:
+        raise ValueError(f"Невідомий index backend '{name}'. Доступні: {list(INDEX_BACKENDS)}")
+
+    if name == 'exact':
+        return NearestNeighbors(
+            n_neighbors=n_neighbors,
+            metric=metric,
+            algorithm=params.get('algorithm', 'auto'),  # автоматично обирає ball_tree, kd_tree або brute
+            n_jobs=params.get('n_jobs', -1)  # використовує всі CPU cores
+        )
+
+    return INDEX_BACKENDS[name](n_neighbors=n_neighbors, metric=metric, **params)
+
+
+def recall_report(index, X, k=10, n_queries=500, random_state=42):
+    """
+    Порівнює індекс з точним brute-force KNN на випадкових рядках X
+
+    Returns:
+        dict: recall@k, час на запит (мс) для індексу та точного пошуку, speedup
+    """
+    rng = np.random.default_rng(random_state)
+    query_idx = rng.choice(X.shape[0], size=min(n_queries, X.shape[0]), replace=False)
+    queries = X[query_idx]
+
+    exact = NearestNeighbors(n_neighbors=k, metric=index.metric, algorithm='brute').fit(X)
+
+    start = time.perf_counter()
+    exact_indices = exact.kneighbors(queries, n_neighbors=k, return_distance=False)
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    approx_indices = index.kneighbors(queries, n_neighbors=k, return_distance=False)
+    approx_time = time.perf_counter() - start
+
+    hits = sum(
+        len(np.intersect1d(approx_row, exact_row, assume_unique=True))
+        for approx_row, exact_row in zip(approx_indices, exact_indices)
+    )
+
+    report = {
+        'k': k,
+        'n_queries': len(query_idx),
+        f'recall@{k}': hits / (len(query_idx) * k),
+        'index_ms_per_query': approx_time / len(query_idx) * 1000,
+        'exact_ms_per_query': exact_time / len(query_idx) * 1000,
+    }
+    report['speedup'] = report['exact_ms_per_query'] / max(report['index_ms_per_query'], 1e-9)
+    return report
@@ -0,0 +1,344 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.metrics.pairwise import paired_distances
+from sklearn.neighbors import NearestNeighbors
+from threadpoolctl import threadpool_limits
+from sqlalchemy import create_engine
+import dotenv
+
+from catalog import YachtCatalog
+from events import load_events
+from similar_yachts import YachtRecommender
+
+dotenv.load_dotenv()
+
+
+# Конфігурації за замовчуванням: метрики × index backend-и (ann_index.py)
+DEFAULT_CONFIGS = [
+    {'name': 'exact-cosine', 'metric': 'cosine', 'index': 'exact'},
+    {'name': 'exact-euclidean', 'metric': 'euclidean', 'index': 'exact'},
+    {'name': 'exact-manhattan', 'metric': 'manhattan', 'index': 'exact'},
+    {'name': 'exact-cosine-sparse', 'metric': 'cosine', 'index': 'exact', 'sparse': True},
+    {'name': 'blocked-cosine', 'metric': 'cosine', 'index': 'blocked', 'index_params': {'block_size': 1024}},
+    {'name': 'lsh-cosine', 'metric': 'cosine', 'index': 'lsh',
+     'index_params': {'n_tables': 8, 'n_bits': 10, 'n_probes': 2}},
+    {'name': 'lsh-cosine-fast', 'metric': 'cosine', 'index': 'lsh',
+     'index_params': {'n_tables': 4, 'n_bits': 12, 'n_probes': 1}},
+    {'name': 'quantized-int8', 'metric': 'cosine', 'index': 'quantized',
+     'index_params': {'dtype': 'int8', 'rerank': 4}},
+    {'name': 'quantized-float16', 'metric': 'cosine', 'index': 'quantized',
+     'index_params': {'dtype': 'float16', 'rerank': 0}},
+]
+
+# Скільки одиночних recommend() вимірюється для латентності
+N_LATENCY_QUERIES = 100
+
+
+def split_events(events, holdout_fraction=0.2):
+    """
+    Часовий split подій для offline оцінки
+
+    Останні holdout_fraction подій (за createdAt) — held-out. Для кожного
+    користувача з подіями по обидва боки межі запит — остання яхта до межі
+    (як сторінка яхти, на якій показуються cold_recommendations),
+    релевантні — яхти з held-out подій (крім самої яхти запиту).
+
+    Args:
+        events: DataFrame подій (userId, yachtId, createdAt), напр. вихід
+            generating/event_generator.py
+
+    Returns:
+        (query_ids, relevant): масив ID яхт-запитів і список масивів релевантних ID
+            (ID — рядки)
+    """
+    events = events[['userId', 'yachtId', 'createdAt']].copy()
+    # ID з CSV — рядки, з Postgres — uuid.UUID: порівнюємо як рядки (як build_interaction_matrix)
+    events['userId'] = events['userId'].astype(str)
+    events['yachtId'] = events['yachtId'].astype(str)
+    events['createdAt'] = pd.to_datetime(events['createdAt'], utc=True)
+    cutoff = events['createdAt'].quantile(1 - holdout_fraction)
+
+    train = events[events['createdAt'] <= cutoff].sort_values('createdAt', kind='stable')
+    test = events[events['createdAt'] > cutoff]
+
+    last_yacht = train.groupby('userId', sort=False)['yachtId'].last()
+    held_out = test.groupby('userId', sort=False)['yachtId'].unique()
+    users = last_yacht.index.intersection(held_out.index)
+
+    query_ids, relevant = [], []
+    for user_id in users:
+        query_id = last_yacht[user_id]
+        targets = held_out[user_id]
+        targets = targets[targets != query_id]
+        if len(targets):
+            query_ids.append(query_id)
+            relevant.append(targets)
+    return np.array(query_ids, dtype=object), relevant
+
+
+def run_benchmark(df, events=None, configs=DEFAULT_CONFIGS, k=10, n_queries=500, holdout_fraction=0.2,
+                  n_jobs=1, output=None, random_state=42):
+    """
+    Запускає всі конфігурації і збирає JSON-сумісний звіт
+
+    Для кожної конфігурації: час fit, batched запиту (recommend_many),
+    одиночного recommend() і recommend_all; recall@k проти точного
+    brute-force KNN тієї ж метрики; hit-rate@k та NDCG@k на held-out
+    подіях (split_events); coverage — частка каталогу в recommend_all.
+
+    Args:
+        df: DataFrame яхт або YachtCatalog
+        events: DataFrame подій для hit-rate / NDCG (None — без них)
+        configs: список dict {name, metric, index, index_params, sparse}
+        k: довжина списку рекомендацій
+        n_queries: скільки випадкових яхт для recall і batched timing
+        n_jobs: скільки конфігурацій рахувати паралельно в процесах
+            (кожен процес — один потік BLAS; час менш точний при n_jobs > cores)
+        output: шлях JSON звіту (None — не записувати)
+
+    Returns:
+        dict звіту: {'k', 'n_yachts', 'n_eval_queries', ..., 'results': [...]}
+    """
+    if isinstance(df, YachtCatalog):
+        df = df.to_frame()
+
+    query_ids, relevant = (np.empty(0, dtype=object), []) if events is None else split_events(events, holdout_fraction)
+    rng = np.random.default_rng(random_state)
+    sample = rng.choice(len(df), size=min(n_queries, len(df)), replace=False)
+
+    n_jobs = (os.cpu_count() or 1) if n_jobs == -1 else n_jobs
+    if events is not None:
+        catalog_ids = set(df['id'].astype(str))
+        n_matched = sum(value in catalog_ids for value in query_ids)
+        if not n_matched:
+            print(f"⚠️ Немає held-out запитів з яхтами каталогу ({len(query_ids)} запитів з подій) — "
+                  f"hit-rate / NDCG не рахуються (перевірте yachtId подій)")
+    print(f"🚀 Benchmark: {len(configs)} конфігурацій, {len(df)} яхт, "
+          f"{len(query_ids)} held-out запитів, k={k}, {n_jobs} процесів")
+
+    data = (df, query_ids, relevant, sample, k)
+    if n_jobs <= 1:
+        _init_benchmark_worker(data, limit_threads=False)
+        results = [_run_config(config) for config in configs]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(n_jobs, len(configs)),
+            initializer=_init_benchmark_worker,
+            initargs=(data,)
+        ) as executor:
+            results = list(executor.map(_run_config, configs))
+
+    report = {
+        'generated_at': pd.Timestamp.now(tz='UTC').isoformat(),
+        'k': k,
+        'n_yachts': len(df),
+        'n_queries': len(sample),
+        'n_eval_queries': len(query_ids),
+        'holdout_fraction': holdout_fraction,
+        'n_jobs': n_jobs,
+        'results': results,
+    }
+    print_report(report)
+
+    if output:
+        tmp_path = f"{output}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, output)
+        print(f"💾 Звіт збережено у {output}")
+    return report
+
+
+def select_config(report, min_recall=0.95, min_hit_rate=None, min_ndcg=None, by='batch_ms_per_query'):
+    """
+    Найшвидша (за метрикою by) конфігурація, що проходить поріг якості
+
+    Returns:
+        dict результату конфігурації або None, якщо жодна не проходить
+    """
+    thresholds = {'recall': min_recall, 'hit_rate': min_hit_rate, 'ndcg': min_ndcg}
+    passing = [
+        result for result in report['results']
+        if 'error' not in result and all(
+            threshold is None or (result[name] is not None and result[name] >= threshold)
+            for name, threshold in thresholds.items()
+        )
+    ]
+    return min(passing, key=lambda result: result[by]) if passing else None
+
+
+def print_report(report):
+    k = report['k']
+    print(f"\n📊 {'config':<22} {'fit с':>7} {'batch мс':>9} {'single мс':>10} {'all с':>7} "
+          f"{f'recall@{k}':>10} {f'hit@{k}':>7} {f'ndcg@{k}':>8} {'coverage':>9}")
+    for result in report['results']:
+        if 'error' in result:
+            print(f"   {result['name']:<22} ❌ {result['error']}")
+            continue
+        hit_rate = '—' if result['hit_rate'] is None else f"{result['hit_rate']:.3f}"
+        ndcg = '—' if result['ndcg'] is None else f"{result['ndcg']:.3f}"
+        print(f"   {result['name']:<22} {result['fit_seconds']:>7.3f} {result['batch_ms_per_query']:>9.4f} "
+              f"{result['single_ms_p50']:>10.3f} {result['recommend_all_seconds']:>7.2f} "
+              f"{result['recall']:>10.3f} {hit_rate:>7} {ndcg:>8} {result['coverage']:>9.2%}")
+
+
+# Дані benchmark-у в процесі (задаються initializer-ом)
+_benchmark_data = None
+
+
+def _init_benchmark_worker(data, limit_threads=True):
+    """
+    Initializer worker процесу: дані benchmark-у + один потік BLAS
+    """
+    global _benchmark_data
+    if limit_threads:
+        threadpool_limits(limits=1)
+    _benchmark_data = data
+
+
+def _run_config(config):
+    """
+    Вимірює одну конфігурацію (виконується у worker процесі або локально)
+    """
+    df, query_ids, relevant, sample, k = _benchmark_data
+    result = {
+        'name': config.get('name', f"{config['index']}-{config['metric']}"),
+        'metric': config['metric'],
+        'index': config['index'],
+        'index_params': config.get('index_params', {}),
+        'sparse': bool(config.get('sparse', False)),
+    }
+
+    try:
+        recommender = YachtRecommender(df)
+        start = time.perf_counter()
+        recommender.fit(
+            n_neighbors=k + 1,
+            metric=config['metric'],
+            sparse=result['sparse'],
+            index=config['index'],
+            index_params=config.get('index_params'),
+        )
+        result['fit_seconds'] = time.perf_counter() - start
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+
+    yacht_ids = recommender.yacht_ids
+
+    # Batched запит (як service.py / recommend_many)
+    start = time.perf_counter()
+    recommender.recommend_many(yacht_ids[sample], top_k=k)
+    result['batch_ms_per_query'] = (time.perf_counter() - start) / len(sample) * 1000
+
+    # Одиночні recommend() (DataFrame результату)
+    latencies = []
+    for yacht_id in yacht_ids[sample[:N_LATENCY_QUERIES]]:
+        start = time.perf_counter()
+        recommender.recommend(yacht_id, top_k=k)
+        latencies.append(time.perf_counter() - start)
+    result['single_ms_p50'] = float(np.median(latencies) * 1000)
+    result['single_ms_p95'] = float(np.quantile(latencies, 0.95) * 1000)
+
+    # Весь каталог: throughput + coverage
+    start = time.perf_counter()
+    _, neighbor_ids, _ = recommender.recommend_all(top_k=k)
+    result['recommend_all_seconds'] = time.perf_counter() - start
+    recommended = np.unique(recommender.yacht_id_to_idx.rows(neighbor_ids.ravel()))
+    result['coverage'] = len(recommended) / len(yacht_ids)
+
+    result['recall'] = _recall(recommender, sample, k)
+    result['hit_rate'], result['ndcg'] = _ranking_quality(recommender, query_ids, relevant, k)
+    result['n_eval_queries'] = len(_query_rows(recommender, query_ids)[0])
+    return result
+
+
+def _recall(recommender, sample, k):
+    """
+    Recall@k проти точного brute-force KNN тієї ж метрики
+
+    Сусід вважається влученням, якщо його відстань не більша за k-ту точну
+    (стійко до однакових feature векторів, де порядок рівних довільний).
+    """
+    features = recommender.feature_matrix_scaled
+    metric = recommender.knn_model.metric
+    exact = NearestNeighbors(n_neighbors=k + 1, metric=metric, algorithm='brute').fit(features)
+    # + сама яхта з відстанню 0: k-та відстань без неї — стовпець k
+    exact_distances, _ = exact.kneighbors(features[sample], n_neighbors=k + 1)
+    kth_distance = exact_distances[:, k]
+
+    indices, _ = recommender.batch_neighbors(sample, k)
+    queries, neighbors = features[np.repeat(sample, indices.shape[1])], features[indices.ravel()]
+    if sp.issparse(features):
+        # paired_distances приймає тільки dense (тут лише n_queries × k рядків)
+        queries, neighbors = queries.toarray(), neighbors.toarray()
+    distances = paired_distances(queries, neighbors, metric=metric).reshape(indices.shape)
+    return float((distances <= kth_distance[:, None] + 1e-6).mean())
+
+
+def _ranking_quality(recommender, query_ids, relevant, k):
+    """
+    (hit-rate@k, NDCG@k) на held-out подіях; (None, None) без подій
+    """
+    known, query_idx = _query_rows(recommender, query_ids)
+    if not known:
+        return None, None
+
+    indices, _ = recommender.batch_neighbors(query_idx, k)
+    neighbor_ids = recommender.yacht_ids[indices].astype(str)
+
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    hits = np.zeros(len(known))
+    ndcg = np.zeros(len(known))
+    for row, idx in enumerate(known):
+        is_relevant = np.isin(neighbor_ids[row], relevant[idx])
+        hits[row] = is_relevant.any()
+        ideal = discounts[:min(len(relevant[idx]), k)].sum()
+        ndcg[row] = (discounts[:len(is_relevant)] * is_relevant).sum() / ideal
+    return float(hits.mean()), float(ndcg.mean())
+
+
+def _query_rows(recommender, query_ids):
+    """
+    (позиції в query_ids, рядки каталогу) для запитів, відомих моделі;
+    ID порівнюються як рядки (події з CSV проти uuid.UUID каталогу)
+    """
+    lookup = {str(yacht_id): idx for yacht_id, idx in recommender.yacht_id_to_idx.items()}
+    known = [position for position, value in enumerate(query_ids) if str(value) in lookup]
+    query_idx = np.array([lookup[str(query_ids[position])] for position in known], dtype=np.int64)
+    return known, query_idx
+
+
+# ============================================
+# ВИКОРИСТАННЯ
+# ============================================
+
+if __name__ == "__main__":
+    engine = create_engine(os.getenv("DB_STRING"))
+    catalog = YachtCatalog.from_sql(engine, table='yachts', chunksize=50_000)
+
+    # Held-out події: CSV з generating/event_generator.py або таблиця events
+    if os.getenv("EVENTS_CSV"):
+        events = pd.read_csv(os.getenv("EVENTS_CSV"))
+    else:
+        events = pd.concat(load_events(engine), ignore_index=True)
+
+    report = run_benchmark(
+        catalog,
+        events,
+        k=10,
+        n_jobs=int(os.getenv("BENCHMARK_JOBS", "1")),
+        output=os.getenv("BENCHMARK_REPORT", "benchmark_report.json"),
+    )
+
+    best = select_config(report, min_recall=0.95)
+    if best is None:
+        print("⚠️ Жодна конфігурація не проходить поріг recall ≥ 0.95")
+    else:
+        print(f"✅ Найшвидша конфігурація з recall ≥ 0.95: {best['name']} "
+              f"({best['batch_ms_per_query']:.4f} мс/запит)")
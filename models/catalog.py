@@ -0,0 +1,405 @@
+import os
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+
+# Колонки каталогу, які тримає рекомендер (фільтри + результати)
+CATALOG_COLUMNS = [
+    'id', 'name', 'type', 'model', 'guests', 'cabins', 'crew', 'length', 'year', 'rating',
+    'summerLowSeasonPrice', 'summerHighSeasonPrice', 'winterLowSeasonPrice', 'winterHighSeasonPrice',
+    'baseMarina', 'country',
+]
+
+# Явні dtypes numeric колонок при завантаженні з БД (float64 — NULL-safe)
+CATALOG_NUMERIC_DTYPES = {
+    column: 'float64' for column in [
+        'guests', 'cabins', 'crew', 'length', 'year', 'rating',
+        'summerLowSeasonPrice', 'summerHighSeasonPrice', 'winterLowSeasonPrice', 'winterHighSeasonPrice',
+    ]
+}
+
+
+class YachtCatalog:
+    """
+    Колонковий каталог яхт
+
+    Numeric колонки — типізовані NumPy масиви, рядкові — pd.Categorical
+    (кожне значення зберігається один раз + int коди), 'id' — object масив.
+    Сторінка результатів збирається одним take по кожній колонці,
+    без копій усього DataFrame.
+    """
+
+    def __init__(self, columns=None):
+        """
+        Args:
+            columns: dict назва → масив (numeric ndarray / pd.Categorical / object ndarray)
+        """
+        self.columns = dict(columns or {})
+
+    @classmethod
+    def from_frame(cls, df, columns=CATALOG_COLUMNS):
+        """
+        Будує каталог з DataFrame, беручи тільки потрібні колонки
+
+        Args:
+            columns: які колонки залишити (None — всі колонки df)
+        """
+        names = [column for column in (columns or df.columns) if column in df.columns]
+        return cls({column: _to_column(column, df[column]) for column in names})
+
+    @classmethod
+    def from_sql(cls, engine, table='yachts', columns=CATALOG_COLUMNS, chunksize=50_000,
+                 where=None, params=None):
+        """
+        Завантажує каталог з БД частинами через server-side cursor
+
+        SELECT бере тільки колонки каталогу (без description / photos),
+        рядки читаються по chunksize (stream_results), а колонки каталогу
+        нарощуються по chunk-ах: пікова пам'ять — каталог + один chunk.
+
+        Args:
+            engine: SQLAlchemy engine (Postgres, SQLite, ...)
+            table: таблиця з яхтами
+            columns: які колонки завантажити
+            chunksize: рядків на один fetch
+            where: SQL умова (напр. '"updatedAt" > :since') з bind params
+        """
+        # Лапки зберігають camelCase назви колонок у Postgres
+        select_list = ', '.join(f'"{column}"' for column in columns)
+        query = f'SELECT {select_list} FROM "{table}"'
+        if where:
+            query = f"{query} WHERE {where}"
+        dtypes = {column: dtype for column, dtype in CATALOG_NUMERIC_DTYPES.items() if column in columns}
+
+        numeric_parts = {column: [] for column in columns if column in dtypes or column == 'id'}
+        categorical_parts = {column: [] for column in columns if column not in numeric_parts}
+        categories = {column: {} for column in categorical_parts}
+
+        with engine.connect().execution_options(stream_results=True, max_row_buffer=chunksize) as conn:
+            for chunk in pd.read_sql(text(query), conn, chunksize=chunksize, dtype=dtypes, params=params):
+                for column, parts in numeric_parts.items():
+                    parts.append(_to_column(column, chunk[column]))
+                for column, parts in categorical_parts.items():
+                    # Коди chunk-а → глобальні коди (lookup тільки по унікальних значеннях)
+                    codes, uniques = pd.factorize(chunk[column].astype(object))
+                    lookup = categories[column]
+                    mapping = np.array(
+                        [lookup.setdefault(str(value), len(lookup)) for value in uniques] + [-1],
+                        dtype=np.int32
+                    )
+                    parts.append(mapping[codes])
+
+        catalog = {}
+        for column in columns:
+            if column in numeric_parts:
+                parts = numeric_parts[column]
+                catalog[column] = np.concatenate(parts) if parts else np.empty(0, dtype=np.float64)
+            else:
+                parts = categorical_parts[column]
+                catalog[column] = pd.Categorical.from_codes(
+                    np.concatenate(parts) if parts else np.empty(0, dtype=np.int32),
+                    categories=list(categories[column])
+                )
+
+        catalog = cls(catalog)
+        print(f"✅ Завантажено {len(catalog)} яхт з таблиці {table} (chunksize={chunksize})")
+        return catalog
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    @property
+    def nbytes(self):
+        total = 0
+        for values in self.columns.values():
+            if isinstance(values, pd.Categorical):
+                total += values.codes.nbytes + values.categories.memory_usage(deep=True)
+            else:
+                total += values.nbytes
+        return int(total)
+
+    def take(self, indices):
+        """
+        Рядки indices як DataFrame (index = номери рядків каталогу)
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return pd.DataFrame(
+            {column: values[indices] for column, values in self.columns.items()},
+            index=indices,
+            copy=False
+        )
+
+    def to_frame(self):
+        """
+        Весь каталог як DataFrame (колонки не копіюються)
+        """
+        return pd.DataFrame(self.columns, copy=False)
+
+    def subset(self, indices):
+        """
+        Новий каталог тільки з рядками indices (для compact())
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return YachtCatalog({column: values[indices] for column, values in self.columns.items()})
+
+    def group_indices(self, column):
+        """
+        dict значення → відсортовані рядки (як df.groupby(column).indices)
+        """
+        values = self.columns[column]
+        if not isinstance(values, pd.Categorical):
+            return pd.Series(values).groupby(values, sort=False).indices
+
+        codes = values.codes
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(values.categories) + 1))
+        return {
+            category: order[bounds[code]:bounds[code + 1]]
+            for code, category in enumerate(values.categories)
+            if bounds[code + 1] > bounds[code]
+        }
+
+    def codes(self, column, values=None):
+        """
+        Коди рядків categorical колонки, або (якщо задано values) коди
+        цих значень (-1 — значення немає в каталозі)
+        """
+        categories = self.columns[column].categories
+        if values is None:
+            return self.columns[column].codes
+        return categories.get_indexer(pd.Index(list(values), dtype=object))
+
+    def append(self, df):
+        """
+        Додає рядки df в кінець каталогу (колонки, яких немає в df, → NaN)
+        """
+        for column, values in self.columns.items():
+            if column in df.columns:
+                new_values = _to_column(column, df[column], like=values)
+            else:
+                new_values = _to_column(column, pd.Series([None] * len(df), dtype=object), like=values)
+
+            if isinstance(values, pd.Categorical):
+                values, new_codes = _with_categories(values, new_values)
+                self.columns[column] = pd.Categorical.from_codes(
+                    np.concatenate([values.codes, new_codes]), dtype=values.dtype
+                )
+            else:
+                self.columns[column] = np.concatenate([values, new_values.astype(
+                    np.result_type(values.dtype, new_values.dtype)
+                )])
+        return self
+
+    def update(self, indices, df):
+        """
+        Переписує значення колонок df (крім 'id') у рядках indices.
+        Нова категорія або float значення в int колонці змінюють тип колонки.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        for column in df.columns:
+            if column == 'id' or column not in self.columns:
+                continue
+            values = self.columns[column]
+            new_values = _to_column(column, df[column], like=values)
+
+            if isinstance(values, pd.Categorical):
+                values, new_codes = _with_categories(values, new_values)
+                codes = np.array(values.codes)
+                codes[indices] = new_codes
+                values = pd.Categorical.from_codes(codes, dtype=values.dtype)
+            else:
+                # mmap масиви read-only, а зміна dtype все одно потребує копії
+                values = values.astype(np.result_type(values.dtype, new_values.dtype), copy=True)
+                values[indices] = new_values
+            self.columns[column] = values
+        return self
+
+    def save(self, path):
+        """
+        Зберігає колонки (крім 'id') у path/*.npy
+
+        Returns:
+            JSON-сумісний опис колонок для metadata.json
+        """
+        os.makedirs(path, exist_ok=True)
+        spec = {}
+        for column, values in self.columns.items():
+            if column == 'id':
+                continue
+            if isinstance(values, pd.Categorical):
+                np.save(os.path.join(path, f"{column}.npy"), values.codes.astype(np.int32))
+                spec[column] = {
+                    'kind': 'categorical',
+                    'categories': [str(value) for value in values.categories]
+                }
+            else:
+                np.save(os.path.join(path, f"{column}.npy"), np.ascontiguousarray(values))
+                spec[column] = {'kind': 'numeric'}
+        return spec
+
+    @classmethod
+    def load(cls, path, spec, ids=None, mmap=True):
+        """
+        Завантажує каталог, збережений save()
+
+        Args:
+            spec: опис колонок з save()
+            ids: масив ID яхт (зберігається окремо від каталогу)
+            mmap: numeric колонки та коди відкриваються через mmap (read-only)
+        """
+        columns = {} if ids is None else {'id': ids}
+        for column, column_spec in spec.items():
+            values = np.load(os.path.join(path, f"{column}.npy"), mmap_mode='r' if mmap else None)
+            if column_spec['kind'] == 'categorical':
+                values = pd.Categorical.from_codes(values, categories=column_spec['categories'])
+            columns[column] = values
+        return cls(columns)
+
+
+class IdIndex(Mapping):
+    """
+    ID яхти → рядок каталогу (read-only mapping замість dict)
+
+    Тримає посилання на масиви ids і removed, нічого не копіюючи: хеш-таблиця
+    pd.Index будується при першому пошуку, тому load_model() не проходить
+    ID поелементно. rows() шукає масив ID одним get_indexer. Видалені яхти
+    (tombstones у removed) в mapping відсутні.
+    """
+
+    def __init__(self, ids, removed=None):
+        """
+        Args:
+            ids: масив ID яхт (рядок = позиція)
+            removed: bool масив tombstones (None — видалених немає)
+        """
+        self.ids = ids
+        self.removed = removed
+        self._index = None
+        self._positions = None
+
+    def _lookup(self):
+        if self._index is None:
+            index = pd.Index(self.ids)
+            if index.is_unique:
+                self._positions = np.arange(len(index))
+            else:
+                # Як у dict {id: row}: для повторного ID — останній рядок
+                keep = ~index.duplicated(keep='last')
+                index, self._positions = index[keep], np.flatnonzero(keep)
+            self._index = index
+        return self._index
+
+    def rows(self, ids):
+        """
+        Рядки для масиву ID (-1 — невідомий або видалений ID)
+        """
+        index = self._lookup()
+        found = index.get_indexer(pd.Index(list(ids), dtype=object))
+        hit = np.flatnonzero(found >= 0)
+        rows = np.full(len(found), -1, dtype=np.int64)
+        rows[hit] = self._positions[found[hit]]
+        if self.removed is not None:
+            rows[hit[self.removed[rows[hit]]]] = -1
+        return rows
+
+    def __getitem__(self, yacht_id):
+        index = self._lookup()
+        row = int(self._positions[index.get_loc(yacht_id)])
+        if self.removed is not None and self.removed[row]:
+            raise KeyError(yacht_id)
+        return row
+
+    def _alive(self):
+        if self.removed is None:
+            return np.arange(len(self.ids))
+        return np.flatnonzero(~self.removed)
+
+    def __iter__(self):
+        return iter(np.asarray(self.ids)[self._alive()].tolist())
+
+    def __len__(self):
+        if self.removed is None:
+            return len(self.ids)
+        return len(self.ids) - int(np.count_nonzero(self.removed))
+
+    def items(self):
+        alive = self._alive()
+        return zip(np.asarray(self.ids)[alive].tolist(), alive.tolist())
+
+    @property
+    def by_row(self):
+        """
+        Зворотний mapping: рядок → ID яхти (без видалених)
+        """
+        return RowIds(self)
+
+
+class RowIds(Mapping):
+    """
+    Рядок каталогу → ID яхти поверх IdIndex (read-only)
+    """
+
+    def __init__(self, id_index):
+        self.id_index = id_index
+
+    def __getitem__(self, row):
+        ids, removed = self.id_index.ids, self.id_index.removed
+        if not isinstance(row, (int, np.integer)) or not 0 <= row < len(ids) or (
+                removed is not None and removed[row]):
+            raise KeyError(row)
+        return ids[row]
+
+    def __iter__(self):
+        return iter(self.id_index._alive().tolist())
+
+    def __len__(self):
+        return len(self.id_index)
+
+
+def _to_column(column, values, like=None):
+    """
+    Конвертує колонку DataFrame у представлення каталогу
+
+    Args:
+        like: існуюча колонка каталогу — нові значення приводяться до її виду
+    """
+    if column == 'id':
+        return values.to_numpy(dtype=object)
+
+    if like is not None:
+        numeric = not isinstance(like, pd.Categorical)
+    else:
+        numeric = pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)
+
+    if numeric:
+        # Звичайні numpy dtypes залишаються як є (int32 не роздувається до int64)
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'iuf':
+            return values.to_numpy()
+        return pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+
+    values = values.astype(object).where(values.notna(), None)
+    return pd.Categorical(values)
+
+
+def _with_categories(values, new_values):
+    """
+    Розширює категорії колонки новими значеннями
+
+    Returns:
+        (колонка з розширеними категоріями, коди new_values у ній)
+    """
+    new_values = pd.Index(np.asarray(new_values, dtype=object), dtype=object)
+    missing = new_values.dropna().unique().difference(pd.Index(values.categories, dtype=object))
+    if len(missing):
+        values = values.add_categories(missing)
+    return values, values.categories.get_indexer(new_values)
@@ -0,0 +1,223 @@
+import io
+import numpy as np
+from sqlalchemy import text
+
+from catalog import YachtCatalog
+
+
+# Таблиця з рекомендаціями холодного старту (yacht_id uuid, cold_recommendations uuid[])
+COLD_RECOMMENDATIONS_TABLE = 'cold_recommendations'
+
+# Скільки рядків відправляється одним COPY chunk-ом
+COPY_CHUNK_ROWS = 50_000
+
+
+def write_cold_recommendations(engine, yacht_ids, neighbor_ids, table=COLD_RECOMMENDATIONS_TABLE,
+                               mode='swap', delete_missing=False, chunk_rows=COPY_CHUNK_ROWS):
+    """
+    Bulk-запис cold_recommendations (yacht_id uuid, cold_recommendations uuid[]),
+    див. write_recommendations
+    """
+    return write_recommendations(
+        engine, yacht_ids, neighbor_ids, table=table, key_column='yacht_id',
+        value_column='cold_recommendations', mode=mode, delete_missing=delete_missing, chunk_rows=chunk_rows
+    )
+
+
+def write_recommendations(engine, ids, neighbor_ids, table, key_column, value_column,
+                          mode='swap', delete_missing=False, chunk_rows=COPY_CHUNK_ROWS):
+    """
+    Bulk-запис рекомендацій у Postgres через COPY FROM STDIN
+
+    Рекомендації зберігаються як нативний uuid[] — читачам не потрібно
+    парсити рядок виду "['...', '...']".
+
+    Args:
+        engine: SQLAlchemy engine (драйвер psycopg2 або psycopg 3)
+        ids: масив ID (uuid) яхт або користувачів (n,)
+        neighbor_ids: масив ID рекомендованих яхт (n × k), рядок i — для ids[i]
+        table: цільова таблиця
+        key_column, value_column: колонки uuid PRIMARY KEY та uuid[]
+        mode: 'swap' — повний refresh: COPY у staging таблицю, яка потім
+                однією транзакцією підміняє цільову (читачі ніколи не бачать
+                порожню таблицю);
+              'upsert' — COPY у тимчасову таблицю і INSERT ... ON CONFLICT
+                тільки для рядків, у яких список сусідів змінився
+        delete_missing: (upsert) видалити рядки, яких немає в ids
+        chunk_rows: рядків на один COPY chunk (обмежує пам'ять буфера)
+
+    Returns:
+        кількість записаних (swap) або змінених (upsert) рядків
+    """
+    if mode not in ('swap', 'upsert'):
+        raise ValueError(f"Невідомий mode: {mode} (очікується 'swap' або 'upsert')")
+    if len(ids) != len(neighbor_ids):
+        raise ValueError(
+            f"ids ({len(ids)}) і neighbor_ids ({len(neighbor_ids)}) мають різну довжину"
+        )
+
+    columns = (key_column, value_column)
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        if mode == 'swap':
+            n_rows = _swap_load(cursor, ids, neighbor_ids, table, columns, chunk_rows)
+        else:
+            n_rows = _upsert_load(cursor, ids, neighbor_ids, table, columns, delete_missing, chunk_rows)
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()  # обов’язково закрити!
+
+    print(f"✅ {table}: {'записано' if mode == 'swap' else 'оновлено'} {n_rows} рядків ({mode})")
+    return n_rows
+
+
+def refresh_changed_recommendations(engine, recommender, since=None, table='yachts',
+                                    target_table=COLD_RECOMMENDATIONS_TABLE, top_k=None):
+    """
+    Delta job: яхти зі зміненим updatedAt → перерахунок тільки зачеплених списків
+
+    Нові яхти додаються (add_yachts), існуючі оновлюються (update_yachts);
+    рекомендер через reverse index перераховує списки цих яхт і списки,
+    де вони є або мають з'явитись. Тільки ці рядки пишуться upsert-ом.
+
+    Args:
+        engine: SQLAlchemy engine
+        recommender: натренований YachtRecommender (з таблицею сусідів)
+        since: watermark попереднього запуску (None — всі яхти)
+        top_k: скільки рекомендацій записувати (за замовчуванням — ширина таблиці)
+
+    Returns:
+        новий watermark (max updatedAt) для наступного запуску
+    """
+    if recommender.neighbor_indices is None:
+        recommender.build_neighbor_table(top_k or 20)
+    top_k = top_k or recommender.neighbor_indices.shape[1]
+
+    # Верхня межа фіксується до вибірки: рядки, змінені під час job-а,
+    # потраплять у наступний запуск
+    with engine.connect() as conn:
+        watermark = conn.execute(text(f'SELECT max("updatedAt") FROM "{table}"')).scalar()
+    if watermark is None or (since is not None and watermark <= since):
+        print("✅ Змінених яхт немає")
+        return since
+
+    where = '"updatedAt" <= :watermark'
+    params = {'watermark': watermark}
+    if since is not None:
+        where = f'"updatedAt" > :since AND {where}'
+        params['since'] = since
+    changed = YachtCatalog.from_sql(engine, table=table, where=where, params=params).to_frame()
+
+    # Попередні позначки не належать цьому запуску
+    recommender.pop_changed_lists()
+
+    is_known = recommender.yacht_id_to_idx.rows(changed['id']) >= 0
+    recommender.update_yachts(changed[is_known])
+    recommender.add_yachts(changed[~is_known])
+
+    rows = recommender.pop_changed_lists()
+    write_cold_recommendations(
+        engine,
+        recommender.yacht_ids[rows],
+        recommender.yacht_ids[recommender.neighbor_indices[rows, :top_k]],
+        table=target_table,
+        mode='upsert'
+    )
+
+    print(f"✅ Delta: {len(changed)} змінених яхт → {len(rows)} перерахованих списків")
+    return watermark
+
+
+def _swap_load(cursor, ids, neighbor_ids, table, columns, chunk_rows):
+    """
+    COPY у staging таблицю + атомарна підміна цільової (DDL в Postgres транзакційний)
+    """
+    staging = f"{table}_staging"
+    key_column, value_column = columns
+
+    cursor.execute(f'DROP TABLE IF EXISTS "{staging}"')
+    cursor.execute(f'CREATE TABLE "{staging}" ({key_column} uuid NOT NULL, {value_column} uuid[] NOT NULL)')
+    _copy_chunks(
+        cursor,
+        f'COPY "{staging}" ({key_column}, {value_column}) FROM STDIN',
+        _copy_text_chunks(ids, neighbor_ids, chunk_rows)
+    )
+    # Індекс будується один раз після завантаження — швидше, ніж під час COPY
+    cursor.execute(f'ALTER TABLE "{staging}" ADD CONSTRAINT "{staging}_pkey" PRIMARY KEY ({key_column})')
+
+    # Читачі чекають на lock лише на час rename і бачать стару або нову таблицю
+    cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
+    cursor.execute(f'ALTER TABLE "{staging}" RENAME TO "{table}"')
+    cursor.execute(f'ALTER TABLE "{table}" RENAME CONSTRAINT "{staging}_pkey" TO "{table}_pkey"')
+
+    return len(ids)
+
+
+def _upsert_load(cursor, ids, neighbor_ids, table, columns, delete_missing, chunk_rows):
+    """
+    COPY у тимчасову таблицю + upsert тільки змінених списків
+    """
+    staging = f"{table}_delta"
+    key_column, value_column = columns
+
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS "{table}" '
+        f'({key_column} uuid PRIMARY KEY, {value_column} uuid[] NOT NULL)'
+    )
+    cursor.execute(
+        f'CREATE TEMP TABLE "{staging}" ({key_column} uuid NOT NULL, {value_column} uuid[] NOT NULL) '
+        f'ON COMMIT DROP'
+    )
+    _copy_chunks(
+        cursor,
+        f'COPY "{staging}" ({key_column}, {value_column}) FROM STDIN',
+        _copy_text_chunks(ids, neighbor_ids, chunk_rows)
+    )
+
+    cursor.execute(
+        f'INSERT INTO "{table}" AS target ({key_column}, {value_column}) '
+        f'SELECT {key_column}, {value_column} FROM "{staging}" '
+        f'ON CONFLICT ({key_column}) DO UPDATE SET {value_column} = EXCLUDED.{value_column} '
+        f'WHERE target.{value_column} IS DISTINCT FROM EXCLUDED.{value_column}'
+    )
+    n_changed = max(cursor.rowcount, 0)
+
+    if delete_missing:
+        cursor.execute(
+            f'DELETE FROM "{table}" AS target WHERE NOT EXISTS '
+            f'(SELECT 1 FROM "{staging}" AS delta WHERE delta.{key_column} = target.{key_column})'
+        )
+        n_changed += max(cursor.rowcount, 0)
+
+    return n_changed
+
+
+def _copy_text_chunks(ids, neighbor_ids, chunk_rows):
+    """
+    Рядки у COPY text форматі (id TAB {uuid,uuid,...}) по chunk_rows за раз
+    """
+    for start in range(0, len(ids), chunk_rows):
+        lines = []
+        for key, neighbors in zip(ids[start:start + chunk_rows], neighbor_ids[start:start + chunk_rows]):
+            neighbors = ','.join(str(neighbor) for neighbor in np.asarray(neighbors, dtype=object))
+            lines.append(f"{key}\t{{{neighbors}}}\n")
+        yield ''.join(lines)
+
+
+def _copy_chunks(cursor, statement, chunks):
+    """
+    COPY FROM STDIN для psycopg2 (copy_expert) або psycopg 3 (cursor.copy)
+    """
+    if hasattr(cursor, 'copy_expert'):
+        for chunk in chunks:
+            cursor.copy_expert(statement, io.StringIO(chunk))
+    elif hasattr(cursor, 'copy'):
+        with cursor.copy(statement) as copy:
+            for chunk in chunks:
+                copy.write(chunk)
+    else:
+        raise ValueError("COPY FROM STDIN підтримується тільки з драйверами psycopg2 / psycopg")
@@ -0,0 +1,360 @@
+import os
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+import dotenv
+
+from events import EVENT_WEIGHTS, load_events
+from model_store import atomic_directory, save_array, load_array, save_ids, load_ids, write_metadata, read_metadata
+
+dotenv.load_dotenv()
+
+
+# Версія формату директорії індексу (save / load)
+COOCCURRENCE_FORMAT_VERSION = 1
+
+# Таблиця "користувачі, які дивились X, також дивились Y"
+# (yacht_id uuid, cooccurrence_recommendations uuid[])
+COOCCURRENCE_TABLE = 'cooccurrence_recommendations'
+
+
+class CooccurrenceIndex:
+    """
+    Item-item індекс "користувачі, які взаємодіяли з X, також взаємодіяли з Y"
+
+    Події обробляються потоком у порядку часу: кожна нова подія утворює пари
+    з останніми window_size подіями того ж користувача за window_days, вага
+    пари — min(ваги двох подій). Для кожної яхти зберігаються тільки
+    capacity найсильніших сусідів (фіксовані масиви n_yachts × capacity,
+    відсортовані за спаданням), тому пам'ять не залежить від кількості
+    подій, а top-N читається одним зрізом рядка. Хвіст слабких пар
+    відкидається — лічильники наближені для сусідів поза capacity.
+
+    Стан між запусками — останні події кожного активного користувача,
+    тож update() обробляє тільки нові події без повторного скану історії.
+    """
+
+    def __init__(self, yacht_ids=None, window_size=20, window_days=30, top_n=20, capacity=None):
+        """
+        Args:
+            yacht_ids: відомі ID яхт (нові яхти з подій додаються автоматично)
+            window_size: скільки останніх подій користувача утворюють пари з новою
+            window_days: максимальний проміжок між подіями пари
+            top_n: скільки сусідів повертається за замовчуванням
+            capacity: скільки сусідів зберігається на яхту (за замовчуванням 4 × top_n)
+        """
+        self.window_size = window_size
+        self.window_days = window_days
+        self.top_n = top_n
+        self.capacity = capacity or 4 * top_n
+        self.yacht_ids = np.empty(0, dtype=object)
+        self.yacht_id_to_idx = {}
+        self.neighbors = np.empty((0, self.capacity), dtype=np.int32)  # -1 — порожній слот
+        self.scores = np.empty((0, self.capacity), dtype=np.float32)
+        # Стан: останні події активних користувачів (плоскі масиви, коди користувачів)
+        self.user_ids = np.empty(0, dtype=object)
+        self.user_id_to_idx = {}
+        self.recent_users = np.empty(0, dtype=np.int64)
+        self.recent_yachts = np.empty(0, dtype=np.int64)
+        self.recent_weights = np.empty(0, dtype=np.float32)
+        self.recent_timestamps = np.empty(0, dtype=np.float64)
+        self.watermark = None       # max createdAt оброблених подій
+        self.changed = np.zeros(0, dtype=bool)  # яхти зі зміненими сусідами після pop_changed()
+        if yacht_ids is not None:
+            self._add_yachts(yacht_ids)
+
+    def _add_yachts(self, yacht_ids):
+        """
+        Додає рядки для нових яхт і повертає їхні індекси
+        """
+        new_ids = [yacht_id for yacht_id in dict.fromkeys(yacht_ids) if yacht_id not in self.yacht_id_to_idx]
+        start = len(self.yacht_ids)
+        for offset, yacht_id in enumerate(new_ids):
+            self.yacht_id_to_idx[yacht_id] = start + offset
+        self.yacht_ids = np.concatenate([self.yacht_ids, np.array(new_ids, dtype=object)])
+        self.neighbors = np.vstack([self.neighbors, np.full((len(new_ids), self.capacity), -1, dtype=np.int32)])
+        self.scores = np.vstack([self.scores, np.zeros((len(new_ids), self.capacity), dtype=np.float32)])
+        self.changed = np.concatenate([self.changed, np.zeros(len(new_ids), dtype=bool)])
+        return np.arange(start, start + len(new_ids))
+
+    def update(self, events):
+        """
+        Обробляє нові події (DataFrame або ітератор chunk-ів у порядку часу)
+
+        Returns:
+            кількість нових пар
+        """
+        if isinstance(events, pd.DataFrame):
+            events = [events]
+
+        n_pairs = 0
+        for chunk in events:
+            if len(chunk):
+                n_pairs += self._update_chunk(chunk)
+        return n_pairs
+
+    def _update_chunk(self, chunk):
+        """
+        Пари подій chunk-а між собою та зі станом + новий стан вікон
+        """
+        # Після load(mmap=True) масиви read-only
+        if not self.neighbors.flags.writeable:
+            self.neighbors = np.array(self.neighbors)
+            self.scores = np.array(self.scores)
+
+        if 'weight' in chunk.columns:
+            weights = pd.to_numeric(chunk['weight'], errors='coerce').to_numpy(dtype=np.float32)
+        else:
+            weights = chunk['type'].map(EVENT_WEIGHTS).to_numpy(dtype=np.float32)
+        created_at = pd.to_datetime(chunk['createdAt'], utc=True)
+        timestamps = (created_at - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+
+        codes, uniques = pd.factorize(chunk['yachtId'])
+        unknown = [value for value in uniques if value not in self.yacht_id_to_idx]
+        if unknown:
+            self._add_yachts(unknown)
+        yachts = np.array([self.yacht_id_to_idx[value] for value in uniques], dtype=np.int64)[codes]
+
+        codes, uniques = pd.factorize(chunk['userId'])
+        new_users = [value for value in uniques if value not in self.user_id_to_idx]
+        for offset, user_id in enumerate(new_users):
+            self.user_id_to_idx[user_id] = len(self.user_ids) + offset
+        self.user_ids = np.concatenate([self.user_ids, np.array(new_users, dtype=object)])
+        user_codes = np.array([self.user_id_to_idx[value] for value in uniques] + [-1], dtype=np.int64)[codes]
+        keep = np.isfinite(weights) & (user_codes >= 0)
+
+        # + збережені останні події цих користувачів (пари нових зі старими)
+        in_chunk = np.zeros(len(self.user_ids), dtype=bool)
+        in_chunk[user_codes[keep]] = True
+        old = in_chunk[self.recent_users]
+        user_codes, yachts, weights, timestamps = (
+            np.concatenate([new[keep], state[old]]) for new, state in (
+                (user_codes, self.recent_users), (yachts, self.recent_yachts),
+                (weights, self.recent_weights), (timestamps, self.recent_timestamps),
+            )
+        )
+        is_new = np.arange(len(user_codes)) < keep.sum()
+        if not len(user_codes):
+            return 0
+
+        order = np.lexsort((timestamps, user_codes))
+        user_codes, yachts, weights, timestamps, is_new = (
+            user_codes[order], yachts[order], weights[order], timestamps[order], is_new[order]
+        )
+
+        # Пари з d-ю попередньою подією того ж користувача, векторизовано по d
+        window_seconds = self.window_days * 86400.0
+        sources, targets, pair_weights = [], [], []
+        n_pairs = 0
+        for d in range(1, self.window_size + 1):
+            later = np.arange(d, len(yachts))
+            earlier = later - d
+            same_user = user_codes[later] == user_codes[earlier]
+            # Події відсортовані за користувачем: немає пар на відстані d — немає і далі
+            if not same_user.any():
+                break
+            valid = (
+                same_user
+                & (is_new[later] | is_new[earlier])
+                & (timestamps[later] - timestamps[earlier] <= window_seconds)
+                & (yachts[later] != yachts[earlier])
+            )
+            later, earlier = later[valid], earlier[valid]
+            n_pairs += len(later)
+            pair_weight = np.minimum(weights[later], weights[earlier])
+            # Симетрично: X → Y і Y → X
+            sources += [yachts[later], yachts[earlier]]
+            targets += [yachts[earlier], yachts[later]]
+            pair_weights += [pair_weight, pair_weight]
+
+        if n_pairs:
+            self._merge_pairs(np.concatenate(sources), np.concatenate(targets), np.concatenate(pair_weights))
+
+        # Останні window_size подій кожного користувача → стан
+        group_ends = np.searchsorted(user_codes, user_codes, side='right')
+        tail = group_ends - np.arange(len(user_codes)) <= self.window_size
+        self.recent_users, self.recent_yachts, self.recent_weights, self.recent_timestamps = (
+            np.concatenate([state[~old], values[tail]]) for state, values in (
+                (self.recent_users, user_codes), (self.recent_yachts, yachts),
+                (self.recent_weights, weights), (self.recent_timestamps, timestamps),
+            )
+        )
+        self._prune(timestamps.max() - window_seconds)
+
+        latest = created_at.max()
+        self.watermark = latest if self.watermark is None else max(self.watermark, latest)
+        return n_pairs
+
+    def _merge_pairs(self, sources, targets, weights):
+        """
+        Додає ваги пар до рядків sources і залишає capacity найсильніших сусідів
+
+        Всі зачеплені рядки зливаються одним сортуванням: поточні сусіди +
+        нові пари → сума по (яхта, сусід) → перші capacity у кожному рядку.
+        """
+        rows = np.unique(sources)
+        current = self.neighbors[rows]
+        filled = current >= 0
+        sources = np.concatenate([np.repeat(rows, filled.sum(axis=1)), sources])
+        targets = np.concatenate([current[filled], targets])
+        weights = np.concatenate([self.scores[rows][filled], weights])
+
+        n_yachts = len(self.yacht_ids)
+        codes, inverse = np.unique(sources * n_yachts + targets, return_inverse=True)
+        sums = np.bincount(inverse, weights=weights)
+        sources, targets = np.divmod(codes, n_yachts)
+
+        # Ранг сусіда всередині рядка за спаданням ваги
+        order = np.lexsort((-sums, sources))
+        sources, targets, sums = sources[order], targets[order], sums[order]
+        group_starts = np.searchsorted(sources, sources, side='left')
+        ranks = np.arange(len(sources)) - group_starts
+        top = ranks < self.capacity
+
+        self.neighbors[rows] = -1
+        self.scores[rows] = 0
+        self.neighbors[sources[top], ranks[top]] = targets[top]
+        self.scores[sources[top], ranks[top]] = sums[top]
+        self.changed[rows] = True
+
+    def _prune(self, oldest):
+        """
+        Видаляє зі стану події, старші за oldest (секунди): вони вже не
+        утворять пар з новими подіями. Коди користувачів без подій
+        перенумеровуються, коли їх стає більше, ніж активних.
+        """
+        fresh = self.recent_timestamps >= oldest
+        if not fresh.all():
+            self.recent_users = self.recent_users[fresh]
+            self.recent_yachts = self.recent_yachts[fresh]
+            self.recent_weights = self.recent_weights[fresh]
+            self.recent_timestamps = self.recent_timestamps[fresh]
+
+        active, self.recent_users = np.unique(self.recent_users, return_inverse=True)
+        if len(self.user_ids) > 2 * len(active) + 1024:
+            self.user_ids = self.user_ids[active]
+            self.user_id_to_idx = {user_id: idx for idx, user_id in enumerate(self.user_ids)}
+        else:
+            self.recent_users = active[self.recent_users]
+
+    def pop_changed(self):
+        """
+        Індекси яхт, чиї сусіди змінились після попереднього виклику
+        """
+        changed = np.flatnonzero(self.changed)
+        self.changed[:] = False
+        return changed
+
+    def similar(self, yacht_id, top_n=None):
+        """
+        Сусіди яхти: (neighbor_ids, scores), відсортовані за спаданням
+        (порожні, якщо яхта невідома)
+        """
+        idx = self.yacht_id_to_idx.get(yacht_id)
+        if idx is None:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.float32)
+        neighbors = self.neighbors[idx, :top_n or self.top_n]
+        neighbors = neighbors[neighbors >= 0]
+        return self.yacht_ids[neighbors], self.scores[idx, :len(neighbors)]
+
+    def save(self, path='yacht_cooccurrence_index'):
+        """
+        Зберігає індекс і стан вікон користувачів як директорію .npy
+        (neighbors / scores відкриваються через mmap)
+        """
+        path = os.path.abspath(path)
+        with atomic_directory(path) as tmp_path:
+            save_array(tmp_path, 'neighbors', self.neighbors)
+            save_array(tmp_path, 'scores', self.scores)
+
+            # Стан: тільки користувачі з подіями у вікні
+            active, recent_users = np.unique(self.recent_users, return_inverse=True)
+            save_array(tmp_path, 'recent_users', recent_users.astype(np.int64))
+            save_array(tmp_path, 'recent_yachts', self.recent_yachts)
+            save_array(tmp_path, 'recent_weights', self.recent_weights)
+            save_array(tmp_path, 'recent_timestamps', self.recent_timestamps)
+
+            id_types = {name: save_ids(tmp_path, name, ids)
+                        for name, ids in (('yacht_ids', self.yacht_ids), ('user_ids', self.user_ids[active]))}
+
+            write_metadata(tmp_path, {
+                'format_version': COOCCURRENCE_FORMAT_VERSION,
+                'id_types': id_types,
+                'params': {
+                    'window_size': self.window_size,
+                    'window_days': self.window_days,
+                    'top_n': self.top_n,
+                    'capacity': self.capacity,
+                },
+                'watermark': None if self.watermark is None else self.watermark.isoformat(),
+            })
+
+        print(f"✅ Co-occurrence індекс збережено у {path}")
+
+    @classmethod
+    def load(cls, path='yacht_cooccurrence_index', mmap=True):
+        """
+        Завантажує індекс, збережений save()
+
+        Args:
+            mmap: neighbors / scores через mmap (read-only; перший update() копіює їх)
+        """
+        metadata = read_metadata(path)
+
+        if metadata.get('format_version') != COOCCURRENCE_FORMAT_VERSION:
+            raise ValueError(
+                f"Непідтримувана версія формату індексу: {metadata.get('format_version')} "
+                f"(очікується {COOCCURRENCE_FORMAT_VERSION})"
+            )
+
+        index = cls(**metadata['params'])
+        index.yacht_ids = load_ids(path, 'yacht_ids', metadata['id_types']['yacht_ids'], mmap=False)
+        index.yacht_id_to_idx = {yacht_id: idx for idx, yacht_id in enumerate(index.yacht_ids)}
+        index.neighbors = load_array(path, 'neighbors', mmap=mmap)
+        index.scores = load_array(path, 'scores', mmap=mmap)
+        index.changed = np.zeros(len(index.yacht_ids), dtype=bool)
+        if metadata['watermark'] is not None:
+            index.watermark = pd.Timestamp(metadata['watermark'])
+
+        index.user_ids = load_ids(path, 'user_ids', metadata['id_types']['user_ids'], mmap=False)
+        index.user_id_to_idx = {user_id: idx for idx, user_id in enumerate(index.user_ids)}
+        index.recent_users = load_array(path, 'recent_users', mmap=False)
+        index.recent_yachts = load_array(path, 'recent_yachts', mmap=False)
+        index.recent_weights = load_array(path, 'recent_weights', mmap=False)
+        index.recent_timestamps = load_array(path, 'recent_timestamps', mmap=False)
+
+        print(f"✅ Co-occurrence індекс завантажено з {path}")
+        return index
+
+
+# ============================================
+# ВИКОРИСТАННЯ (інкрементальний job)
+# ============================================
+
+if __name__ == "__main__":
+    from cold_recommendations import write_recommendations
+
+    engine = create_engine(os.getenv("DB_STRING"))
+    index_path = os.getenv("COOCCURRENCE_INDEX_PATH", "yacht_cooccurrence_index")
+
+    # Стан попереднього запуску: обробляються тільки події після watermark
+    if os.path.exists(os.path.join(index_path, 'metadata.json')):
+        index = CooccurrenceIndex.load(index_path)
+    else:
+        index = CooccurrenceIndex()
+    since = None if index.watermark is None else index.watermark.to_pydatetime()
+
+    n_pairs = index.update(load_events(engine, since=since))
+    index.save(index_path)
+
+    rows = index.pop_changed()
+    print(f"✅ {n_pairs} нових пар → {len(rows)} яхт зі зміненими сусідами")
+
+    neighbor_lists = [index.similar(yacht_id)[0] for yacht_id in index.yacht_ids[rows]]
+    try:
+        write_recommendations(
+            engine, index.yacht_ids[rows], neighbor_lists, table=COOCCURRENCE_TABLE,
+            key_column='yacht_id', value_column='cooccurrence_recommendations', mode='upsert'
+        )
+    except Exception as e:
+        print(f"❌ Помилка під час завантаження в базу даних: {e}")
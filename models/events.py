@@ -0,0 +1,139 @@
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sqlalchemy import text
+
+
+# Ваги типів подій (як EVENT_TYPES у generating/event_generator.py) —
+# використовуються, якщо в подіях немає колонки 'weight'
+EVENT_WEIGHTS = {
+    'view': 2,
+    'wishlist': 4,
+    'chat_owner': 6,
+    'start_booking': 8,
+    'book': 10
+}
+
+# Колонки таблиці подій (назва таблиці — env EVENTS_TABLE, за замовчуванням events)
+EVENT_COLUMNS = ['userId', 'yachtId', 'type', 'weight', 'createdAt']
+
+
+def load_events(engine, table=None, since=None, chunksize=200_000):
+    """
+    Події з БД частинами через server-side cursor (генератор DataFrame chunk-ів)
+
+    Args:
+        engine: SQLAlchemy engine
+        table: таблиця подій (None — env EVENTS_TABLE на момент виклику, тобто
+            після dotenv.load_dotenv(); за замовчуванням events)
+        since: тільки події з createdAt > since (напр. вікно активних користувачів)
+        chunksize: рядків на один fetch
+    """
+    table = table or os.getenv('EVENTS_TABLE', 'events')
+    select_list = ', '.join(f'"{column}"' for column in EVENT_COLUMNS)
+    query = f'SELECT {select_list} FROM "{table}"'
+    params = None
+    if since is not None:
+        query = f'{query} WHERE "createdAt" > :since'
+        params = {'since': since}
+    query = f'{query} ORDER BY "createdAt"'
+
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=chunksize) as conn:
+        yield from pd.read_sql(text(query), conn, chunksize=chunksize, params=params)
+
+
+def build_interaction_matrix(events, yacht_id_to_idx, user_ids=None, half_life_days=None, now=None,
+                             n_yachts=None):
+    """
+    Sparse матриця взаємодій користувачі × яхти (CSR, float32)
+
+    Значення — сума ваг подій пари (user, yacht), з half_life_days кожна
+    вага множиться на 0.5 ** (вік події в днях / half_life_days).
+    Події з невідомими яхтами відкидаються.
+
+    Args:
+        events: DataFrame подій або ітератор chunk-ів (load_events)
+        yacht_id_to_idx: dict ID яхти → стовпець матриці
+        user_ids: фіксований порядок користувачів (події інших відкидаються);
+            None — користувачі в порядку першої появи
+        half_life_days: період напіврозпаду ваги (None — без затухання)
+        now: момент, від якого рахується вік подій (за замовчуванням — зараз)
+        n_yachts: кількість стовпців (None — len(yacht_id_to_idx)); для
+            YachtRecommender з tombstones — len(recommender.yacht_ids), бо
+            yacht_id_to_idx не містить видалених яхт, а індекси — рядки
+            повної feature matrix
+
+    Returns:
+        (matrix, user_ids): CSR (n_users × n_yachts) та object масив ID користувачів
+    """
+    if isinstance(events, pd.DataFrame):
+        events = [events]
+
+    # ID з CSV — рядки, з Postgres — uuid.UUID: порівнюємо як рядки
+    yacht_lookup = {str(yacht_id): idx for yacht_id, idx in yacht_id_to_idx.items()}
+    user_lookup = {} if user_ids is None else {str(user_id): idx for idx, user_id in enumerate(user_ids)}
+    user_values = {} if user_ids is None else None
+    fixed_users = user_ids is not None
+    now = utc_timestamp(now)
+
+    rows, cols, values = [], [], []
+    n_events = n_dropped = 0
+    for chunk in events:
+        n_events += len(chunk)
+        if 'weight' in chunk.columns:
+            weights = pd.to_numeric(chunk['weight'], errors='coerce').to_numpy(dtype=np.float64)
+        else:
+            weights = chunk['type'].map(EVENT_WEIGHTS).to_numpy(dtype=np.float64)
+        if half_life_days is not None:
+            created_at = pd.to_datetime(chunk['createdAt'], utc=True)
+            age_days = (now - created_at).dt.total_seconds().to_numpy() / 86400.0
+            weights = weights * np.exp2(-np.maximum(age_days, 0) / half_life_days)
+
+        # Lookup тільки по унікальних значеннях chunk-а
+        codes, uniques = pd.factorize(chunk['yachtId'])
+        mapping = np.array([yacht_lookup.get(str(value), -1) for value in uniques] + [-1], dtype=np.int64)
+        chunk_cols = mapping[codes]
+
+        codes, uniques = pd.factorize(chunk['userId'])
+        if fixed_users:
+            mapping = [user_lookup.get(str(value), -1) for value in uniques]
+        else:
+            mapping = []
+            for value in uniques:
+                idx = user_lookup.setdefault(str(value), len(user_lookup))
+                if idx == len(user_values):
+                    user_values[idx] = value
+                mapping.append(idx)
+        chunk_rows = np.array(mapping + [-1], dtype=np.int64)[codes]
+
+        keep = (chunk_cols >= 0) & (chunk_rows >= 0) & np.isfinite(weights)
+        n_dropped += int((~keep).sum())
+        rows.append(chunk_rows[keep])
+        cols.append(chunk_cols[keep])
+        values.append(weights[keep].astype(np.float32))
+
+    if not fixed_users:
+        user_ids = np.array([user_values[idx] for idx in range(len(user_values))], dtype=object)
+    user_ids = np.asarray(user_ids, dtype=object)
+
+    shape = (len(user_ids), len(yacht_id_to_idx) if n_yachts is None else n_yachts)
+    if rows:
+        matrix = sp.coo_matrix(
+            (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=shape
+        ).tocsr()  # дублікати (user, yacht) сумуються
+    else:
+        matrix = sp.csr_matrix(shape, dtype=np.float32)
+    matrix.eliminate_zeros()
+
+    if n_dropped:
+        print(f"⚠️ Відкинуто {n_dropped} з {n_events} подій (невідомі яхти / користувачі або без ваги)")
+    return matrix, user_ids
+
+
+def utc_timestamp(value=None):
+    """
+    pd.Timestamp у UTC (naive значення вважаються UTC)
+    """
+    value = pd.Timestamp.now(tz='UTC') if value is None else pd.Timestamp(value)
+    return value.tz_localize('UTC') if value.tzinfo is None else value.tz_convert('UTC')
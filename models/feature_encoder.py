@@ -0,0 +1,272 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+# 1. NUMERICAL FEATURES (нормалізовані) + log ціни
+NUMERICAL_FEATURE_COLS = ['guests', 'cabins', 'crew', 'length', 'year', 'rating', 'log_price']
+
+PRICE_COLS = ['summerLowSeasonPrice', 'summerHighSeasonPrice', 'winterLowSeasonPrice', 'winterHighSeasonPrice']
+
+# Колонка → префікс one-hot ознак (в порядку feature matrix)
+CATEGORICAL_FEATURE_COLS = [
+    ('type', 'type'),
+    ('baseMarina', 'marina'),
+    ('country', 'country'),
+]
+
+# Маріни поза топ-N групуються в цю категорію
+OTHER_MARINA = 'Other'
+
+
+class YachtFeatureEncoder:
+    """
+    Кодує яхти у feature space для KNN із замороженими словниками
+
+    fit() запам'ятовує словники type / marina (топ-N + "Other") / country
+    та параметри нормалізації; transform() кодує будь-який batch яхт
+    векторизованими category-code lookup-ами, тому нові або ad-hoc
+    яхти кодуються так само, як і каталог, без повторного fit.
+    """
+
+    def __init__(self, top_marinas=15, rating_fill=4.0):
+        """
+        Args:
+            top_marinas: скільки найпопулярніших марін отримують окрему колонку
+                (решта → "Other"); None — всі маріни без групування
+            rating_fill: рейтинг для яхт без рейтингу
+        """
+        self.top_marinas = top_marinas
+        self.rating_fill = rating_fill
+        self.sparse = False
+        self.vocabularies = {}
+        self.mean_ = None
+        self.scale_ = None
+
+    @property
+    def n_numerical(self):
+        return len(NUMERICAL_FEATURE_COLS)
+
+    @property
+    def feature_names(self):
+        names = list(NUMERICAL_FEATURE_COLS)
+        for column, prefix in CATEGORICAL_FEATURE_COLS:
+            names.extend(f"{prefix}_{value}" for value in self.vocabularies[column])
+        return names
+
+    def fit(self, df, sparse=False):
+        """
+        Вивчає словники та параметри нормалізації
+
+        Args:
+            sparse: one-hot колонки тільки масштабуються (без центрування),
+                щоб transform() повертав CSR, в якому нулі залишаються нулями
+        """
+        self.sparse = sparse
+
+        for column, _ in CATEGORICAL_FEATURE_COLS:
+            values = df[column].dropna()
+            if column == 'baseMarina' and self.top_marinas is not None:
+                # Base Marina (топ-N марін, решта → "Other")
+                counts = values.value_counts()
+                top = counts.index[:self.top_marinas]
+                vocabulary = set(top)
+                if len(counts) > len(top) or values.size < len(df):
+                    vocabulary.add(OTHER_MARINA)
+            else:
+                vocabulary = set(values.unique())
+            # Порядок колонок як у pd.get_dummies
+            self.vocabularies[column] = sorted(str(value) for value in vocabulary)
+
+        numerical = self._numerical(df)
+        one_hot = self._one_hot(df, scaled=False)
+
+        # StandardScaler семантика: std з ddof=0, нульовий std → 1
+        numerical_mean = numerical.mean(axis=0)
+        numerical_scale = numerical.std(axis=0)
+
+        one_hot_mean = np.asarray(one_hot.mean(axis=0)).ravel()
+        one_hot_scale = np.sqrt(np.maximum(one_hot_mean - one_hot_mean ** 2, 0))
+        if sparse:
+            one_hot_mean = np.zeros_like(one_hot_mean)
+
+        self.mean_ = np.concatenate([numerical_mean, one_hot_mean])
+        self.scale_ = np.concatenate([numerical_scale, one_hot_scale])
+        self.scale_[self.scale_ == 0] = 1
+
+        print(f"✅ Feature encoder: {len(self.feature_names)} ознак "
+              f"({'sparse' if sparse else 'dense'})")
+        print(f"   Numerical features: {self.n_numerical}")
+        for column, prefix in CATEGORICAL_FEATURE_COLS:
+            print(f"   {prefix.capitalize()} dummies: {len(self.vocabularies[column])}")
+
+        return self
+
+    def transform(self, df, scale=True, sparse=None):
+        """
+        Кодує batch яхт
+
+        Args:
+            scale: нормалізувати (як для KNN) або повернути сирі значення
+            sparse: формат результату (за замовчуванням — як при fit)
+
+        Returns:
+            float32 масив (n × ознаки) або CSR
+        """
+        sparse = self.sparse if sparse is None else sparse
+        numerical = self._numerical(df)
+        one_hot = self._one_hot(df, scaled=scale)
+
+        if scale:
+            numerical = (numerical - self.mean_[:self.n_numerical]) / self.scale_[:self.n_numerical]
+
+        if sparse:
+            return sp.hstack([sp.csr_matrix(numerical), one_hot], format='csr', dtype=np.float32)
+
+        features = np.empty((len(df), len(self.mean_)), dtype=np.float32)
+        features[:, :self.n_numerical] = numerical
+        features[:, self.n_numerical:] = one_hot.toarray()
+        if scale:
+            # Нулі one-hot блоку після центрування: -mean / scale
+            one_hot_offset = -self.mean_[self.n_numerical:] / self.scale_[self.n_numerical:]
+            features[:, self.n_numerical:] += one_hot_offset.astype(np.float32)
+        return features
+
+    def transform_profiles(self, profiles):
+        """
+        Кодує часткові профілі (побажання користувача) у той самий feature space
+
+        Профіль — dict з будь-якими з полів: guests, cabins, crew, length,
+        year, rating, budget (ціна за день), type, marina, country.
+        Поля, яких немає в профілі, стають нейтральними (0 після
+        нормалізації) і не впливають на cosine similarity.
+
+        Returns:
+            float32 масив (n × ознаки) або CSR, якщо encoder у sparse режимі
+        """
+        df = pd.DataFrame(list(profiles))
+        if 'marina' in df.columns:
+            df = df.rename(columns={'marina': 'baseMarina'})
+        if 'budget' in df.columns:
+            for column in PRICE_COLS:
+                df[column] = df['budget']
+
+        features = self.transform(df, sparse=False)
+
+        def given(column):
+            return df[column].notna().to_numpy() if column in df.columns else np.zeros(len(df), dtype=bool)
+
+        for position, column in enumerate(NUMERICAL_FEATURE_COLS):
+            features[~given('budget' if column == 'log_price' else column), position] = 0
+
+        offset = self.n_numerical
+        for column, _ in CATEGORICAL_FEATURE_COLS:
+            size = len(self.vocabularies[column])
+            features[~given(column), offset:offset + size] = 0
+            offset += size
+
+        return sp.csr_matrix(features) if self.sparse else features
+
+    def category_codes(self, column, values):
+        """
+        Індекси значень у словнику колонки (-1 — невідоме значення).
+        Для марін невідомі значення потрапляють в "Other".
+        """
+        vocabulary = self.vocabularies[column]
+        values = pd.Series(values, dtype=object)
+        values = values.where(values.isna(), values.astype(str))
+        codes = pd.Categorical(values, categories=vocabulary).codes.astype(np.int64)
+
+        if column == 'baseMarina' and OTHER_MARINA in vocabulary:
+            codes[codes < 0] = vocabulary.index(OTHER_MARINA)
+
+        return codes
+
+    def _numerical(self, df):
+        """
+        Numerical колонки (guests, ..., rating, log_price) як float64 масив
+        """
+        numerical = np.empty((len(df), self.n_numerical), dtype=np.float64)
+
+        for position, column in enumerate(NUMERICAL_FEATURE_COLS[:-1]):
+            if column in df.columns:
+                numerical[:, position] = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+            else:
+                numerical[:, position] = np.nan
+
+        # RATING (без рейтингу → rating_fill)
+        rating = NUMERICAL_FEATURE_COLS.index('rating')
+        numerical[:, rating] = np.where(np.isnan(numerical[:, rating]), self.rating_fill, numerical[:, rating])
+
+        # PRICE: log від середньої ціни за 4 сезони (щоб зменшити вплив outliers)
+        prices = np.column_stack([
+            pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float64)
+            if column in df.columns else np.full(len(df), np.nan)
+            for column in PRICE_COLS
+        ])
+        numerical[:, -1] = np.log1p(prices.mean(axis=1))
+
+        # Заповнюємо будь-які залишкові NaN нулями
+        return np.nan_to_num(numerical, nan=0.0)
+
+    def _one_hot(self, df, scaled=True):
+        """
+        One-hot блок як CSR; scaled=True — одиниці діляться на scale_
+        """
+        n_rows = len(df)
+        offset = 0
+        rows, columns = [], []
+
+        for column, _ in CATEGORICAL_FEATURE_COLS:
+            values = df[column] if column in df.columns else pd.Series([None] * n_rows)
+            codes = self.category_codes(column, values.to_numpy())
+            known = np.flatnonzero(codes >= 0)  # невідоме / NaN → рядок без одиниці
+            rows.append(known)
+            columns.append(codes[known] + offset)
+            offset += len(self.vocabularies[column])
+
+        rows = np.concatenate(rows)
+        columns = np.concatenate(columns)
+        data = np.ones(len(rows), dtype=np.float64)
+        if scaled:
+            data /= self.scale_[self.n_numerical + columns]
+
+        return sp.csr_matrix((data, (rows, columns)), shape=(n_rows, offset))
+
+    def to_dict(self):
+        """
+        JSON-сумісний стан encoder-а (для metadata.json моделі)
+        """
+        return {
+            'top_marinas': self.top_marinas,
+            'rating_fill': self.rating_fill,
+            'sparse': self.sparse,
+            'vocabularies': self.vocabularies,
+            'mean': self.mean_.tolist(),
+            'scale': self.scale_.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        encoder = cls(top_marinas=state['top_marinas'], rating_fill=state['rating_fill'])
+        encoder.sparse = state['sparse']
+        encoder.vocabularies = {column: list(values) for column, values in state['vocabularies'].items()}
+        encoder.mean_ = np.array(state['mean'], dtype=np.float64)
+        encoder.scale_ = np.array(state['scale'], dtype=np.float64)
+        return encoder
+
+    @classmethod
+    def from_feature_layout(cls, feature_names, mean, scale, sparse=False):
+        """
+        Відновлює encoder для моделей, збережених до появи encoder-а:
+        словники беруться з назв one-hot колонок, нормалізація — зі scaler-ів
+        """
+        encoder = cls(top_marinas=None)
+        encoder.sparse = sparse
+        for column, prefix in CATEGORICAL_FEATURE_COLS:
+            encoder.vocabularies[column] = [
+                name[len(prefix) + 1:] for name in feature_names if name.startswith(f"{prefix}_")
+            ]
+        encoder.mean_ = np.asarray(mean, dtype=np.float64)
+        encoder.scale_ = np.asarray(scale, dtype=np.float64)
+        return encoder
@@ -0,0 +1,345 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from threadpoolctl import threadpool_limits
+from sqlalchemy import create_engine
+import dotenv
+
+from events import build_interaction_matrix, load_events
+from instrumentation import instrumented
+from model_store import atomic_directory, save_array, load_array, save_ids, load_ids, write_metadata, read_metadata
+
+dotenv.load_dotenv()
+
+
+# Версія формату директорії факторів (save / load)
+ALS_FORMAT_VERSION = 1
+
+# Таблиця collaborative рекомендацій (user_id uuid, als_recommendations uuid[])
+ALS_RECOMMENDATIONS_TABLE = 'als_recommendations'
+
+
+class ImplicitALS:
+    """
+    Implicit-feedback matrix factorization (ALS, Hu / Koren / Volinsky)
+
+    Вага події r (EVENT_WEIGHTS, опціонально з затуханням) → довіра
+    c = 1 + alpha * r до переваги p = 1. Кожен півкрок ALS розв'язує
+    (YᵀY + Yᵀ(C_u − I)Y + λI) x_u = Yᵀ C_u p_u для всіх користувачів
+    (потім для всіх яхт) кількома кроками conjugate gradient, векторизовано
+    по всіх рядках одразу: вартість — O(nnz · factors) на крок, без
+    f × f матриць на користувача. Рядки діляться на блоки, які рахуються
+    паралельно в потоках (NumPy / BLAS відпускають GIL).
+    """
+
+    def __init__(self, factors=64, regularization=0.05, alpha=40.0, iterations=15, cg_steps=3,
+                 half_life_days=None, n_threads=-1, block_size=65_536, block_nnz=1_000_000, random_state=0):
+        """
+        Args:
+            factors: розмірність латентних векторів
+            regularization: λ
+            alpha: масштаб довіри c = 1 + alpha * r
+            iterations: кількість ітерацій ALS (користувачі + яхти)
+            cg_steps: кроків conjugate gradient на півкрок (з warm start)
+            half_life_days: затухання ваг подій (None — без затухання)
+            n_threads: потоків для блоків (-1 — всі ядра)
+            block_size: максимум рядків (користувачів / яхт) на блок
+            block_nnz: максимум пар на блок (обмежує тимчасову пам'ять
+                O(block_nnz · factors) для популярних яхт)
+        """
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.cg_steps = cg_steps
+        self.half_life_days = half_life_days
+        self.n_threads = (os.cpu_count() or 1) if n_threads == -1 else n_threads
+        self.block_size = block_size
+        self.block_nnz = block_nnz
+        self.random_state = random_state
+        self.user_factors = None   # (n_users × factors) float32
+        self.item_factors = None   # (n_yachts × factors) float32
+        self.interactions = None   # CSR users × yachts (сирі ваги, для exclude seen)
+        self.user_ids = None
+        self.yacht_ids = None
+        self.user_id_to_idx = {}
+        self.yacht_id_to_idx = {}
+        self.instrumentation = None  # Instrumentation (опціонально)
+
+    @instrumented('als_fit')
+    def fit(self, events, yacht_ids, now=None):
+        """
+        Тренує фактори на подіях
+
+        Args:
+            events: DataFrame подій (userId, yachtId, weight або type, createdAt)
+                або ітератор chunk-ів (load_events)
+            yacht_ids: ID яхт каталогу (стовпці матриці; події інших яхт відкидаються)
+            now: момент для затухання ваг (з half_life_days)
+        """
+        self.yacht_ids = np.asarray(yacht_ids, dtype=object)
+        self.yacht_id_to_idx = {yacht_id: idx for idx, yacht_id in enumerate(self.yacht_ids)}
+        self.interactions, self.user_ids = build_interaction_matrix(
+            events, self.yacht_id_to_idx, half_life_days=self.half_life_days, now=now
+        )
+        self.user_id_to_idx = {user_id: idx for idx, user_id in enumerate(self.user_ids)}
+        return self.fit_matrix(self.interactions)
+
+    def fit_matrix(self, interactions):
+        """
+        Тренує фактори на готовій CSR матриці users × yachts (ваги r ≥ 0)
+        """
+        interactions = sp.csr_matrix(interactions, dtype=np.float32)
+        interactions.sum_duplicates()
+        self.interactions = interactions
+
+        # Довіра зберігається як c − 1 = alpha * r: саме вона потрібна в A·v
+        confidence = interactions.copy()
+        confidence.data = (self.alpha * confidence.data).astype(np.float32)
+        confidence_t = confidence.T.tocsr()
+
+        n_users, n_items = interactions.shape
+        rng = np.random.default_rng(self.random_state)
+        scale = np.float32(0.01)
+        self.user_factors = (rng.standard_normal((n_users, self.factors), dtype=np.float32) * scale)
+        self.item_factors = (rng.standard_normal((n_items, self.factors), dtype=np.float32) * scale)
+
+        print(f"🔧 ALS: {n_users} користувачів × {n_items} яхт, {interactions.nnz} пар, "
+              f"{self.factors} факторів, {self.iterations} ітерацій, {self.n_threads} потоків")
+
+        start = time.perf_counter()
+        # Власні потоки по блоках → BLAS в один потік, без oversubscription
+        limits = threadpool_limits(limits=1) if self.n_threads > 1 else None
+        try:
+            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                for _ in range(self.iterations):
+                    self._solve(confidence, self.user_factors, self.item_factors, executor)
+                    self._solve(confidence_t, self.item_factors, self.user_factors, executor)
+        finally:
+            if limits is not None:
+                limits.unregister()
+
+        print(f"✅ ALS натренована за {time.perf_counter() - start:.1f} с")
+        return self
+
+    def _solve(self, confidence, target, fixed, executor):
+        """
+        Півкрок ALS: оновлює target на місці при фіксованих fixed
+        """
+        gram = fixed.T @ fixed + self.regularization * np.eye(self.factors, dtype=np.float32)
+        n_rows = target.shape[0]
+        starts = np.union1d(
+            np.arange(0, n_rows, self.block_size),
+            np.searchsorted(confidence.indptr, np.arange(0, confidence.nnz, self.block_nnz), side='right') - 1
+        )
+        stops = np.append(starts[1:], n_rows)
+        # list() — щоб помилки з потоків не губились
+        list(executor.map(
+            lambda bounds: self._solve_block(confidence, target, fixed, gram, *bounds), zip(starts, stops)
+        ))
+
+    def _solve_block(self, confidence, target, fixed, gram, start, stop):
+        """
+        Conjugate gradient для рядків target[start:stop]
+        (warm start від поточних значень)
+        """
+        block = confidence[start:stop]
+        rows = np.repeat(np.arange(stop - start), np.diff(block.indptr))
+        fixed_nz = fixed[block.indices]
+
+        def matvec(vectors):
+            # (YᵀY + λI) v + Yᵀ (C − I) Y v тільки по ненульових парах
+            projections = np.einsum('ij,ij->i', fixed_nz, vectors[rows])
+            weighted = sp.csr_matrix((block.data * projections, block.indices, block.indptr), shape=block.shape)
+            return vectors @ gram + weighted @ fixed
+
+        x = target[start:stop]
+        # b = Yᵀ C p: c = 1 + (c − 1) для кожної пари
+        full_confidence = sp.csr_matrix((block.data + 1, block.indices, block.indptr), shape=block.shape)
+        residual = full_confidence @ fixed - matvec(x)
+        direction = residual.copy()
+        rs_old = np.einsum('ij,ij->i', residual, residual)
+
+        for _ in range(self.cg_steps):
+            product = matvec(direction)
+            denominator = np.einsum('ij,ij->i', direction, product)
+            step = np.divide(rs_old, denominator, out=np.zeros_like(rs_old), where=denominator > 0)
+            x += step[:, None] * direction
+            residual -= step[:, None] * product
+            rs_new = np.einsum('ij,ij->i', residual, residual)
+            beta = np.divide(rs_new, rs_old, out=np.zeros_like(rs_new), where=rs_old > 0)
+            direction = residual + beta[:, None] * direction
+            rs_old = rs_new
+
+        target[start:stop] = x
+
+    @instrumented('als_recommend_many')
+    def recommend_many(self, user_ids, top_k=10, exclude_seen=True, block_size=4096):
+        """
+        Top-K яхт для списку користувачів (невідомі ID пропускаються)
+
+        Returns:
+            (user_ids, neighbor_ids, scores): ID знайдених користувачів,
+            масиви shape (n_users, top_k)
+        """
+        if self.user_factors is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+
+        rows = np.array([self.user_id_to_idx[user_id] for user_id in user_ids if user_id in self.user_id_to_idx],
+                        dtype=np.int64)
+        indices, scores = self._score_rows(rows, top_k, exclude_seen, block_size)
+        return self.user_ids[rows], self.yacht_ids[indices], scores
+
+    @instrumented('als_recommend_all')
+    def recommend_all(self, top_k=10, exclude_seen=True, block_size=4096):
+        """
+        Top-K яхт для всіх користувачів (нічний batch)
+
+        Returns:
+            (user_ids, neighbor_ids, scores)
+        """
+        if self.user_factors is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+
+        rows = np.arange(len(self.user_ids))
+        indices, scores = self._score_rows(rows, top_k, exclude_seen, block_size)
+        return self.user_ids, self.yacht_ids[indices], scores
+
+    def _score_rows(self, rows, top_k, exclude_seen, block_size):
+        """
+        Скори XYᵀ блоками по block_size користувачів + top-K через argpartition
+
+        Переглянуті яхти отримують штраф більший за розкид скорів у рядку,
+        тому потрапляють у top-K лише коли інших яхт не вистачає.
+        """
+        n_items = self.item_factors.shape[0]
+        top_k = max(min(top_k, n_items), 0)
+        indices = np.empty((len(rows), top_k), dtype=np.int64)
+        scores = np.empty((len(rows), top_k), dtype=np.float32)
+        if top_k == 0:
+            return indices, scores
+
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            block_scores = self.user_factors[block] @ self.item_factors.T
+            ranking = block_scores
+            if exclude_seen:
+                seen = self.interactions[block]
+                ranking = block_scores.copy()
+                penalty = block_scores.max(axis=1) - block_scores.min(axis=1) + 1
+                seen_rows = np.repeat(np.arange(len(block)), np.diff(seen.indptr))
+                ranking[seen_rows, seen.indices] -= penalty[seen_rows]
+
+            top = np.argpartition(-ranking, top_k - 1, axis=1)[:, :top_k]
+            order = np.argsort(-np.take_along_axis(ranking, top, axis=1), axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+
+            indices[start:start + len(block)] = top
+            scores[start:start + len(block)] = np.take_along_axis(block_scores, top, axis=1)
+
+        return indices, scores
+
+    def save(self, path='yacht_als_model'):
+        """
+        Зберігає фактори як директорію:
+            metadata.json — версія формату, гіперпараметри, типи ID
+            *.npy — фактори, матриця взаємодій (CSR), ID користувачів і яхт
+
+        .npy відкриваються через np.load(mmap_mode='r') — кілька процесів
+        ділять фактори через page cache. Запис — через atomic_directory().
+        """
+        if self.user_factors is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+
+        path = os.path.abspath(path)
+        with atomic_directory(path) as tmp_path:
+            save_array(tmp_path, 'user_factors', np.asarray(self.user_factors, dtype=np.float32))
+            save_array(tmp_path, 'item_factors', np.asarray(self.item_factors, dtype=np.float32))
+            save_array(tmp_path, 'interactions_data', self.interactions.data.astype(np.float32))
+            save_array(tmp_path, 'interactions_indices', self.interactions.indices)
+            save_array(tmp_path, 'interactions_indptr', self.interactions.indptr)
+
+            id_types = {name: save_ids(tmp_path, name, ids)
+                        for name, ids in (('user_ids', self.user_ids), ('yacht_ids', self.yacht_ids))}
+
+            write_metadata(tmp_path, {
+                'format_version': ALS_FORMAT_VERSION,
+                'n_users': int(self.user_factors.shape[0]),
+                'n_yachts': int(self.item_factors.shape[0]),
+                'id_types': id_types,
+                'params': {
+                    'factors': self.factors,
+                    'regularization': self.regularization,
+                    'alpha': self.alpha,
+                    'iterations': self.iterations,
+                    'cg_steps': self.cg_steps,
+                    'half_life_days': self.half_life_days,
+                },
+            })
+
+        print(f"✅ ALS фактори збережені у {path}")
+
+    @classmethod
+    def load(cls, path='yacht_als_model', mmap=True):
+        """
+        Завантажує фактори, збережені save()
+
+        Args:
+            mmap: відкривати .npy через mmap (read-only, спільні сторінки)
+        """
+        metadata = read_metadata(path)
+
+        if metadata.get('format_version') != ALS_FORMAT_VERSION:
+            raise ValueError(
+                f"Непідтримувана версія формату ALS: {metadata.get('format_version')} "
+                f"(очікується {ALS_FORMAT_VERSION})"
+            )
+
+        model = cls(**metadata['params'])
+        model.user_factors = load_array(path, 'user_factors', mmap=mmap)
+        model.item_factors = load_array(path, 'item_factors', mmap=mmap)
+        model.interactions = sp.csr_matrix(
+            (load_array(path, 'interactions_data', mmap=mmap),
+             load_array(path, 'interactions_indices', mmap=mmap),
+             load_array(path, 'interactions_indptr', mmap=mmap)),
+            shape=(metadata['n_users'], metadata['n_yachts']),
+            copy=False
+        )
+
+        model.user_ids = load_ids(path, 'user_ids', metadata['id_types']['user_ids'], mmap=mmap)
+        model.yacht_ids = load_ids(path, 'yacht_ids', metadata['id_types']['yacht_ids'], mmap=mmap)
+        model.user_id_to_idx = {user_id: idx for idx, user_id in enumerate(model.user_ids)}
+        model.yacht_id_to_idx = {yacht_id: idx for idx, yacht_id in enumerate(model.yacht_ids)}
+
+        print(f"✅ ALS фактори завантажені з {path}")
+        return model
+
+
+# ============================================
+# ВИКОРИСТАННЯ (нічний job)
+# ============================================
+
+if __name__ == "__main__":
+    from catalog import YachtCatalog
+    from cold_recommendations import write_recommendations
+
+    engine = create_engine(os.getenv("DB_STRING"))
+
+    yacht_ids = YachtCatalog.from_sql(engine, table='yachts', columns=['id'])['id']
+
+    model = ImplicitALS(factors=64, iterations=15, half_life_days=90)
+    model.fit(load_events(engine), yacht_ids)
+    model.save(os.getenv("ALS_MODEL_PATH", "yacht_als_model"))
+
+    print("\n🚀 Генеруємо collaborative рекомендації для всіх користувачів...")
+    user_ids, neighbor_ids, _ = model.recommend_all(top_k=10)
+
+    try:
+        write_recommendations(
+            engine, user_ids, neighbor_ids, table=ALS_RECOMMENDATIONS_TABLE,
+            key_column='user_id', value_column='als_recommendations', mode='swap'
+        )
+    except Exception as e:
+        print(f"❌ Помилка під час завантаження в базу даних: {e}")
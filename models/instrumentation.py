@@ -0,0 +1,145 @@
+import os
+import time
+import functools
+import threading
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+
+# Скільки останніх вимірів на метрику зберігається для p50/p95/p99
+LATENCY_WINDOW = 10_000
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Instrumentation:
+    """
+    Opt-in метрики YachtRecommender: час етапів, латентність API, лічильники
+
+    Латентність зберігається як ковзне вікно останніх window вимірів
+    (p50/p95/p99) + сума та кількість за весь час. Експорт — Prometheus
+    text format (summary + counter) або callback на кожен вимір.
+
+    Thread-safe: service.py рахує batch-і в executor потоках.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW, callback=None, namespace='yacht_recommender'):
+        """
+        Args:
+            window: розмір вікна для percentiles
+            callback: fn(kind, name, seconds) — викликається на кожен вимір
+                (kind: 'api' або 'stage')
+            namespace: префікс назв метрик Prometheus
+        """
+        self.window = window
+        self.callback = callback
+        self.namespace = namespace
+        self.counters = {}
+        self._samples = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, kind, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(kind, name, time.perf_counter() - start)
+
+    def observe(self, kind, name, seconds):
+        key = (kind, name)
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=self.window)
+                self._totals[key] = [0, 0.0]
+            self._samples[key].append(seconds)
+            totals = self._totals[key]
+            totals[0] += 1
+            totals[1] += seconds
+        if self.callback is not None:
+            self.callback(kind, name, seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        """
+        {'api': {name: {count, sum, p50, p95, p99}}, 'stage': {...}, 'counters': {...}}
+        (латентність у секундах)
+        """
+        with self._lock:
+            samples = {key: np.fromiter(values, dtype=np.float64) for key, values in self._samples.items()}
+            totals = {key: tuple(values) for key, values in self._totals.items()}
+            counters = dict(self.counters)
+
+        snapshot = {'api': {}, 'stage': {}, 'counters': counters}
+        for (kind, name), values in samples.items():
+            count, total = totals[(kind, name)]
+            stats = {'count': count, 'sum': total}
+            for quantile, value in zip(QUANTILES, np.quantile(values, QUANTILES)):
+                stats[f"p{int(quantile * 100)}"] = float(value)
+            snapshot[kind][name] = stats
+        return snapshot
+
+    def to_prometheus(self):
+        """
+        Метрики у Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for kind, label in (('api', 'api'), ('stage', 'stage')):
+            metric = f"{self.namespace}_{kind}_latency_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for name, stats in sorted(snapshot[kind].items()):
+                for quantile in QUANTILES:
+                    lines.append(
+                        f'{metric}{{{label}="{name}",quantile="{quantile}"}} '
+                        f'{stats[f"p{int(quantile * 100)}"]:.9f}'
+                    )
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {stats["sum"]:.9f}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {stats["count"]}')
+
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f"{self.namespace}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Атомарно записує метрики у файл (для textfile collector node_exporter)
+        """
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def print_report(self):
+        snapshot = self.snapshot()
+        print("\n📊 Латентність (мс):")
+        for kind in ('api', 'stage'):
+            for name, stats in sorted(snapshot[kind].items()):
+                print(f"   {kind}:{name:<22} n={stats['count']:<7} p50={stats['p50'] * 1000:8.3f} "
+                      f"p95={stats['p95'] * 1000:8.3f} p99={stats['p99'] * 1000:8.3f}")
+        for name, value in sorted(snapshot['counters'].items()):
+            print(f"   {name}: {value}")
+
+
+def instrumented(name, kind='api'):
+    """
+    Декоратор методу: вимірює час, якщо в об'єкта є self.instrumentation
+    (інакше — прямий виклик без накладних витрат)
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.instrumentation is None:
+                return method(self, *args, **kwargs)
+            with self.instrumentation.timer(kind, name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import mmap as mmap_module
+import shutil
+import uuid
+from contextlib import contextmanager
+import numpy as np
+
+
+# Symlink на активну генерацію моделі в root директорії
+CURRENT_LINK = 'current'
+
+GENERATION_PATTERN = re.compile(r'^gen-(\d+)$')
+
+
+def publish_model(recommender, root='yacht_recommender_models', keep=3):
+    """
+    Зберігає модель як нову генерацію і атомарно перемикає на неї 'current'
+
+    root/
+        gen-000001/  gen-000002/  ...   — директорії save_model()
+        current -> gen-000002           — symlink, підміняється одним rename
+
+    Сервіс (service.py) помічає нову генерацію і підхоплює її без рестарту.
+    Старі генерації видаляються, крім останніх keep: worker-и, які ще
+    тримають mmap старої моделі, продовжують працювати (inode живий).
+
+    Returns:
+        шлях до нової генерації
+    """
+    os.makedirs(root, exist_ok=True)
+    generations = list_generations(root)
+    generation = generations[-1][0] + 1 if generations else 1
+    path = os.path.join(root, f"gen-{generation:06d}")
+
+    recommender.save_model(path)
+
+    tmp_link = os.path.join(root, f".{CURRENT_LINK}-{os.getpid()}")
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.basename(path), tmp_link)
+    os.replace(tmp_link, os.path.join(root, CURRENT_LINK))
+
+    for _, old_path in list_generations(root)[:-keep]:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    print(f"✅ Опубліковано генерацію моделі {os.path.basename(path)}")
+    return path
+
+
+def list_generations(root):
+    """
+    [(номер, шлях)] генерацій у root, відсортовані за номером
+    """
+    generations = []
+    for name in os.listdir(root):
+        match = GENERATION_PATTERN.match(name)
+        if match and os.path.isdir(os.path.join(root, name)):
+            generations.append((int(match.group(1)), os.path.join(root, name)))
+    return sorted(generations)
+
+
+def current_model_path(root):
+    """
+    Шлях до активної моделі: ціль symlink 'current' або сам root,
+    якщо це звичайна директорія save_model() (без генерацій)
+    """
+    link = os.path.join(root, CURRENT_LINK)
+    if os.path.islink(link):
+        return os.path.realpath(link)
+    return os.path.abspath(root)
+
+
+@contextmanager
+def atomic_directory(path):
+    """
+    Запис директорії моделі / індексу з підміною наприкінці
+
+        with atomic_directory(path) as tmp_path:
+            save_array(tmp_path, 'features', features)
+            write_metadata(tmp_path, metadata)
+
+    Вміст пишеться у path.tmp-<pid>. Після успішного виходу з блоку стара
+    директорія відсувається rename-ом у path.old-<pid>, нова стає на її місце
+    другим rename, і лише тоді стара видаляється: на диску завжди є повна
+    копія моделі, а path відсутній тільки між двома rename. Процеси, які вже
+    тримають mmap старої моделі, продовжують працювати. Для підміни без
+    жодного вікна — publish_model() (symlink на генерацію).
+    При винятку тимчасова директорія видаляється, а path не змінюється.
+    """
+    path = os.path.abspath(path)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    try:
+        yield tmp_path
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def save_array(directory, name, array):
+    """
+    Масив як directory/name.npy (C-contiguous, щоб np.load(mmap_mode='r') не копіював)
+    """
+    np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+
+def load_array(directory, name, mmap=True, random_access=False):
+    """
+    directory/name.npy, за замовчуванням через mmap (read-only, спільні сторінки)
+
+    Args:
+        random_access: MADV_RANDOM для mmap — ядро не робить readahead, тому
+            читання окремих рядків (features quantized моделі: запити і
+            rerank кандидатів) не підтягує у page cache весь файл
+    """
+    array = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r' if mmap else None)
+    if mmap and random_access:
+        # np.memmap тримає mmap.mmap файлу в _mmap; madvise — Python 3.8+, не на всіх ОС
+        mapping = getattr(array, '_mmap', None)
+        if mapping is not None and hasattr(mmap_module, 'MADV_RANDOM'):
+            mapping.madvise(mmap_module.MADV_RANDOM)
+    return array
+
+
+def detect_id_type(ids):
+    """
+    Тип ID для збереження у .npy: 'uuid', 'int' або 'str'
+    """
+    if len(ids) and all(isinstance(value, uuid.UUID) for value in ids):
+        return 'uuid'
+    if len(ids) and all(isinstance(value, (int, np.integer)) for value in ids):
+        return 'int'
+    return 'str'
+
+
+def save_ids(directory, name, ids):
+    """
+    ID як directory/name.npy: int → int64, uuid → 16 байт (V16),
+    str → fixed-width unicode (щоб масив можна було mmap)
+
+    Returns:
+        тип ID для metadata.json (аргумент load_ids)
+    """
+    ids = np.asarray(ids, dtype=object)
+    id_type = detect_id_type(ids)
+    if id_type == 'int':
+        values = ids.astype(np.int64)
+    elif id_type == 'uuid':
+        values = np.frombuffer(b''.join(value.bytes for value in ids), dtype='V16')
+    else:
+        values = ids.astype(str)
+    save_array(directory, name, values)
+    return id_type
+
+
+def load_ids(directory, name, id_type, mmap=True):
+    """
+    ID, збережені save_ids(): uuid / str — object масив, int — int64 масив
+
+    Значення читаються з mmap одним tolist(), а не поелементною
+    індексацією memmap. UUID з V16 будуються з int без розбору рядка;
+    моделі старішого формату зберігали UUID як рядки (<U36).
+    """
+    values = load_array(directory, name, mmap=mmap)
+    if id_type == 'uuid':
+        if values.dtype.kind == 'V':
+            return np.array(
+                [uuid.UUID(int=int.from_bytes(value, 'big')) for value in values.tolist()], dtype=object
+            )
+        return np.array([uuid.UUID(value) for value in values.tolist()], dtype=object)
+    if id_type == 'str':
+        return np.array(values.tolist(), dtype=object)
+    return values
+
+
+def write_metadata(directory, metadata):
+    with open(os.path.join(directory, 'metadata.json'), 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+
+def read_metadata(directory):
+    with open(os.path.join(directory, 'metadata.json'), encoding='utf-8') as f:
+        return json.load(f)
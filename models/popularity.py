@@ -0,0 +1,318 @@
+import os
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+import dotenv
+
+from catalog import YachtCatalog
+from events import EVENT_WEIGHTS, load_events, utc_timestamp
+from model_store import atomic_directory, save_array, load_array, save_ids, load_ids, write_metadata, read_metadata
+
+dotenv.load_dotenv()
+
+
+# Версія формату директорії індексу (save / load)
+POPULARITY_FORMAT_VERSION = 1
+
+# Період напіврозпаду популярності: подія тижневої давнини важить удвічі менше
+TRENDING_HALF_LIFE_DAYS = 7
+
+# Коли показник exp(rate · (t − landmark)) перевищує це значення, скори
+# перераховуються до нового landmark (запас до переповнення float64)
+MAX_DECAY_EXPONENT = 300.0
+
+
+class PopularityIndex:
+    """
+    Trending / popularity індекс яхт з експоненційним затуханням у часі
+
+    Forward decay: подія ваги w в момент t додає w · exp(rate · (t − landmark))
+    до скору яхти, а поточний скор — це збережене значення ×
+    exp(−rate · (now − landmark)). Множник спільний для всіх яхт, тому
+    порядок не залежить від now, скори тільки зростають, і top-N кожного
+    сегмента (глобальний + (country, type)) підтримується точно: яхта поза
+    top-N може потрапити туди тільки обігнавши останню. Оновлення —
+    O(top_n) на подію, читання top-N — зріз готового списку.
+    """
+
+    def __init__(self, catalog, half_life_days=TRENDING_HALF_LIFE_DAYS, top_n=50):
+        """
+        Args:
+            catalog: DataFrame або YachtCatalog з колонками id, country, type
+            half_life_days: період напіврозпаду ваги подій
+            top_n: скільки яхт зберігається в top кожного сегмента
+        """
+        self.half_life_days = half_life_days
+        self.decay_rate = np.log(2) / (half_life_days * 86400.0)
+        self.top_n = top_n
+        self.yacht_ids = np.empty(0, dtype=object)
+        self.yacht_id_to_idx = {}
+        self.yacht_segments = np.empty(0, dtype=np.int64)  # код (country, type) яхти, -1 — немає
+        self.segments = []                                 # код → (country, type)
+        self.segment_to_code = {}
+        self.scores = np.empty(0, dtype=np.float64)        # forward-decayed скори (відносно landmark)
+        self.landmark = None                               # секунди UTC
+        self.watermark = None                              # max createdAt оброблених подій
+        self.top = {None: []}                              # сегмент (None — глобальний) → індекси яхт
+        self.n_dropped = 0
+        self.add_yachts(catalog)
+
+    def add_yachts(self, catalog):
+        """
+        Реєструє нові яхти каталогу (вже відомі пропускаються)
+        """
+        if isinstance(catalog, YachtCatalog):
+            catalog = catalog.take(np.arange(len(catalog)))
+
+        new = ~catalog['id'].map(lambda yacht_id: yacht_id in self.yacht_id_to_idx).to_numpy(dtype=bool)
+        catalog = catalog[new]
+        start = len(self.yacht_ids)
+        for offset, yacht_id in enumerate(catalog['id']):
+            self.yacht_id_to_idx[yacht_id] = start + offset
+
+        segments = []
+        for key in zip(catalog['country'], catalog['type']):
+            if any(pd.isna(value) for value in key):
+                segments.append(-1)
+                continue
+            if key not in self.segment_to_code:
+                self.segment_to_code[key] = len(self.segments)
+                self.segments.append(key)
+                self.top[self.segment_to_code[key]] = []
+            segments.append(self.segment_to_code[key])
+
+        self.yacht_ids = np.concatenate([self.yacht_ids, catalog['id'].to_numpy(dtype=object)])
+        self.yacht_segments = np.concatenate([self.yacht_segments, np.array(segments, dtype=np.int64)])
+        self.scores = np.concatenate([self.scores, np.zeros(len(catalog))])
+        return self
+
+    def _forward_factor(self, timestamps):
+        """
+        exp(rate · (t − landmark)); за потреби спершу зсуває landmark
+        """
+        latest = float(np.max(timestamps))
+        if self.landmark is None:
+            self.landmark = latest
+        elif self.decay_rate * (latest - self.landmark) > MAX_DECAY_EXPONENT:
+            # Рідко (раз на сотні періодів напіврозпаду): O(n_yachts)
+            self.scores *= np.exp(-self.decay_rate * (latest - self.landmark))
+            self.landmark = latest
+        return np.exp(self.decay_rate * (np.asarray(timestamps, dtype=np.float64) - self.landmark))
+
+    def add_event(self, yacht_id, weight, created_at):
+        """
+        Одна подія з потоку: O(top_n)
+
+        Args:
+            weight: вага події або її тип (ключ EVENT_WEIGHTS)
+            created_at: час події (datetime / рядок / pd.Timestamp)
+        """
+        idx = self.yacht_id_to_idx.get(yacht_id)
+        if idx is None:
+            self.n_dropped += 1
+            return
+        weight = EVENT_WEIGHTS[weight] if isinstance(weight, str) else weight
+        created_at = utc_timestamp(created_at)
+        self.scores[idx] += weight * self._forward_factor([created_at.timestamp()])[0]
+
+        self._promote(self.top[None], idx)
+        if self.yacht_segments[idx] >= 0:
+            self._promote(self.top[self.yacht_segments[idx]], idx)
+        self._advance_watermark(created_at)
+
+    def _promote(self, top, idx):
+        """
+        Оновлює відсортований top після зростання скору яхти idx
+        """
+        scores = self.scores
+        if idx in top:
+            position = top.index(idx)
+        elif len(top) < self.top_n:
+            top.append(idx)
+            position = len(top) - 1
+        elif scores[idx] > scores[top[-1]]:
+            top[-1] = idx
+            position = len(top) - 1
+        else:
+            return
+        while position > 0 and scores[top[position - 1]] < scores[idx]:
+            top[position] = top[position - 1]
+            position -= 1
+        top[position] = idx
+
+    def update(self, events):
+        """
+        Batch подій (DataFrame або ітератор chunk-ів): скори — одним
+        np.add.at, top кожного зачепленого сегмента — злиттям поточного
+        top з яхтами batch-а
+
+        Returns:
+            кількість врахованих подій
+        """
+        if isinstance(events, pd.DataFrame):
+            events = [events]
+
+        n_events = 0
+        for chunk in events:
+            if not len(chunk):
+                continue
+            if 'weight' in chunk.columns:
+                weights = pd.to_numeric(chunk['weight'], errors='coerce').to_numpy(dtype=np.float64)
+            else:
+                weights = chunk['type'].map(EVENT_WEIGHTS).to_numpy(dtype=np.float64)
+            codes, uniques = pd.factorize(chunk['yachtId'])
+            mapping = np.array([self.yacht_id_to_idx.get(value, -1) for value in uniques] + [-1], dtype=np.int64)
+            yachts = mapping[codes]
+            timestamps = _utc_seconds(chunk['createdAt'])
+
+            keep = (yachts >= 0) & np.isfinite(weights)
+            self.n_dropped += int((~keep).sum())
+            if not keep.any():
+                continue
+            yachts, weights, timestamps = yachts[keep], weights[keep], timestamps[keep]
+
+            np.add.at(self.scores, yachts, weights * self._forward_factor(timestamps))
+            touched = np.unique(yachts)
+            self._merge_top(None, touched)
+            touched = touched[self.yacht_segments[touched] >= 0]
+            for segment in np.unique(self.yacht_segments[touched]):
+                self._merge_top(segment, touched[self.yacht_segments[touched] == segment])
+
+            self._advance_watermark(pd.to_datetime(chunk['createdAt'], utc=True).max())
+            n_events += len(yachts)
+        return n_events
+
+    def _merge_top(self, segment, touched):
+        """
+        Новий top сегмента: поточний top ∪ яхти, скори яких зросли
+        """
+        candidates = np.union1d(np.array(self.top[segment], dtype=np.int64), touched)
+        order = np.argsort(-self.scores[candidates], kind='stable')[:self.top_n]
+        self.top[segment] = candidates[order].tolist()
+
+    def _advance_watermark(self, created_at):
+        if self.watermark is None or created_at > self.watermark:
+            self.watermark = created_at
+
+    def trending(self, top_n=None, country=None, yacht_type=None, now=None):
+        """
+        Top-N популярних яхт глобально або в сегменті (country, yacht_type)
+
+        Args:
+            top_n: скільки яхт (≤ top_n індексу)
+            country, yacht_type: сегмент (обидва або жодного)
+            now: момент, до якого затухають скори (за замовчуванням — зараз)
+
+        Returns:
+            (yacht_ids, scores): порожні, якщо сегмент невідомий
+        """
+        if (country is None) != (yacht_type is None):
+            raise ValueError("Сегмент задається парою country + yacht_type (або без них — глобальний top)")
+
+        segment = None if country is None else self.segment_to_code.get((country, yacht_type))
+        if country is not None and segment is None:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.float64)
+
+        top = self.top[segment][:top_n or self.top_n]
+        return self.yacht_ids[top], self.current_scores(top, now)
+
+    def current_scores(self, indices=None, now=None):
+        """
+        Скори яхт (за індексами; None — всі), затухлі до now
+        """
+        scores = self.scores if indices is None else self.scores[np.asarray(indices, dtype=np.int64)]
+        if self.landmark is None:
+            return scores.copy()
+        now = utc_timestamp(now).timestamp()
+        return scores * np.exp(-self.decay_rate * (now - self.landmark))
+
+    def save(self, path='yacht_popularity_index'):
+        """
+        Зберігає скори і сегменти як директорію (.npy + metadata.json)
+        """
+        path = os.path.abspath(path)
+        with atomic_directory(path) as tmp_path:
+            save_array(tmp_path, 'scores', self.scores)
+            save_array(tmp_path, 'yacht_segments', self.yacht_segments)
+            id_type = save_ids(tmp_path, 'yacht_ids', self.yacht_ids)
+
+            write_metadata(tmp_path, {
+                'format_version': POPULARITY_FORMAT_VERSION,
+                'id_type': id_type,
+                'half_life_days': self.half_life_days,
+                'top_n': self.top_n,
+                'segments': [list(key) for key in self.segments],
+                'landmark': self.landmark,
+                'watermark': None if self.watermark is None else self.watermark.isoformat(),
+            })
+
+        print(f"✅ Popularity індекс збережено у {path}")
+
+    @classmethod
+    def load(cls, path='yacht_popularity_index'):
+        """
+        Завантажує індекс, збережений save() (top сегментів перебудовується)
+        """
+        metadata = read_metadata(path)
+
+        if metadata.get('format_version') != POPULARITY_FORMAT_VERSION:
+            raise ValueError(
+                f"Непідтримувана версія формату індексу: {metadata.get('format_version')} "
+                f"(очікується {POPULARITY_FORMAT_VERSION})"
+            )
+
+        yacht_ids = load_ids(path, 'yacht_ids', metadata['id_type'], mmap=False)
+
+        index = cls(pd.DataFrame({'id': [], 'country': [], 'type': []}),
+                    half_life_days=metadata['half_life_days'], top_n=metadata['top_n'])
+        index.yacht_ids = yacht_ids
+        index.yacht_id_to_idx = {yacht_id: idx for idx, yacht_id in enumerate(yacht_ids)}
+        index.yacht_segments = load_array(path, 'yacht_segments', mmap=False)
+        index.segments = [tuple(key) for key in metadata['segments']]
+        index.segment_to_code = {key: code for code, key in enumerate(index.segments)}
+        index.scores = load_array(path, 'scores', mmap=False)
+        index.landmark = metadata['landmark']
+        if metadata['watermark'] is not None:
+            index.watermark = pd.Timestamp(metadata['watermark'])
+
+        index.top = {None: []}
+        index.top.update({code: [] for code in range(len(index.segments))})
+        all_yachts = np.arange(len(yacht_ids))
+        index._merge_top(None, all_yachts)
+        for code in range(len(index.segments)):
+            index._merge_top(code, all_yachts[index.yacht_segments == code])
+
+        print(f"✅ Popularity індекс завантажено з {path}")
+        return index
+
+
+def _utc_seconds(values):
+    """
+    Секунди UTC (float64) для Series дат (naive значення вважаються UTC)
+    """
+    return (pd.to_datetime(values, utc=True) - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+
+
+# ============================================
+# ВИКОРИСТАННЯ (інкрементальний job)
+# ============================================
+
+if __name__ == "__main__":
+    engine = create_engine(os.getenv("DB_STRING"))
+    index_path = os.getenv("POPULARITY_INDEX_PATH", "yacht_popularity_index")
+
+    catalog = YachtCatalog.from_sql(engine, table='yachts', columns=['id', 'country', 'type'])
+    if os.path.exists(os.path.join(index_path, 'metadata.json')):
+        index = PopularityIndex.load(index_path).add_yachts(catalog)
+    else:
+        index = PopularityIndex(catalog)
+
+    # Тільки події після попереднього запуску
+    since = None if index.watermark is None else index.watermark.to_pydatetime()
+    n_events = index.update(load_events(engine, since=since))
+    index.save(index_path)
+
+    print(f"✅ Враховано {n_events} нових подій")
+    yacht_ids, scores = index.trending(top_n=10)
+    for yacht_id, score in zip(yacht_ids, scores):
+        print(f"   {yacht_id}: {score:.2f}")
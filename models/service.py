@@ -0,0 +1,544 @@
+import os
+import json
+import uuid
+import signal
+import socket
+import asyncio
+from contextlib import nullcontext
+from urllib.parse import urlsplit, parse_qs, unquote
+import numpy as np
+import dotenv
+
+from similar_yachts import YachtRecommender, FILTER_OVERFETCH, validate_filters
+from model_store import current_model_path
+
+dotenv.load_dotenv()
+
+# Скільки чекати на інші запити перед batched запитом до індексу
+BATCH_WAIT_MS = 2.0
+MAX_BATCH_SIZE = 256
+
+MAX_TOP_K = 100
+
+# Як часто worker перевіряє, чи опубліковано нову генерацію моделі
+MODEL_POLL_SECONDS = 5.0
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+
+
+class RecommendationBatcher:
+    """
+    Micro-batching запитів до YachtRecommender
+
+    Запити, що приходять протягом max_wait_ms, збираються в один batched
+    kneighbors (для яхт) або один recommend_for_profile на групу профілів
+    з однаковими фільтрами. Batch рахується в executor-і, щоб event loop
+    продовжував приймати запити.
+
+    swap_model() підміняє модель між batch-ами: кожен batch повністю
+    рахується однією моделлю.
+    """
+
+    def __init__(self, recommender, max_wait_ms=BATCH_WAIT_MS, max_batch_size=MAX_BATCH_SIZE,
+                 filter_overfetch=FILTER_OVERFETCH):
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.filter_overfetch = filter_overfetch
+        self.n_batches = 0
+        self.n_requests = 0
+        self._model = None
+        self._queue = None
+        self._task = None
+        self.swap_model(recommender)
+
+    @property
+    def recommender(self):
+        return self._model[0]
+
+    def swap_model(self, recommender):
+        """
+        Атомарно перемикає batcher на іншу модель (наступні batch-і)
+        """
+        # ID з URL приходять рядками, а в моделі можуть бути UUID
+        rows_by_str = {str(yacht_id): row for yacht_id, row in recommender.yacht_id_to_idx.items()}
+        self._model = (recommender, rows_by_str)
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._batch_loop())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def similar(self, yacht_id, top_k=10, filters=None):
+        """
+        Схожі яхти (як recommend()), список dict для JSON
+        """
+        return await self._submit(('yacht', yacht_id, top_k, filters or {}))
+
+    async def profile(self, profile, top_k=10, filters=None):
+        """
+        Яхти за профілем побажань (як recommend_for_profile()), список dict для JSON
+        """
+        return await self._submit(('profile', profile, top_k, filters or {}))
+
+    async def _submit(self, request):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((request, future))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self._run_batch, requests)
+            except Exception as e:
+                results = [e] * len(batch)
+
+            self.n_batches += 1
+            self.n_requests += len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _run_batch(self, requests):
+        """
+        Виконує batch запитів; повертає список результатів (або Exception) по запитах
+        """
+        recommender, rows_by_str = self._model
+        results = [None] * len(requests)
+
+        # ID з запиту → рядок моделі цього batch-у (один get_indexer на batch)
+        positions = [i for i, request in enumerate(requests) if request[0] == 'yacht']
+        rows = recommender.yacht_id_to_idx.rows([requests[i][1] for i in positions])
+        yacht_positions = []
+        for i, row in zip(positions, rows.tolist()):
+            request = requests[i]
+            if row < 0:
+                row = rows_by_str.get(str(request[1]), -1)
+            if row < 0:
+                results[i] = ValueError(f"Yacht ID {request[1]} не знайдено в датасеті")
+            else:
+                requests[i] = ('yacht', row, request[2], request[3])
+                yacht_positions.append(i)
+        if yacht_positions:
+            self._run_yacht_batch(recommender, [requests[i] for i in yacht_positions], yacht_positions, results)
+
+        # Профілі з однаковими фільтрами — один recommend_for_profile
+        profile_groups = {}
+        for i, request in enumerate(requests):
+            if request[0] == 'profile':
+                key = json.dumps(request[3], sort_keys=True, default=str)
+                profile_groups.setdefault(key, []).append(i)
+        for positions in profile_groups.values():
+            try:
+                filters = requests[positions[0]][3]
+                top_k = max(requests[i][2] for i in positions)
+                neighbor_ids, scores = recommender.recommend_for_profile(
+                    [requests[i][1] for i in positions], top_k=top_k, filters=filters
+                )
+                for row, i in enumerate(positions):
+                    n = min(requests[i][2], neighbor_ids.shape[1])
+                    indices = recommender.yacht_id_to_idx.rows(neighbor_ids[row, :n])
+                    results[i] = _records(recommender, indices, scores[row, :n])
+            except Exception as e:
+                for i in positions:
+                    results[i] = e
+
+        return results
+
+    def _run_yacht_batch(self, recommender, requests, positions, results):
+        """
+        Один search_rows (один kneighbors) для всіх яхт batch-у
+
+        requests — ('yacht', рядок каталогу, top_k, filters)
+        """
+        try:
+            rows = recommender.search_rows(
+                [request[1] for request in requests],
+                top_k=[request[2] for request in requests],
+                filters=[request[3] for request in requests],
+                filter_overfetch=self.filter_overfetch
+            )
+        except Exception as e:
+            for i in positions:
+                results[i] = e
+            return
+
+        for (row_indices, row_similarities), i in zip(rows, positions):
+            try:
+                results[i] = _records(recommender, row_indices, row_similarities)
+            except Exception as e:
+                results[i] = e
+
+
+class RecommendationServer:
+    """
+    Мінімальний HTTP/1.1 сервер (asyncio streams, keep-alive) з JSON API:
+
+        GET  /health
+        GET  /metrics                          (Prometheus text, якщо ввімкнено instrumentation)
+        GET  /similar/<yacht_id>?top_k=10
+        POST /search  {"yacht_id": ..., "top_k": 10, "filters": {...}}
+                      або {"profile": {...}, "top_k": 10, "filters": {...}}
+
+    З model_root сервер раз на poll_interval перевіряє symlink 'current'
+    (model_store.publish_model) і підміняє модель без рестарту: нова
+    генерація відкривається через mmap і прогрівається у фоні, а
+    запити до того часу обслуговує стара.
+    """
+
+    def __init__(self, recommender, host='0.0.0.0', port=8080, sock=None, model_root=None,
+                 model_path=None, poll_interval=MODEL_POLL_SECONDS, **batcher_params):
+        """
+        Args:
+            sock: вже відкритий listening socket (pre-fork worker-и ділять один socket)
+            model_root: директорія генерацій моделі для hot-swap (None — без hot-swap)
+            model_path: звідки завантажено recommender (за замовчуванням — поточна генерація)
+        """
+        self.recommender = recommender
+        self.host = host
+        self.port = port
+        self.sock = sock
+        self.model_root = model_root
+        if model_path is None and model_root:
+            model_path = current_model_path(model_root)
+        self.model_path = model_path
+        self.poll_interval = poll_interval
+        self.batcher_params = batcher_params
+        self.batcher = None
+        self._server = None
+        self._watcher = None
+        self._connections = set()
+
+    async def start(self):
+        self.batcher = RecommendationBatcher(self.recommender, **self.batcher_params).start()
+        if self.sock is not None:
+            self._server = await asyncio.start_server(self._handle_connection, sock=self.sock)
+        else:
+            self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.model_root:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch_model())
+        print(f"🚀 Сервіс рекомендацій слухає http://{self.host}:{self.port} (pid {os.getpid()})")
+        return self
+
+    async def _watch_model(self):
+        """
+        Hot-swap: нова генерація → load (mmap) + warm-up у executor-і → swap
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            model_path = current_model_path(self.model_root)
+            if model_path == self.model_path:
+                continue
+            try:
+                recommender = await loop.run_in_executor(None, load_warm_model, model_path)
+            except Exception as e:
+                print(f"❌ Не вдалося завантажити {model_path}: {e}")
+                continue
+            recommender.instrumentation = self.recommender.instrumentation
+            self.recommender = recommender
+            self.model_path = model_path
+            self.batcher.swap_model(recommender)
+            print(f"🔄 pid {os.getpid()}: модель → {os.path.basename(model_path)}")
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def _handle_connection(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = b''
+                if int(headers.get('content-length', 0)):
+                    body = await reader.readexactly(int(headers['content-length']))
+
+                status, payload = await self._dispatch(method, target, body)
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                if isinstance(payload, str):
+                    data, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+                else:
+                    data = json.dumps(payload, ensure_ascii=False, default=_json_default).encode('utf-8')
+                    content_type = 'application/json; charset=utf-8'
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, method, target, body):
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/health':
+                return 200, {
+                    'status': 'ok',
+                    'pid': os.getpid(),
+                    'model': os.path.basename(self.model_path) if self.model_path else None,
+                    'n_yachts': len(self.recommender.yacht_id_to_idx),
+                    'batches': self.batcher.n_batches,
+                    'requests': self.batcher.n_requests,
+                }
+
+            if url.path == '/metrics':
+                if self.recommender.instrumentation is None:
+                    return 404, {'error': 'Instrumentation вимкнено (METRICS=1)'}
+                return 200, self.recommender.instrumentation.to_prometheus()
+
+            if url.path.startswith('/similar/'):
+                if method != 'GET':
+                    return 405, {'error': 'Використайте GET'}
+                yacht_id = unquote(url.path[len('/similar/'):])
+                top_k = _parse_top_k(query.get('top_k', 10))
+                recommendations = await self.batcher.similar(yacht_id, top_k=top_k)
+                return 200, {'yacht_id': yacht_id, 'recommendations': recommendations}
+
+            if url.path == '/search':
+                if method != 'POST':
+                    return 405, {'error': 'Використайте POST'}
+                request = json.loads(body or b'{}')
+                # Типи перевіряються до черги batcher-а: інакше масив замість
+                # об'єкта дає 500, а рядковий profile — довільні яхти
+                if not isinstance(request, dict):
+                    raise ValueError(f"Тіло запиту має бути JSON об'єктом, отримано {type(request).__name__}")
+                top_k = _parse_top_k(request.get('top_k', 10))
+                filters = request.get('filters') or {}
+                validate_filters(filters)
+                if 'yacht_id' in request and (
+                        isinstance(request['yacht_id'], bool) or not isinstance(request['yacht_id'], (str, int))):
+                    raise ValueError(
+                        f"yacht_id має бути рядком або числом, отримано {type(request['yacht_id']).__name__}"
+                    )
+                if 'yacht_id' not in request and 'profile' in request and not isinstance(request['profile'], dict):
+                    raise ValueError(f"profile має бути об'єктом, отримано {type(request['profile']).__name__}")
+                if 'yacht_id' in request:
+                    recommendations = await self.batcher.similar(request['yacht_id'], top_k, filters)
+                elif 'profile' in request:
+                    recommendations = await self.batcher.profile(request['profile'], top_k, filters)
+                else:
+                    return 400, {'error': "Потрібне поле 'yacht_id' або 'profile'"}
+                return 200, {'recommendations': recommendations}
+
+            return 404, {'error': f"Невідомий шлях: {url.path}"}
+
+        except ValueError as e:
+            status = 404 if 'не знайдено' in str(e) else 400
+            return status, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': str(e)}
+
+
+def load_warm_model(model_path):
+    """
+    Відкриває модель через mmap і прогріває її, щоб перші запити після
+    старту / hot-swap не чекали на page faults
+    """
+    recommender = YachtRecommender.load_model(model_path, mmap=True)
+    warm_up(recommender)
+    return recommender
+
+
+def warm_up(recommender, n_queries=32):
+    """
+    Читає mmap масиви, потрібні запитам (resident_arrays(): для quantized —
+    тільки коди), щоб сторінки потрапили у page cache, і робить пробний
+    batched запит
+    """
+    for array in recommender.resident_arrays():
+        np.asarray(array).sum()
+
+    alive = np.flatnonzero(~recommender.removed)[:n_queries]
+    if len(alive):
+        recommender.batch_neighbors(alive, 10)
+
+
+def serve_prefork(model_root, host='0.0.0.0', port=8080, n_workers=None,
+                  poll_interval=MODEL_POLL_SECONDS, metrics=False, **batcher_params):
+    """
+    Pre-fork serving: батьківський процес відкриває модель через mmap і
+    listening socket, потім fork-ає n_workers worker-ів
+
+    Масиви моделі — mmap файлів генерації, тому всі worker-и ділять ті
+    самі сторінки page cache (read-only), а не тримають N копій. Кожен
+    worker сам підхоплює нову генерацію (hot-swap) і знову ділить її
+    сторінки з іншими. Впалий worker перезапускається.
+
+    metrics: кожен worker збирає власні метрики (GET /metrics)
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    sock = socket.create_server((host, port), backlog=1024)
+    sock.setblocking(False)
+
+    def load_parent_model():
+        model_path = current_model_path(model_root)
+        recommender = YachtRecommender.load_model(model_path, mmap=True)
+        # Тільки читання сторінок: BLAS потоки в батьківському процесі до fork не стартуємо
+        for array in recommender.resident_arrays():
+            np.asarray(array).sum()
+        return recommender, model_path
+
+    recommender, model_path = load_parent_model()
+
+    def spawn_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                if metrics:
+                    recommender.enable_instrumentation()
+                server = RecommendationServer(
+                    recommender, host=host, port=port, sock=sock, model_root=model_root,
+                    model_path=model_path, poll_interval=poll_interval, **batcher_params
+                )
+                asyncio.run(server.serve_forever())
+            finally:
+                os._exit(0)
+        return pid
+
+    workers = {spawn_worker() for _ in range(n_workers)}
+    print(f"🚀 Pre-fork: {n_workers} worker-ів на http://{host}:{port}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        workers.discard(pid)
+        if not stopping:
+            # Новий worker стартує з актуальної генерації батьківського процесу
+            print(f"⚠️ Worker {pid} завершився — перезапускаємо")
+            if current_model_path(model_root) != model_path:
+                recommender, model_path = load_parent_model()
+            workers.add(spawn_worker())
+
+    sock.close()
+
+
+def _parse_top_k(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"top_k має бути цілим числом, отримано {type(value).__name__}")
+    top_k = int(value)
+    if not 1 <= top_k <= MAX_TOP_K:
+        raise ValueError(f"top_k має бути від 1 до {MAX_TOP_K}")
+    return top_k
+
+
+def _records(recommender, indices, similarities):
+    """
+    Рядки каталогу + similarity_score як список dict (без проміжного DataFrame)
+    """
+    instrumentation = recommender.instrumentation
+    with nullcontext() if instrumentation is None else instrumentation.timer('stage', 'result_assembly'):
+        columns = {
+            column: [None if value != value else value for value in values[indices].tolist()]
+            for column, values in recommender.catalog.columns.items()
+        }
+        columns['similarity_score'] = np.asarray(similarities, dtype=np.float64).tolist()
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def _json_default(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} не серіалізується в JSON")
+
+
+if __name__ == "__main__":
+    # MODEL_ROOT — директорія генерацій (publish_model) або звичайна save_model()
+    model_root = os.getenv("MODEL_ROOT", "yacht_recommender_models")
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", 8080))
+    n_workers = int(os.getenv("WORKERS", 1))
+    max_wait_ms = float(os.getenv("BATCH_WAIT_MS", BATCH_WAIT_MS))
+    metrics = os.getenv("METRICS") == "1"
+
+    if n_workers > 1:
+        serve_prefork(model_root, host=host, port=port, n_workers=n_workers, metrics=metrics,
+                      max_wait_ms=max_wait_ms)
+    else:
+        recommender = load_warm_model(current_model_path(model_root))
+        if metrics:
+            recommender.enable_instrumentation()
+        server = RecommendationServer(
+            recommender, host=host, port=port, model_root=model_root, max_wait_ms=max_wait_ms
+        )
+        asyncio.run(server.serve_forever())
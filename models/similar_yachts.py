@@ -1,138 +1,216 @@
 import os
 import pandas as pd
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
-from sklearn.preprocessing import StandardScaler, MinMaxScaler
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
+from sklearn.metrics.pairwise import pairwise_distances, paired_distances
 import pickle
+import tempfile
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from threadpoolctl import threadpool_limits
 from sqlalchemy import create_engine
-from tqdm import tqdm
 import dotenv
 
+from ann_index import build_index, recall_report
+from feature_encoder import YachtFeatureEncoder
+from catalog import YachtCatalog, IdIndex, CATALOG_COLUMNS
+from cold_recommendations import write_cold_recommendations
+from model_store import (
+    publish_model, atomic_directory, write_metadata, read_metadata, save_ids, load_ids,
+    save_array as save_model_array, load_array as load_model_array
+)
+from instrumentation import Instrumentation, instrumented
+
 dotenv.load_dotenv()
 
+# Версія формату директорії моделі (save_model / load_model)
+# 2 — нормалізація та словники зберігаються як feature encoder
+MODEL_FORMAT_VERSION = 2
+
+# search_rows() з фільтрами бере top_k × FILTER_OVERFETCH сусідів і фільтрує їх;
+# якщо не вистачає — точний filtered search для цього запиту
+FILTER_OVERFETCH = 4
+
+# Фільтри recommend(): списки значень та числові пороги
+LIST_FILTERS = ('countries', 'types')
+NUMERIC_FILTERS = ('max_price', 'min_guests')
+
 class YachtRecommender:
     """
     Content-based yacht recommender using KNN
     для холодного старту (схожі яхти на основі поточної)
     """
     
-    def __init__(self, df: pd.DataFrame):
+    def __init__(self, df: pd.DataFrame, catalog_columns=CATALOG_COLUMNS):
         """
         Args:
-            df: DataFrame з яхтами (yachts_data_filled.csv)
+            df: DataFrame з яхтами (yachts_data_filled.csv) або готовий YachtCatalog
+            catalog_columns: колонки, які залишаються в каталозі (None — всі)
         """
-        self.df = df.copy()
-        self.feature_matrix = None
+        # Колонковий каталог замість копії DataFrame: df не копіюється цілком
+        if isinstance(df, YachtCatalog):
+            self.catalog = df
+        else:
+            self.catalog = YachtCatalog.from_frame(df, columns=catalog_columns)
+        self.feature_matrix = None  # pandas frame (опціонально, keep_feature_frame=True)
+        self.feature_matrix_scaled = None  # contiguous float32 масив для запитів
+        # (з index='quantized' після load_model — mmap, з якого читаються лише
+        # окремі рядки: запити та rerank кандидатів; див. resident_arrays)
+        self.feature_names = []
         self.knn_model = None
-        self.scaler = None
-        self.yacht_id_to_idx = {}
-        self.idx_to_yacht_id = {}
+        self.index_name = 'exact'
+        self.index_params = {}
+        self.encoder = None  # YachtFeatureEncoder: словники + нормалізація
+        self.yacht_ids = None
+        self._id_index = None  # IdIndex над yacht_ids / removed (див. yacht_id_to_idx)
+        self.filter_index = None
+        self.neighbor_indices = None  # (n_yachts × K) int32, опціонально
+        self.neighbor_scores = None   # (n_yachts × K) float32
+        self.reverse_indptr = None    # reverse index: яхта → рядки таблиці, де вона сусід (CSR)
+        self.reverse_indices = None
+        self.changed_lists = None     # рядки таблиці, змінені після pop_changed_lists()
+        self.removed = None           # tombstones видалених яхт (до compact())
+        self.n_removed = 0
+        self.instrumentation = None   # Instrumentation (opt-in, enable_instrumentation())
+    
+    @property
+    def yacht_id_to_idx(self):
+        """
+        ID яхти → рядок (IdIndex, без видалених яхт)
         
-    def prepare_features(self):
+        Mapping перебудовується, коли змінюються масиви yacht_ids або
+        removed (fit, add_yachts, compact, load_model); хеш-таблиця ID
+        будується лише при першому пошуку.
         """
-        Створює feature matrix для KNN
+        index = self._id_index
+        if index is None or index.ids is not self.yacht_ids or index.removed is not self.removed:
+            ids = self.yacht_ids if self.yacht_ids is not None else np.empty(0, dtype=object)
+            index = self._id_index = IdIndex(ids, self.removed)
+        return index
+    
+    @property
+    def idx_to_yacht_id(self):
         """
-        df = self.df.copy()
-        
-        # 1. NUMERICAL FEATURES (нормалізовані)
-        numerical_features = ['guests', 'cabins', 'crew', 'length', 'year', 'rating']
-        
-        # 3. PRICE FEATURES (важливо для схожості!)
-        df['avg_price'] = (
-            df['summerLowSeasonPrice'] + 
-            df['summerHighSeasonPrice'] +
-            df['winterLowSeasonPrice'] + 
-            df['winterHighSeasonPrice']
-        ) / 4
-        
-        # Log transform для ціни (щоб зменшити вплив outliers)
-        df['log_price'] = np.log1p(df['avg_price'])
-        
-        # 4. RATING
-        df['rating'] = pd.to_numeric(df['rating'], errors='coerce').fillna(4.0)
-        
-        # 5. CATEGORICAL FEATURES (one-hot encoding)
-        # Type
-        type_dummies = pd.get_dummies(df['type'], prefix='type')
-        
-        # Base Marina (топ-15 марін, решта → "Other")
-        top_marinas = df['baseMarina'].value_counts().index
-        df['marina_grouped'] = df['baseMarina'].apply(
-            lambda x: x if x in top_marinas else 'Other'
-        )
-        marina_dummies = pd.get_dummies(df['marina_grouped'], prefix='marina')
-        
-        # Country
-        country_dummies = pd.get_dummies(df['country'], prefix='country')
-        
-        # 6. COMBINE ALL FEATURES
-        feature_cols = (
-            numerical_features + 
-            ['log_price']
-        )
+        Рядок → ID яхти (без видалених яхт)
+        """
+        return self.yacht_id_to_idx.by_row
+    
+    def enable_instrumentation(self, instrumentation=None):
+        """
+        Вмикає метрики: час етапів (feature build, scaling, index build,
+        neighbor query, filter, result assembly), латентність recommend і
+        batch API, лічильники нестачі рядків після фільтрів
         
-        numerical_df = df[feature_cols]
+        Returns:
+            Instrumentation (snapshot(), to_prometheus(), write_prometheus())
+        """
+        self.instrumentation = instrumentation or Instrumentation()
+        return self.instrumentation
+    
+    def _timed(self, name, kind='stage'):
+        if self.instrumentation is None:
+            return nullcontext()
+        return self.instrumentation.timer(kind, name)
+    
+    def _count(self, name, value=1):
+        if self.instrumentation is not None:
+            self.instrumentation.increment(name, value)
+    
+    @property
+    def df(self):
+        """
+        Каталог як DataFrame (view на колонки каталогу, без копії)
+        """
+        return self.catalog.to_frame()
         
-        # Concatenate з categorical
-        feature_matrix = pd.concat([
-            numerical_df,
-            type_dummies,
-            marina_dummies,
-            country_dummies
-        ], axis=1)
+    @instrumented('feature_build', kind='stage')
+    def prepare_features(self, df=None):
+        """
+        Створює (ненормалізовану) feature matrix для KNN як DataFrame
         
-        # Заповнюємо будь-які залишкові NaN нулями
-        feature_matrix = feature_matrix.fillna(0)
+        Args:
+            df: яхти для кодування (за замовчуванням — весь каталог)
+        """
+        df = self.df if df is None else df
+        if self.encoder is None:
+            self.encoder = YachtFeatureEncoder().fit(df)
         
-        print(f"✅ Feature matrix створено: {feature_matrix.shape}")
-        print(f"   Numerical features: {len(feature_cols)}")
-        print(f"   Type dummies: {type_dummies.shape[1]}")
-        print(f"   Marina dummies: {marina_dummies.shape[1]}")
-        print(f"   Country dummies: {country_dummies.shape[1]}")
+        features = self.encoder.transform(df, scale=False)
+        if sp.issparse(features):
+            features = features.toarray()
         
-        return feature_matrix
+        return pd.DataFrame(features, columns=self.encoder.feature_names, index=df.index)
     
-    def fit(self, n_neighbors=11, metric='cosine'):
+    def fit(self, n_neighbors=11, metric='cosine', keep_feature_frame=False, sparse=False,
+            precompute_k=None, index='exact', index_params=None, top_marinas=15):
         """
         Тренує KNN модель
         
         Args:
             n_neighbors: скільки сусідів шукати (11 = 10 recommendations + сама яхта)
             metric: 'cosine', 'euclidean', 'manhattan'
+            keep_feature_frame: зберігати pandas feature_matrix (для дебагу).
+                Запити використовують тільки feature_matrix_scaled.
+            sparse: зберігати features як CSR. Numerical колонки стандартизуються
+                як завжди, а one-hot блок тільки масштабується (без центрування),
+                тому нулі залишаються нулями і пам'ять росте лінійно з рядками.
+            precompute_k: якщо задано — одразу будує таблицю K сусідів для всіх яхт
+                (build_neighbor_table), і recommend() стає простим slice.
+            index: backend індексу сусідів — 'exact' (sklearn NearestNeighbors),
+                'lsh' (наближений, для великих каталогів), 'blocked' (точний
+                блочний cosine для batch задач) або 'quantized' (int8/float16
+                scoring з опційним float32 rerank); див. ann_index.py
+            index_params: параметри backend-у, напр. {'n_tables': 8, 'n_bits': 10},
+                {'block_size': 1024, 'n_threads': 4} або {'dtype': 'int8', 'rerank': 4}
+            top_marinas: скільки марін отримують окрему one-hot колонку (решта → "Other")
         """
         print(f"\n🔧 Тренування KNN моделі (n_neighbors={n_neighbors}, metric={metric})...")
         
-        # Prepare features
-        self.feature_matrix = self.prepare_features()
+        # Словники категорій + нормалізація (важливо для euclidean/manhattan)
+        df = self.df
+        with self._timed('scaling'):
+            self.encoder = YachtFeatureEncoder(top_marinas=top_marinas).fit(df, sparse=sparse)
+        self.feature_names = self.encoder.feature_names
         
-        # Normalize features (важливо для euclidean/manhattan)
-        self.scaler = StandardScaler()
-        feature_matrix_scaled = self.scaler.fit_transform(self.feature_matrix.values)
+        # Зберігаємо одну float32 копію — її ж використовує KNN індекс
+        with self._timed('feature_build'):
+            self.feature_matrix_scaled = self.encoder.transform(df)
+        self.feature_matrix = self.prepare_features(df) if keep_feature_frame else None
         
-        # Створюємо mapping yacht_id ↔ index
-        if 'id' in self.df.columns:
-            self.yacht_id_to_idx = {yacht_id: idx for idx, yacht_id in enumerate(self.df['id'])}
-            self.idx_to_yacht_id = {idx: yacht_id for yacht_id, idx in self.yacht_id_to_idx.items()}
+        # Масив ID для векторизованого idx → yacht_id (колонка 'id' каталогу, без копії)
+        if 'id' in self.catalog:
+            self.yacht_ids = self.catalog['id']
         else:
             # Якщо немає колонки 'id', використовуємо row index
-            self.yacht_id_to_idx = {idx: idx for idx in range(len(self.df))}
-            self.idx_to_yacht_id = self.yacht_id_to_idx
+            self.yacht_ids = np.arange(len(self.catalog)).astype(object)
         
         # Train KNN
-        self.knn_model = NearestNeighbors(
-            n_neighbors=n_neighbors,
-            metric=metric,
-            algorithm='auto',  # автоматично обирає ball_tree, kd_tree або brute
-            n_jobs=-1  # використовує всі CPU cores
-        )
+        self.index_name = index
+        self.index_params = dict(index_params or {})
+        self.knn_model = build_index(index, n_neighbors=n_neighbors, metric=metric, **self.index_params)
+        
+        with self._timed('index_build'):
+            self.knn_model.fit(self.feature_matrix_scaled)
         
-        self.knn_model.fit(feature_matrix_scaled)
+        self.removed = np.zeros(len(self.yacht_ids), dtype=bool)
+        self.n_removed = 0
+        
+        self._build_filter_index()
+        
+        self.neighbor_indices = None
+        self.neighbor_scores = None
+        self.reverse_indptr = None
+        self.reverse_indices = None
+        self.changed_lists = None
+        if precompute_k:
+            self.build_neighbor_table(precompute_k)
         
         print(f"✅ KNN модель натренована!")
         
         return self
     
+    @instrumented('recommend')
     def recommend(self, yacht_id, top_k=10, filters=None):
         """
         Рекомендує схожі яхти на основі yacht_id
@@ -150,6 +228,10 @@ class YachtRecommender:
         
         Returns:
             DataFrame з рекомендованими яхтами
+        
+        З фільтрами спочатку звужуємо кандидатів (filter_index), а потім
+        ранжуємо тільки їх — тому завжди повертається top_k рядків, якщо
+        під фільтри підходить достатньо яхт.
         """
         if self.knn_model is None:
             raise ValueError("Модель не натренована! Спочатку викличте .fit()")
@@ -158,62 +240,753 @@ class YachtRecommender:
         if yacht_id not in self.yacht_id_to_idx:
             raise ValueError(f"Yacht ID {yacht_id} не знайдено в датасеті")
         
+        validate_filters(filters)
         yacht_idx = self.yacht_id_to_idx[yacht_id]
+        top_k = max(top_k, 0)
         
-        # Отримуємо feature vector цієї яхти
-        yacht_feature_series = self.feature_matrix.iloc[yacht_idx]
+        # Передобчислена таблиця: slice + векторизований фільтр, без sklearn
+        if self.neighbor_indices is not None and top_k <= self.neighbor_indices.shape[1]:
+            indices = self.neighbor_indices[yacht_idx]
+            similarities = self.neighbor_scores[yacht_idx]
+            
+            mask = self._filter_mask(filters or {}, indices)
+            indices, similarities = indices[mask], similarities[mask]
+            
+            # Якщо після фільтрів (і видалених яхт) рядків вистачає — повертаємо
+            # одразу, інакше переходимо до пошуку нижче
+            if len(indices) >= top_k:
+                return self._build_recommendations(indices[:top_k], similarities[:top_k])
+            self._count('neighbor_table_shortfall')
         
-        # 2. Отримуємо .values, робимо .reshape(1, -1) і передаємо в transform
-        yacht_features = self.scaler.transform(yacht_feature_series.values.reshape(1, -1))
+        # Вже нормалізований feature vector цієї яхти (без повторного transform)
+        yacht_features = self.feature_matrix_scaled[yacht_idx:yacht_idx + 1]
         
-        # Знаходимо k найближчих сусідів
-        distances, indices = self.knn_model.kneighbors(yacht_features)
+        if filters:
+            candidates = self._filter_candidates(filters, exclude_idx=yacht_idx)
+            indices, distances = self._rank_candidates(yacht_features, candidates, top_k)
+            if len(indices) < top_k:
+                self._count('filter_shortfall')
+            return self._build_recommendations(indices, self.distances_to_similarity(distances))
         
-        # Видаляємо саму яхту (перший елемент)
-        distances = distances[0][1:]
-        indices = indices[0][1:]
+        # Знаходимо k найближчих сусідів (без самої яхти та видалених)
+        indices, similarities = self.batch_neighbors(np.array([yacht_idx]), top_k)
         
-        # Конвертуємо distance в similarity score (для cosine: 1 - distance)
-        if self.knn_model.metric == 'cosine':
-            similarities = 1 - distances
+        # Повертаємо топ-K
+        return self._build_recommendations(indices[0], similarities[0])
+    
+    def _build_filter_index(self):
+        """
+        Передобчислені структури для filtered search:
+        рядки по кожній країні / типу та відсортовані ціни й кількість гостей
+        """
+        price = np.asarray(self.catalog['summerLowSeasonPrice'], dtype=np.float64)
+        guests = np.asarray(self.catalog['guests'], dtype=np.float64)
+        
+        # np.argsort ставить NaN в кінець — їх відсікаємо через *_valid
+        price_order = np.argsort(price, kind='stable')
+        guests_order = np.argsort(guests, kind='stable')
+        
+        self.filter_index = {
+            'country': self.catalog.group_indices('country'),
+            'type': self.catalog.group_indices('type'),
+            # Значення по рядках — для фільтрації передобчислених сусідів
+            'price': price,
+            'guests': guests,
+            'price_order': price_order,
+            'price_sorted': price[price_order],
+            'price_valid': int(np.count_nonzero(~np.isnan(price))),
+            'guests_order': guests_order,
+            'guests_sorted': guests[guests_order],
+            'guests_valid': int(np.count_nonzero(~np.isnan(guests))),
+        }
+    
+    @instrumented('filter', kind='stage')
+    def _filter_candidates(self, filters, exclude_idx=None):
+        """
+        Повертає відсортований масив рядків, що проходять усі фільтри
+        """
+        if self.filter_index is None:
+            self._build_filter_index()
+        index = self.filter_index
+        
+        candidate_sets = []
+        
+        if 'max_price' in filters:
+            end = np.searchsorted(
+                index['price_sorted'][:index['price_valid']], filters['max_price'], side='right'
+            )
+            candidate_sets.append(index['price_order'][:end])
+        
+        if 'min_guests' in filters:
+            start = np.searchsorted(
+                index['guests_sorted'][:index['guests_valid']], filters['min_guests'], side='left'
+            )
+            candidate_sets.append(index['guests_order'][start:index['guests_valid']])
+        
+        for key, group in (('countries', 'country'), ('types', 'type')):
+            if key in filters and filters[key]:
+                rows = [index[group][value] for value in filters[key] if value in index[group]]
+                candidate_sets.append(
+                    np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+                )
+        
+        if candidate_sets:
+            # Перетинаємо, починаючи з найменшої множини
+            candidate_sets.sort(key=len)
+            candidates = np.sort(candidate_sets[0])
+            for rows in candidate_sets[1:]:
+                candidates = np.intersect1d(candidates, rows, assume_unique=True)
+        else:
+            candidates = np.arange(len(self.yacht_ids))
+        
+        if exclude_idx is not None:
+            candidates = candidates[candidates != exclude_idx]
+        
+        if self.n_removed:
+            candidates = candidates[~self.removed[candidates]]
+        
+        return candidates
+    
+    @instrumented('filter', kind='stage')
+    def _filter_mask(self, filters, indices):
+        """
+        Булева маска для масиву рядків indices (ті ж правила, що й _filter_candidates)
+        """
+        if self.filter_index is None:
+            self._build_filter_index()
+        index = self.filter_index
+        
+        mask = np.ones(len(indices), dtype=bool)
+        
+        if self.n_removed:
+            mask &= ~self.removed[indices]
+        
+        if 'max_price' in filters:
+            mask &= index['price'][indices] <= filters['max_price']
+        
+        if 'min_guests' in filters:
+            mask &= index['guests'][indices] >= filters['min_guests']
+        
+        # Порівнюємо коди категорій, а не рядки
+        for key, column in (('countries', 'country'), ('types', 'type')):
+            if key in filters and filters[key]:
+                wanted = self.catalog.codes(column, filters[key])
+                mask &= np.isin(self.catalog.codes(column)[indices], wanted[wanted >= 0])
+        
+        return mask
+    
+    @instrumented('neighbor_query', kind='stage')
+    def _rank_candidates(self, query_features, candidates, top_k):
+        """
+        Точне ранжування тільки серед кандидатів (вже відфільтрованих)
+        """
+        if len(candidates) == 0 or top_k <= 0:
+            return candidates[:0], np.empty(0, dtype=np.float32)
+        
+        distances = pairwise_distances(
+            query_features,
+            self.feature_matrix_scaled[candidates],
+            metric=self.knn_model.metric
+        )[0]
+        
+        if len(candidates) > top_k:
+            top = np.argpartition(distances, top_k - 1)[:top_k]
         else:
-            # Для euclidean/manhattan: нормалізуємо до [0, 1]
-            max_dist = distances.max() if distances.max() > 0 else 1
-            similarities = 1 - (distances / max_dist)
+            top = np.arange(len(candidates))
+        top = top[np.argsort(distances[top], kind='stable')]
         
-        # Створюємо DataFrame з рекомендаціями
-        recommendations = []
-        for idx, similarity in zip(indices, similarities):
-            yacht_data = self.df.iloc[idx].copy()
-            yacht_data['similarity_score'] = similarity
-            recommendations.append(yacht_data)
+        return candidates[top], distances[top]
+    
+    @instrumented('result_assembly', kind='stage')
+    def _build_recommendations(self, indices, similarities):
+        """
+        Збирає DataFrame з рекомендаціями одним take по індексах
+        """
+        recommendations_df = self.catalog.take(indices)
+        recommendations_df['similarity_score'] = similarities
+        return recommendations_df
+    
+    @instrumented('recommend_many')
+    def recommend_many(self, yacht_ids, top_k=10):
+        """
+        Рекомендації для багатьох яхт одним batched запитом до KNN
+        
+        На відміну від recommend(), не будує DataFrame для кожної яхти,
+        а повертає компактні масиви (рядок i — рекомендації для yacht_ids[i]).
+        
+        Args:
+            yacht_ids: список ID яхт
+            top_k: скільки рекомендацій на яхту
+        
+        Returns:
+            (neighbor_ids, scores): масиви shape (len(yacht_ids), top_k)
+        """
+        if self.knn_model is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
         
-        recommendations_df = pd.DataFrame(recommendations)
+        query_idx = self.yacht_id_to_idx.rows(yacht_ids)
+        missing = np.flatnonzero(query_idx < 0)
+        if len(missing):
+            raise ValueError(f"Yacht ID {yacht_ids[missing[0]]} не знайдено в датасеті")
+        
+        indices, similarities = self.batch_neighbors(query_idx, top_k)
+        
+        neighbor_ids = self.yacht_ids[indices]
+        return neighbor_ids, similarities
+    
+    @instrumented('search_rows')
+    def search_rows(self, query_idx, top_k, filters=None, filter_overfetch=FILTER_OVERFETCH):
+        """
+        Batched пошук сусідів для рядків каталогу з фільтрами по кожному запиту
+        
+        Один kneighbors на весь batch (з фільтрами — top_k × filter_overfetch
+        сусідів), далі фільтри маскою по цих сусідах. Запит, для якого
+        лишилось менше top_k, добирається точним filtered search (як recommend()).
+        
+        Args:
+            query_idx: рядки каталогу (yacht_id_to_idx[yacht_id])
+            top_k: int або послідовність top_k по запитах
+            filters: None, dict (спільний для всіх) або послідовність dict / None по запитах
+            filter_overfetch: у скільки разів більше сусідів брати для фільтрації
+        
+        Returns:
+            список (indices, similarities) по запитах: рядки каталогу, не більше top_k
+        """
+        if self.knn_model is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+        
+        query_idx = np.asarray(query_idx, dtype=np.int64)
+        top_ks = [top_k] * len(query_idx) if np.isscalar(top_k) else list(top_k)
+        filters = [filters] * len(query_idx) if filters is None or isinstance(filters, dict) else list(filters)
+        if len(top_ks) != len(query_idx) or len(filters) != len(query_idx):
+            raise ValueError("top_k і filters мають містити по значенню на кожен запит")
+        for row_filters in filters:
+            validate_filters(row_filters)
+        if not len(query_idx):
+            return []
+        
+        n_fetch = max(
+            max(row_top_k, 0) * (filter_overfetch if row_filters else 1)
+            for row_top_k, row_filters in zip(top_ks, filters)
+        )
+        indices, similarities = self.batch_neighbors(query_idx, n_fetch)
+        
+        results = []
+        for row, (yacht_idx, row_top_k, row_filters) in enumerate(zip(query_idx, top_ks, filters)):
+            row_top_k = max(row_top_k, 0)
+            row_indices, row_similarities = indices[row], similarities[row]
+            if row_filters:
+                mask = self._filter_mask(row_filters, row_indices)
+                row_indices, row_similarities = row_indices[mask], row_similarities[mask]
+                if len(row_indices) < row_top_k:
+                    # Фільтр відсік забагато сусідів — точний filtered search
+                    self._count('overfetch_shortfall')
+                    candidates = self._filter_candidates(row_filters, exclude_idx=yacht_idx)
+                    row_indices, distances = self._rank_candidates(
+                        self.feature_matrix_scaled[yacht_idx:yacht_idx + 1], candidates, row_top_k
+                    )
+                    row_similarities = self.distances_to_similarity(distances)
+            results.append((row_indices[:row_top_k], row_similarities[:row_top_k]))
+        
+        return results
+    
+    @instrumented('recommend_all')
+    def recommend_all(self, top_k=10, n_jobs=1, shard_size=4096):
+        """
+        Рекомендації для всіх яхт каталогу (нічний rebuild cold_recommendations)
+        
+        Args:
+            n_jobs: кількість процесів (-1 — всі ядра); див. _sharded_neighbors
+            shard_size: рядків-запитів на один shard
+        
+        Returns:
+            (yacht_ids, neighbor_ids, scores)
+        """
+        if self.knn_model is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+        
+        query_idx = np.arange(len(self.yacht_ids))
+        if self.n_removed:
+            query_idx = query_idx[~self.removed]
+        indices, similarities = self._sharded_neighbors(query_idx, top_k, n_jobs, shard_size)
+        
+        return self.yacht_ids[query_idx], self.yacht_ids[indices], similarities
+    
+    @instrumented('build_neighbor_table')
+    def build_neighbor_table(self, k=20, n_jobs=1, shard_size=4096):
+        """
+        Передобчислює K сусідів для кожної яхти (для статичного каталогу)
+        
+        Після цього recommend() з top_k <= k не звертається до KNN моделі.
+        Для euclidean/manhattan score нормалізовано в межах K сусідів рядка.
+        
+        Args:
+            n_jobs, shard_size: паралельний build, як у recommend_all()
+        """
+        if self.knn_model is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+        
+        indices, similarities = self._sharded_neighbors(np.arange(len(self.yacht_ids)), k, n_jobs, shard_size)
+        
+        self.neighbor_indices = np.ascontiguousarray(indices, dtype=np.int32)
+        self.neighbor_scores = np.ascontiguousarray(similarities, dtype=np.float32)
+        self._build_reverse_index()
+        self.changed_lists = ~self.removed
+        
+        print(f"✅ Таблиця сусідів побудована: {self.neighbor_indices.shape}")
+        return self
+    
+    def pop_changed_lists(self):
+        """
+        Рядки таблиці сусідів, які змінились після попереднього виклику
+        (build_neighbor_table, add/update/remove_yachts) — для delta запису
+        в cold_recommendations. Скидає позначки.
+        
+        Returns:
+            масив індексів рядків (живих яхт)
+        """
+        if self.neighbor_indices is None:
+            raise ValueError("Таблиця сусідів не побудована! Спочатку викличте .build_neighbor_table()")
+        
+        rows = np.flatnonzero(self.changed_lists & ~self.removed)
+        self.changed_lists = np.zeros(len(self.yacht_ids), dtype=bool)
+        return rows
+    
+    def _build_reverse_index(self):
+        """
+        Reverse index таблиці сусідів у CSR вигляді: рядки, в яких яхта j
+        є сусідом — reverse_indices[reverse_indptr[j]:reverse_indptr[j + 1]]
+        """
+        k = self.neighbor_indices.shape[1]
+        flat = self.neighbor_indices.ravel()
+        order = np.argsort(flat, kind='stable')
+        
+        self.reverse_indices = (order // max(k, 1)).astype(np.int32)
+        self.reverse_indptr = np.searchsorted(flat[order], np.arange(len(self.yacht_ids) + 1)).astype(np.int64)
+    
+    def _reverse_lookup(self, idx):
+        """
+        Рядки таблиці сусідів, що містять будь-яку з яхт idx
+        """
+        idx = idx[idx < len(self.reverse_indptr) - 1]
+        if len(idx) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([
+            self.reverse_indices[self.reverse_indptr[i]:self.reverse_indptr[i + 1]] for i in idx
+        ])
+    
+    def _affected_rows(self, changed_idx, entering=True, block_size=256):
+        """
+        Рядки таблиці сусідів, які треба перерахувати після зміни changed_idx:
+        власні списки змінених яхт, списки, де вони вже є (reverse index),
+        і (entering=True) списки, куди вони тепер мають потрапити — там
+        відстань до зміненої яхти менша за відстань до K-го сусіда.
+        """
+        n_rows = len(self.yacht_ids)
+        affected = np.zeros(n_rows, dtype=bool)
+        affected[changed_idx] = True
+        affected[self._reverse_lookup(changed_idx)] = True
+        
+        if entering:
+            metric = self.knn_model.metric
+            table_rows = np.arange(len(self.neighbor_indices))
+            if metric == 'cosine':
+                kth_distance = 1 - self.neighbor_scores[:, -1].astype(np.float64)
+            else:
+                # euclidean/manhattan scores нормалізовані по рядку — рахуємо відстань
+                kth_distance = paired_distances(
+                    self.feature_matrix_scaled[table_rows],
+                    self.feature_matrix_scaled[self.neighbor_indices[:, -1]],
+                    metric=metric
+                )
+            
+            for start in range(0, len(changed_idx), block_size):
+                block = changed_idx[start:start + block_size]
+                distances = pairwise_distances(
+                    self.feature_matrix_scaled[block],
+                    self.feature_matrix_scaled[:len(table_rows)],
+                    metric=metric
+                )
+                affected[table_rows[(distances < kth_distance).any(axis=0)]] = True
+        
+        affected &= ~self.removed
+        return np.flatnonzero(affected)
+    
+    @instrumented('recommend_for_profile')
+    def recommend_for_profile(self, profiles, top_k=10, filters=None):
+        """
+        Рекомендації для нових користувачів за частковим профілем
+        (холодний старт без історії), одним batched запитом до індексу
+        
+        Args:
+            profiles: список dict (або один dict), напр.
+                {'guests': 8, 'budget': 20000, 'country': 'Italy', 'type': 'Motor Yachts'}
+                Поля: guests, cabins, crew, length, year, rating, budget,
+                type, marina, country — відсутні поля не впливають на схожість
+            top_k: скільки рекомендацій на профіль
+            filters: dict з фільтрами як у recommend() (спільні для всіх профілів)
+        
+        Returns:
+            (neighbor_ids, scores): масиви shape (len(profiles), top_k)
+        """
+        if self.knn_model is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+        
+        if isinstance(profiles, dict):
+            profiles = [profiles]
+        validate_filters(filters)
+        
+        with self._timed('feature_build'):
+            queries = self.encoder.transform_profiles(profiles)
         
-        # Застосовуємо фільтри (якщо є)
         if filters:
-            if 'max_price' in filters:
-                recommendations_df = recommendations_df[
-                    recommendations_df['summerLowSeasonPrice'] <= filters['max_price']
-                ]
+            candidates = self._filter_candidates(filters)
+            if len(candidates) < top_k:
+                self._count('filter_shortfall', len(profiles))
+            top_k = min(top_k, len(candidates))
+            if top_k == 0:
+                return (np.empty((len(profiles), 0), dtype=object),
+                        np.empty((len(profiles), 0), dtype=np.float32))
             
-            if 'min_guests' in filters:
-                recommendations_df = recommendations_df[
-                    recommendations_df['guests'] >= filters['min_guests']
-                ]
+            # Кандидати спільні для всіх профілів — одна матриця відстаней
+            with self._timed('neighbor_query'):
+                distances = pairwise_distances(
+                    queries, self.feature_matrix_scaled[candidates], metric=self.knn_model.metric
+                )
+                top = np.argpartition(distances, top_k - 1, axis=1)[:, :top_k]
+                top_distances = np.take_along_axis(distances, top, axis=1)
+                order = np.argsort(top_distances, axis=1, kind='stable')
             
-            if 'countries' in filters and filters['countries']:
-                recommendations_df = recommendations_df[
-                    recommendations_df['country'].isin(filters['countries'])
-                ]
+            indices = candidates[np.take_along_axis(top, order, axis=1)]
+            similarities = self.distances_to_similarity(np.take_along_axis(top_distances, order, axis=1))
+        else:
+            indices, similarities = self._query_neighbors(queries, top_k)
+        
+        return self.yacht_ids[indices], similarities
+    
+    def _sharded_neighbors(self, query_idx, top_k, n_jobs=1, shard_size=4096):
+        """
+        batch_neighbors, розбитий на shards по shard_size рядків-запитів
+        і виконаний у ProcessPoolExecutor
+        
+        Модель один раз зберігається у тимчасову директорію (save_model), і
+        кожен worker відкриває її через mmap — feature matrix не pickle-ться
+        в процеси, а ділиться через page cache. Кожен worker рахує в один
+        потік BLAS, тому час масштабується з кількістю ядер. Результати
+        склеюються в порядку shards, тому вихід не залежить від n_jobs.
+        """
+        n_jobs = (os.cpu_count() or 1) if n_jobs == -1 else n_jobs
+        shards = [query_idx[start:start + shard_size] for start in range(0, len(query_idx), shard_size)]
+        if n_jobs <= 1 or len(shards) <= 1:
+            return self.batch_neighbors(query_idx, top_k)
+        
+        with tempfile.TemporaryDirectory(prefix='yacht_model_') as tmp_dir:
+            model_path = os.path.join(tmp_dir, 'model')
+            self.save_model(model_path)
             
-            if 'types' in filters and filters['types']:
-                recommendations_df = recommendations_df[
-                    recommendations_df['type'].isin(filters['types'])
-                ]
+            print(f"🚀 Паралельний build: {len(shards)} shards × {shard_size} рядків, {n_jobs} процесів")
+            with ProcessPoolExecutor(
+                max_workers=min(n_jobs, len(shards)),
+                initializer=_init_shard_worker,
+                initargs=(model_path,)
+            ) as executor:
+                # map повертає результати в порядку shards
+                results = list(executor.map(_shard_neighbors, shards, repeat(top_k)))
         
-        # Повертаємо топ-K
-        return recommendations_df.head(top_k)
+        indices = np.concatenate([indices for indices, _ in results])
+        similarities = np.concatenate([similarities for _, similarities in results])
+        return indices, similarities
+    
+    def batch_neighbors(self, query_idx, top_k):
+        """
+        Один kneighbors по вже нормалізованій матриці для всіх query рядків
+        (query_idx — рядки каталогу, yacht_id_to_idx[yacht_id]).
+        Повертає (indices, similarities) без самих query яхт.
+        """
+        return self._query_neighbors(
+            self.feature_matrix_scaled[query_idx], top_k, exclude_idx=query_idx
+        )
+    
+    @instrumented('neighbor_query', kind='stage')
+    def _query_neighbors(self, queries, top_k, exclude_idx=None):
+        """
+        Сусіди для довільних (вже закодованих) векторів queries
+        
+        Args:
+            exclude_idx: для кожного запиту — рядок каталогу, який треба
+                виключити (сама яхта), або None
+        """
+        n_samples = self.feature_matrix_scaled.shape[0]
+        n_excluded = 0 if exclude_idx is None else 1
+        top_k = max(min(top_k, n_samples - self.n_removed - n_excluded), 0)
+        
+        # top_k=0 або порожній batch: kneighbors не викликаємо
+        if top_k == 0 or queries.shape[0] == 0:
+            shape = (queries.shape[0], top_k)
+            return np.empty(shape, dtype=np.int64), np.empty(shape, dtype=np.float32)
+        
+        # +1, бо найближчим сусідом зазвичай є сама яхта; + видалені (tombstones)
+        n_neighbors = min(top_k + n_excluded + self.n_removed, n_samples)
+        
+        distances, indices = self.knn_model.kneighbors(queries, n_neighbors=n_neighbors)
+        
+        # Видаляємо саму яхту та видалені яхти і залишаємо перші top_k.
+        # Якщо самої яхти немає серед сусідів (дублікати з однаковими
+        # features) — відкидається останній сусід
+        keep = np.ones(indices.shape, dtype=bool)
+        if exclude_idx is not None:
+            keep &= indices != exclude_idx[:, None]
+        if self.n_removed:
+            keep &= ~self.removed[indices]
+        keep &= np.cumsum(keep, axis=1) <= top_k
+        
+        indices = indices[keep].reshape(-1, top_k)
+        distances = distances[keep].reshape(-1, top_k)
+        
+        return indices, self.distances_to_similarity(distances)
+    
+    def resident_arrays(self):
+        """
+        Масиви, які запити читають повністю — їх варто прогріти у page cache
+        після load_model (service.warm_up)
+        
+        З index='quantized' це коди індексу (а не float32 features): з
+        features читаються лише рядки запитів і rerank кандидатів, тому
+        резидентна пам'ять — розмір квантизованих даних.
+        """
+        if self.index_name == 'quantized' and self.knn_model.codes is not None:
+            arrays = [self.knn_model.codes, self.knn_model.scales]
+            if self.knn_model.inv_norms is not None:
+                arrays.append(self.knn_model.inv_norms)
+        elif sp.issparse(self.feature_matrix_scaled):
+            features = self.feature_matrix_scaled
+            arrays = [features.data, features.indices, features.indptr]
+        else:
+            arrays = [self.feature_matrix_scaled]
+        
+        if self.neighbor_indices is not None:
+            arrays += [self.neighbor_indices, self.neighbor_scores]
+        return arrays
+    
+    def index_recall_report(self, k=10, n_queries=500):
+        """
+        Recall@k та швидкість поточного індексу порівняно з точним KNN
+        (корисно для підбору параметрів index='lsh')
+        """
+        if self.knn_model is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+        
+        report = recall_report(self.knn_model, self.feature_matrix_scaled, k=k, n_queries=n_queries)
+        report['index'] = self.index_name
+        report['index_params'] = self.index_params
+        
+        print(f"📊 {self.index_name}: recall@{k} = {report[f'recall@{k}']:.3f}, "
+              f"{report['index_ms_per_query']:.3f} мс/запит (exact: {report['exact_ms_per_query']:.3f} мс)")
+        return report
+    
+    def distances_to_similarity(self, distances):
+        """
+        Конвертує distance в similarity score (для cosine: 1 - distance).
+        Працює як з одним рядком, так і з матрицею (по рядках).
+        """
+        if self.knn_model.metric == 'cosine':
+            return 1 - distances
+        
+        # Для euclidean/manhattan: нормалізуємо до [0, 1] в межах кожного запиту
+        max_dist = distances.max(axis=-1, keepdims=True) if distances.size else 1
+        max_dist = np.where(max_dist > 0, max_dist, 1)
+        return 1 - (distances / max_dist)
+    
+    def add_yachts(self, df):
+        """
+        Додає нові яхти без повного fit()
+        
+        Рядки кодуються замороженим feature encoder з fit(), KNN індекс
+        і mapping ID оновлюються на місці. Таблиця сусідів (якщо є) отримує
+        рядки для нових яхт, а списки інших яхт перераховуються тільки там,
+        куди нові яхти потрапляють (див. _affected_rows).
+        
+        Args:
+            df: DataFrame нових яхт (з колонкою 'id')
+        """
+        if not self._check_incremental(df):
+            return self
+        
+        existing = np.flatnonzero(self.yacht_id_to_idx.rows(df['id']) >= 0)
+        if len(existing):
+            raise ValueError(
+                f"Yacht ID {df['id'].iloc[existing[0]]} вже є в датасеті (використайте update_yachts)"
+            )
+        
+        start = len(self.yacht_ids)
+        new_features = self._encode_rows(df)
+        
+        if sp.issparse(self.feature_matrix_scaled):
+            self.feature_matrix_scaled = sp.vstack(
+                [self.feature_matrix_scaled, new_features], format='csr', dtype=np.float32
+            )
+        else:
+            self.feature_matrix_scaled = np.ascontiguousarray(
+                np.vstack([self.feature_matrix_scaled, new_features]), dtype=np.float32
+            )
+        
+        self.catalog.append(df)
+        self.yacht_ids = self.catalog['id']
+        self.removed = np.concatenate([self.removed, np.zeros(len(df), dtype=bool)])
+        
+        new_idx = np.arange(start, len(self.yacht_ids))
+        self._refresh_index(new_idx)
+        
+        print(f"✅ Додано {len(df)} яхт")
+        return self
+    
+    def update_yachts(self, df):
+        """
+        Оновлює існуючі яхти (ціна, гості, ...) без повного fit()
+        
+        df може містити тільки змінені колонки (+ 'id'): решта береться
+        з поточних даних яхти. Features перераховуються на місці.
+        """
+        if not self._check_incremental(df):
+            return self
+        
+        idx = self.yacht_id_to_idx.rows(df['id'])
+        missing = np.flatnonzero(idx < 0)
+        if len(missing):
+            raise ValueError(f"Yacht ID {df['id'].iloc[missing[0]]} не знайдено в датасеті")
+        
+        # Переносимо змінені колонки в каталог (int → float ціна або нова
+        # категорія змінюють тип колонки)
+        self.catalog.update(idx, df)
+        
+        new_features = self._encode_rows(self.catalog.take(idx))
+        
+        if sp.issparse(self.feature_matrix_scaled):
+            features = self.feature_matrix_scaled.tolil()
+            features[idx] = new_features
+            self.feature_matrix_scaled = features.tocsr()
+        else:
+            # mmap моделі відкриті read-only — копіюємо перед зміною
+            if not self.feature_matrix_scaled.flags.writeable:
+                self.feature_matrix_scaled = np.array(self.feature_matrix_scaled)
+            self.feature_matrix_scaled[idx] = new_features
+        
+        self._refresh_index(idx)
+        
+        print(f"✅ Оновлено {len(df)} яхт")
+        return self
+    
+    def remove_yachts(self, yacht_ids):
+        """
+        Видаляє яхти з рекомендацій (tombstones, без перебудови індексу)
+        
+        Рядки фізично видаляються у compact().
+        """
+        # Дублікати ID видаляються один раз; перевірка — до будь-яких змін
+        yacht_ids = list(dict.fromkeys(yacht_ids))
+        removed_idx = self.yacht_id_to_idx.rows(yacht_ids)
+        missing = np.flatnonzero(removed_idx < 0)
+        if len(missing):
+            raise ValueError(f"Yacht ID {yacht_ids[missing[0]]} не знайдено в датасеті")
+        
+        self.removed[removed_idx] = True
+        self.n_removed = int(self.removed.sum())
+        
+        # Перераховуємо тільки списки, де були видалені яхти
+        if self.neighbor_indices is not None:
+            self._recompute_rows(self._affected_rows(removed_idx, entering=False))
+        
+        print(f"✅ Видалено {len(yacht_ids)} яхт (tombstones: {self.n_removed})")
+        return self
+    
+    def compact(self):
+        """
+        Фізично видаляє tombstones: features, каталог, mapping ID та
+        таблиця сусідів перебудовуються без видалених яхт
+        """
+        if not self.n_removed:
+            return self
+        
+        alive = np.flatnonzero(~self.removed)
+        self.feature_matrix_scaled = self.feature_matrix_scaled[alive]
+        if not sp.issparse(self.feature_matrix_scaled):
+            self.feature_matrix_scaled = np.ascontiguousarray(self.feature_matrix_scaled)
+        self.catalog = self.catalog.subset(alive)
+        self.yacht_ids = self.catalog['id'] if 'id' in self.catalog else self.yacht_ids[alive]
+        self.removed = np.zeros(len(alive), dtype=bool)
+        self.n_removed = 0
+        
+        self.knn_model.fit(self.feature_matrix_scaled)
+        self._build_filter_index()
+        if self.neighbor_indices is not None:
+            self.build_neighbor_table(self.neighbor_indices.shape[1])
+        
+        print(f"✅ Compact: залишилось {len(alive)} яхт")
+        return self
+    
+    def _check_incremental(self, df):
+        """
+        Спільні перевірки для add_yachts / update_yachts.
+        Повертає False, якщо змінювати нічого.
+        """
+        if self.knn_model is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+        if 'id' not in df.columns:
+            raise ValueError("Для інкрементальних змін потрібна колонка 'id'")
+        return len(df) > 0
+    
+    def _encode_rows(self, df):
+        """
+        Кодує яхти замороженими словниками та нормалізацією з fit()
+        """
+        return self.encoder.transform(df)
+    
+    def _refresh_index(self, changed_idx):
+        """
+        Після add/update: KNN індекс, фільтри та рядки таблиці сусідів,
+        на які впливають changed_idx (див. _affected_rows)
+        """
+        # Для brute-force fit лише запам'ятовує матрицю
+        self.knn_model.fit(self.feature_matrix_scaled)
+        self._build_filter_index()
+        
+        if self.neighbor_indices is None:
+            return
+        
+        # Reverse index та K-ті відстані — по старій таблиці (до додавання рядків)
+        affected = self._affected_rows(changed_idx)
+        
+        k = self.neighbor_indices.shape[1]
+        n_missing = len(self.yacht_ids) - self.neighbor_indices.shape[0]
+        if n_missing > 0:
+            self.neighbor_indices = np.concatenate([
+                self.neighbor_indices, np.zeros((n_missing, k), dtype=np.int32)
+            ])
+            self.neighbor_scores = np.concatenate([
+                self.neighbor_scores, np.zeros((n_missing, k), dtype=np.float32)
+            ])
+            self.changed_lists = np.concatenate([self.changed_lists, np.zeros(n_missing, dtype=bool)])
+        
+        self._recompute_rows(affected)
+    
+    def _recompute_rows(self, rows):
+        """
+        Перераховує рядки rows таблиці сусідів і оновлює reverse index
+        """
+        # mmap моделі відкриті read-only — копіюємо перед зміною
+        if not self.neighbor_indices.flags.writeable:
+            self.neighbor_indices = np.array(self.neighbor_indices)
+            self.neighbor_scores = np.array(self.neighbor_scores)
+        
+        if len(rows):
+            # Якщо живих яхт менше за k, batch_neighbors поверне менше колонок
+            indices, similarities = self.batch_neighbors(rows, self.neighbor_indices.shape[1])
+            n_columns = indices.shape[1]
+            self.neighbor_indices[rows, :n_columns] = indices
+            self.neighbor_scores[rows, :n_columns] = similarities
+            self.changed_lists[rows] = True
+        
+        self._build_reverse_index()
     
     def get_yacht_info(self, yacht_id):
         """
@@ -223,42 +996,306 @@ class YachtRecommender:
             return None
         
         yacht_idx = self.yacht_id_to_idx[yacht_id]
-        return self.df.iloc[yacht_idx]
+        return self.catalog.take([yacht_idx]).iloc[0]
     
-    def save_model(self, filepath='yacht_recommender.pkl'):
+    def save_model(self, path='yacht_recommender_model'):
         """
-        Зберігає модель на диск
+        Зберігає модель на диск як директорію:
+            metadata.json — версія формату, параметри KNN, feature encoder
+            *.npy — features, таблиця сусідів, ID та колонки каталогу,
+                коди quantized індексу
+        
+        .npy масиви завантажуються через np.load(mmap_mode='r'), тому кілька
+        worker процесів ділять ті самі сторінки page cache.
+        Модель пишеться у тимчасову директорію і підміняється через
+        atomic_directory() (стара копія відсувається, а не видаляється
+        заздалегідь); без вікна відсутності — publish_model().
         """
-        with open(filepath, 'wb') as f:
-            pickle.dump({
-                'knn_model': self.knn_model,
-                'feature_matrix': self.feature_matrix,
-                'scaler': self.scaler,
-                'yacht_id_to_idx': self.yacht_id_to_idx,
-                'idx_to_yacht_id': self.idx_to_yacht_id,
-                'df': self.df
-            }, f)
-        print(f"✅ Модель збережена у {filepath}")
+        if self.knn_model is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+        
+        path = os.path.abspath(path)
+        with atomic_directory(path) as tmp_path:
+            self._write_model_files(tmp_path)
+        
+        print(f"✅ Модель збережена у {path}")
+    
+    def _write_model_files(self, tmp_path):
+        """
+        Вміст директорії моделі (див. save_model)
+        """
+        def save_array(name, array):
+            save_model_array(tmp_path, name, array)
+        
+        # Features (dense або CSR)
+        features = self.feature_matrix_scaled
+        if sp.issparse(features):
+            features = features.tocsr()
+            save_array('features_data', features.data.astype(np.float32))
+            save_array('features_indices', features.indices)
+            save_array('features_indptr', features.indptr)
+        else:
+            save_array('features', np.asarray(features, dtype=np.float32))
+        
+        # Таблиця сусідів (якщо побудована)
+        if self.n_removed:
+            save_array('removed', self.removed)
+        
+        if self.neighbor_indices is not None:
+            save_array('neighbor_indices', self.neighbor_indices.astype(np.int32))
+            save_array('neighbor_scores', self.neighbor_scores.astype(np.float32))
+            save_array('reverse_indptr', self.reverse_indptr)
+            save_array('reverse_indices', self.reverse_indices)
+        
+        # Квантизовані коди індексу: load_model не квантизує заново, а worker-и
+        # ділять їх через mmap, як і features
+        if self.index_name == 'quantized':
+            save_array('index_codes', self.knn_model.codes)
+            save_array('index_scales', self.knn_model.scales)
+            if self.knn_model.inv_norms is not None:
+                save_array('index_inv_norms', self.knn_model.inv_norms)
+        
+        # ID яхт: uuid/str → fixed-width unicode, щоб масив можна було mmap
+        id_type = save_ids(tmp_path, 'yacht_ids', self.yacht_ids)
+        
+        # Каталог: колонки як numeric масиви або коди категорій
+        catalog_columns = self.catalog.save(os.path.join(tmp_path, 'catalog'))
+        
+        metadata = {
+            'format_version': MODEL_FORMAT_VERSION,
+            'n_yachts': int(len(self.yacht_ids)),
+            'id_type': id_type,
+            'sparse': bool(sp.issparse(self.feature_matrix_scaled)),
+            'n_features': int(self.feature_matrix_scaled.shape[1]),
+            'feature_names': list(self.feature_names),
+            'knn': {
+                'n_neighbors': int(self.knn_model.n_neighbors),
+                'metric': self.knn_model.metric,
+                'index': self.index_name,
+                'index_params': self.index_params,
+            },
+            'encoder': self.encoder.to_dict(),
+            'has_neighbor_table': self.neighbor_indices is not None,
+            'n_removed': int(self.n_removed),
+            'catalog_columns': catalog_columns,
+        }
+        write_metadata(tmp_path, metadata)
     
     @classmethod
-    def load_model(cls, filepath='yacht_recommender.pkl'):
+    def load_model(cls, path='yacht_recommender_model', mmap=True):
         """
         Завантажує модель з диску
+        
+        Args:
+            path: директорія з save_model() (або старий .pkl файл)
+            mmap: відкривати .npy масиви через mmap (read-only, спільні сторінки)
+        """
+        if os.path.isfile(path):
+            return cls._load_pickle_model(path)
+        
+        metadata = read_metadata(path)
+        
+        if metadata.get('format_version') not in (1, MODEL_FORMAT_VERSION):
+            raise ValueError(
+                f"Непідтримувана версія формату моделі: {metadata.get('format_version')} "
+                f"(очікується {MODEL_FORMAT_VERSION})"
+            )
+        
+        # Quantized індекс читає з float32 features лише окремі рядки
+        random_access = metadata['knn']['index'] == 'quantized'
+        
+        def load_array(name, random_access=False):
+            return load_model_array(path, name, mmap=mmap, random_access=random_access)
+        
+        # ID яхт
+        yacht_ids = load_ids(path, 'yacht_ids', metadata['id_type'], mmap=mmap)
+        
+        # Каталог
+        recommender = cls(YachtCatalog.load(
+            os.path.join(path, 'catalog'), metadata['catalog_columns'], ids=yacht_ids, mmap=mmap
+        ))
+        
+        # Features
+        if metadata['sparse']:
+            recommender.feature_matrix_scaled = sp.csr_matrix(
+                (load_array('features_data', random_access), load_array('features_indices', random_access),
+                 load_array('features_indptr')),
+                shape=(metadata['n_yachts'], metadata['n_features']),
+                copy=False
+            )
+        else:
+            recommender.feature_matrix_scaled = load_array('features', random_access)
+        recommender.feature_names = metadata['feature_names']
+        if metadata['format_version'] == 1:
+            recommender.encoder = _encoder_from_scalers(
+                metadata['feature_names'], metadata['scaler'], metadata['one_hot_scaler']
+            )
+        else:
+            recommender.encoder = YachtFeatureEncoder.from_dict(metadata['encoder'])
+        
+        recommender.yacht_ids = yacht_ids
+        if metadata.get('n_removed'):
+            recommender.removed = np.array(load_array('removed'))
+        else:
+            recommender.removed = np.zeros(len(yacht_ids), dtype=bool)
+        recommender.n_removed = int(recommender.removed.sum())
+        
+        # Для brute-force (cosine) fit лише запам'ятовує mmap масив — без копії;
+        # quantized індекс відкриває збережені коди через mmap
+        knn = metadata['knn']
+        recommender.index_name = knn['index']
+        recommender.index_params = knn['index_params']
+        recommender.knn_model = build_index(
+            knn['index'], n_neighbors=knn['n_neighbors'], metric=knn['metric'], **knn['index_params']
+        )
+        if os.path.exists(os.path.join(path, 'index_codes.npy')):
+            inv_norms_path = os.path.join(path, 'index_inv_norms.npy')
+            recommender.knn_model.fit_codes(
+                recommender.feature_matrix_scaled, load_array('index_codes'), load_array('index_scales'),
+                inv_norms=load_array('index_inv_norms') if os.path.exists(inv_norms_path) else None
+            )
+        else:
+            recommender.knn_model.fit(recommender.feature_matrix_scaled)
+        
+        if metadata['has_neighbor_table']:
+            recommender.neighbor_indices = load_array('neighbor_indices')
+            recommender.neighbor_scores = load_array('neighbor_scores')
+            if os.path.exists(os.path.join(path, 'reverse_indptr.npy')):
+                recommender.reverse_indptr = load_array('reverse_indptr')
+                recommender.reverse_indices = load_array('reverse_indices')
+            else:
+                recommender._build_reverse_index()
+            recommender.changed_lists = np.zeros(len(yacht_ids), dtype=bool)
+        
+        recommender._build_filter_index()
+        
+        print(f"✅ Модель завантажена з {path}")
+        return recommender
+    
+    @classmethod
+    def _load_pickle_model(cls, filepath):
+        """
+        Завантажує модель у старому pickle форматі (до MODEL_FORMAT_VERSION)
         """
         with open(filepath, 'rb') as f:
             data = pickle.load(f)
         
         recommender = cls(data['df'])
         recommender.knn_model = data['knn_model']
-        recommender.feature_matrix = data['feature_matrix']
-        recommender.scaler = data['scaler']
-        recommender.yacht_id_to_idx = data['yacht_id_to_idx']
-        recommender.idx_to_yacht_id = data['idx_to_yacht_id']
+        recommender.feature_matrix = data.get('feature_matrix')
+        
+        # Старі pickle не містять scaled матриці та масиву ID
+        recommender.feature_matrix_scaled = data.get('feature_matrix_scaled')
+        if recommender.feature_matrix_scaled is None:
+            recommender.feature_matrix_scaled = data['scaler'].transform(
+                recommender.feature_matrix.values.astype(np.float64)
+            )
+        if not sp.issparse(recommender.feature_matrix_scaled):
+            recommender.feature_matrix_scaled = np.ascontiguousarray(
+                recommender.feature_matrix_scaled, dtype=np.float32
+            )
+        recommender.feature_names = data.get('feature_names')
+        if recommender.feature_names is None:
+            recommender.feature_names = list(recommender.feature_matrix.columns)
+        recommender.encoder = _encoder_from_scalers(
+            recommender.feature_names, data['scaler'], data.get('one_hot_scaler')
+        )
+        
+        recommender._build_filter_index()
+        # yacht_id_to_idx / idx_to_yacht_id з pickle не потрібні: mapping будується з yacht_ids
+        idx_to_yacht_id = data['idx_to_yacht_id']
+        recommender.removed = np.zeros(len(idx_to_yacht_id), dtype=bool)
+        recommender.n_removed = 0
+        recommender.neighbor_indices = data.get('neighbor_indices')
+        recommender.neighbor_scores = data.get('neighbor_scores')
+        recommender.yacht_ids = data.get('yacht_ids')
+        if recommender.yacht_ids is None:
+            recommender.yacht_ids = np.array(
+                [idx_to_yacht_id[idx] for idx in range(len(idx_to_yacht_id))], dtype=object
+            )
+        if recommender.neighbor_indices is not None:
+            recommender._build_reverse_index()
+            recommender.changed_lists = np.zeros(len(recommender.yacht_ids), dtype=bool)
         
         print(f"✅ Модель завантажена з {filepath}")
         return recommender
 
 
+# Модель worker процесу паралельного build (_sharded_neighbors)
+_shard_recommender = None
+_shard_thread_limits = None
+
+
+def _init_shard_worker(model_path):
+    """
+    Initializer worker процесу: mmap модель + один потік BLAS / індексу
+    """
+    global _shard_recommender, _shard_thread_limits
+    _shard_thread_limits = threadpool_limits(limits=1)
+    
+    recommender = YachtRecommender.load_model(model_path, mmap=True)
+    if 'n_threads' in recommender.index_params:
+        recommender.index_params = {**recommender.index_params, 'n_threads': 1}
+        recommender.knn_model = build_index(
+            recommender.index_name,
+            n_neighbors=recommender.knn_model.n_neighbors,
+            metric=recommender.knn_model.metric,
+            **recommender.index_params
+        ).fit(recommender.feature_matrix_scaled)
+    _shard_recommender = recommender
+
+
+def _shard_neighbors(query_idx, top_k):
+    """
+    Сусіди для одного shard рядків-запитів (виконується у worker процесі)
+    """
+    return _shard_recommender.batch_neighbors(query_idx, top_k)
+
+
+def validate_filters(filters):
+    """
+    Перевіряє типи фільтрів recommend() / search_rows(): рядок замість
+    списку ({'countries': 'Italy'}) інакше мовчки дає порожній результат
+    """
+    if filters is None:
+        return
+    if not isinstance(filters, dict):
+        raise ValueError(f"filters має бути об'єктом, отримано {type(filters).__name__}")
+    for key in LIST_FILTERS:
+        value = filters.get(key)
+        if value is not None and not isinstance(value, (list, tuple, set, np.ndarray)):
+            raise ValueError(f"Фільтр '{key}' має бути списком, отримано {type(value).__name__}")
+    for key in NUMERIC_FILTERS:
+        if key not in filters:
+            continue
+        value = filters[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float, np.number)):
+            raise ValueError(f"Фільтр '{key}' має бути числом, отримано {type(value).__name__}")
+
+
+def _encoder_from_scalers(feature_names, scaler, one_hot_scaler=None):
+    """
+    Feature encoder для моделей до MODEL_FORMAT_VERSION 2, де нормалізація
+    зберігалась як StandardScaler (або його параметри у JSON)
+    """
+    def params(value, name):
+        value = getattr(value, f"{name}_") if hasattr(value, f"{name}_") else value[name]
+        return None if value is None else np.asarray(value, dtype=np.float64)
+    
+    if one_hot_scaler is None:
+        return YachtFeatureEncoder.from_feature_layout(
+            feature_names, params(scaler, 'mean'), params(scaler, 'scale')
+        )
+    
+    one_hot_scale = params(one_hot_scaler, 'scale')
+    return YachtFeatureEncoder.from_feature_layout(
+        feature_names,
+        np.concatenate([params(scaler, 'mean'), np.zeros_like(one_hot_scale)]),
+        np.concatenate([params(scaler, 'scale'), one_hot_scale]),
+        sparse=True
+    )
+
+
 # ============================================
 # ВИКОРИСТАННЯ
 # ============================================
@@ -267,51 +1304,36 @@ if __name__ == "__main__":
     # 1. Завантажуємо дані
     engine = create_engine(os.getenv("DB_STRING"))
 
-    # SQL-запит (можна вибрати конкретну таблицю або зробити join)
-    query = "SELECT * FROM yachts;"
-
-    # Зчитуємо дані у DataFrame
-    raw_conn = engine.raw_connection()
-
-    try:
-        df = pd.read_sql(query, raw_conn)
-    finally:
-        raw_conn.close()  # обов’язково закрити!
+    # Тільки колонки каталогу (без description / photos), частинами через
+    # server-side cursor — пам'ять не залежить від розміру текстових колонок
+    catalog = YachtCatalog.from_sql(engine, table='yachts', chunksize=50_000)
     
-    print(f"Завантажено {len(df)} яхт")
+    print(f"Завантажено {len(catalog)} яхт")
     
     # 2. Створюємо та тренуємо recommender
     # ВАЖЛИВО: n_neighbors = 21, щоб отримати 20 рекомендацій + саму яхту
-    recommender = YachtRecommender(df)
-    recommender.fit(n_neighbors=12, metric='cosine')
+    recommender = YachtRecommender(catalog)
+    # 'blocked' — точний cosine top-k блоками (фіксована пам'ять на великому каталозі)
+    recommender.fit(
+        n_neighbors=12,
+        metric='cosine',
+        index='blocked',
+        index_params={'block_size': 1024}
+    )
     
-    print("\n🚀 Починаємо генерацію рекомендацій для всіх яхт...")
+    # Нова генерація моделі для сервісу (service.py підхопить її без рестарту)
+    if os.getenv("MODEL_ROOT"):
+        publish_model(recommender, os.getenv("MODEL_ROOT"))
     
-    all_recommendations_data = []
+    print("\n🚀 Починаємо генерацію рекомендацій для всіх яхт...")
     
-    # 3. Проходимо по кожній яхті і генеруємо рекомендації
-    all_yacht_ids = df['id'].unique()
+    # 3. Batched kneighbors для всіх яхт, shards паралельно в процесах
+    yacht_ids, neighbor_ids, _ = recommender.recommend_all(top_k=11, n_jobs=-1)
     
-    # tqdm - це просто для гарного progress bar
-    for yacht_id in tqdm(all_yacht_ids, desc="Генерація рекомендацій"):
-        try:
-            # Отримуємо 20 найкращих рекомендацій
-            recs_df = recommender.recommend(yacht_id, top_k=11)
-            
-            # Отримуємо тільки список ID
-            recs_ids = recs_df['id'].tolist()
-            
-            # Додаємо у наш список
-            all_recommendations_data.append({
-                'yacht_id': yacht_id,
-                'cold_recommendations': recs_ids
-            })
-        except ValueError as e:
-            print(f"Помилка для yacht_id {yacht_id}: {e}")
-            all_recommendations_data.append({
-                'yacht_id': yacht_id,
-                'cold_recommendations': [] # Порожній список у разі помилки
-            })
+    all_recommendations_data = [
+        {'yacht_id': yacht_id, 'cold_recommendations': list(recs_ids)}
+        for yacht_id, recs_ids in zip(yacht_ids, neighbor_ids)
+    ]
 
     print(f"\n✅ Успішно згенеровано рекомендації для {len(all_recommendations_data)} яхт.")
     
@@ -319,8 +1341,7 @@ if __name__ == "__main__":
     recs_to_upload_df = pd.DataFrame(all_recommendations_data)
     recs_to_upload_df['yacht_id'] = recs_to_upload_df['yacht_id'].astype(str)
 
-    # --- ОСЬ ЦЕЙ ВАЖЛИВИЙ РЯДОК ---
-    # Він перетворює [UUID('...')] на ['...']
+    # Для CSV бекапу: [UUID('...')] → ['...'] (в БД пишемо нативний uuid[])
     recs_to_upload_df['cold_recommendations'] = recs_to_upload_df['cold_recommendations'].apply(
         lambda uuid_list: str([str(uuid_obj) for uuid_obj in uuid_list])
     )
@@ -335,16 +1356,9 @@ if __name__ == "__main__":
     print(f"📤 Завантажуємо дані в PostgreSQL (таблиця: {table_name})...")
     
     try:
-        # Визначаємо типи даних для колонок
-        # Це важливо, щоб 'cold_recommendations' стала масивом у Postgres
-        
-        # Завантажуємо DataFrame в SQL
-        recs_to_upload_df.to_sql(
-            table_name, 
-            engine, 
-            if_exists='replace',  # 'replace' - повністю перестворює таблицю
-            index=False
-        )
+        # COPY у staging таблицю з нативним uuid[] + атомарна підміна:
+        # читачі не бачать порожньої таблиці і не парсять рядки
+        write_cold_recommendations(engine, yacht_ids, neighbor_ids, table=table_name, mode='swap')
         
         print(f"✅ Дані успішно завантажено в таблицю '{table_name}'!")
         
@@ -355,7 +1369,7 @@ if __name__ == "__main__":
     # recommender.fit(n_neighbors=12, metric='cosine')
     
     # # 3. Зберігаємо модель (для production)
-    # recommender.save_model('yacht_recommender.pkl')
+    # recommender.save_model('yacht_recommender_model')
     
     # # 4. ПРИКЛАД: Рекомендації для першої яхти
     # yacht_id = df['id'].iloc[0]  # Перша яхта
@@ -399,29 +1413,5 @@ if __name__ == "__main__":
     # for i, row in filtered_recs.iterrows():
     #     print(f"{i + 1}. {row['name']} - ${row['summerLowSeasonPrice']:,.0f}/день")
 
-# metrics_to_test = ['cosine', 'euclidean', 'manhattan']
-# results = {}
-
-# for metric in metrics_to_test:
-#     print(f"\n{'='*50}")
-#     print(f"Testing metric: {metric}")
-#     print(f"{'='*50}")
-    
-#     rec = YachtRecommender(df)
-#     rec.fit(n_neighbors=11, metric=metric)
-    
-#     # Тестуємо на кількох яхтах
-#     sample_yachts = df['id'].sample(10)
-    
-#     for yacht_id in sample_yachts:
-#         recs = rec.recommend(yacht_id, top_k=5)
-#         results[f"{metric}_{yacht_id}"] = recs
-        
-#     # Перевіряємо diversity
-#     all_recommended_ids = set()
-#     for yacht_id in sample_yachts:
-#         recs = rec.recommend(yacht_id, top_k=10)
-#         all_recommended_ids.update(recs['id'])
-    
-#     diversity = len(all_recommended_ids) / len(df)
-#     print(f"Diversity (catalog coverage): {diversity:.2%}")
+# Порівняння метрик та index backend-ів (час fit / запитів, recall, hit-rate,
+# NDCG на held-out подіях, coverage каталогу) — див. benchmark.py
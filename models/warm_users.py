@@ -0,0 +1,237 @@
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from contextlib import nullcontext
+from sklearn.metrics.pairwise import pairwise_distances
+from sqlalchemy import create_engine
+import dotenv
+
+from events import build_interaction_matrix, load_events
+from cold_recommendations import write_recommendations
+from instrumentation import instrumented
+
+dotenv.load_dotenv()
+
+
+# Таблиця персональних рекомендацій (user_id uuid, warm_recommendations uuid[])
+WARM_RECOMMENDATIONS_TABLE = 'warm_recommendations'
+
+# Період напіврозпаду ваги події: подія 30-денної давнини важить удвічі менше
+DECAY_HALF_LIFE_DAYS = 30
+
+# Користувачів на блок скорингу: float32 буфер block × n_yachts
+# (256 × 100k яхт ≈ 100 МБ) + int64 індекси argpartition того ж розміру
+WARM_BLOCK_SIZE = 256
+
+# Стовпців (яхт) на один виклик pairwise_distances у блоці
+ITEM_BLOCK_SIZE = 16_384
+
+
+class WarmUserRecommender:
+    """
+    Персональні рекомендації для користувачів з історією подій (warm start)
+
+    Профіль користувача — зважене (EVENT_WEIGHTS) та затухаюче в часі
+    середнє feature рядків яхт, з якими він взаємодіяв: один sparse
+    добуток W @ X (users × yachts на yachts × features) замість циклу
+    по користувачах. Скоринг — блоками користувачів проти всього каталогу
+    в тому ж feature просторі й метриці, що й YachtRecommender.
+    """
+
+    def __init__(self, recommender, half_life_days=DECAY_HALF_LIFE_DAYS, exclude_seen=True):
+        """
+        Args:
+            recommender: натренований YachtRecommender
+            half_life_days: період напіврозпаду ваги подій (None — без затухання)
+            exclude_seen: яхти з історії користувача йдуть після всіх інших
+        """
+        if recommender.knn_model is None:
+            raise ValueError("Модель не натренована! Спочатку викличте .fit()")
+
+        self.recommender = recommender
+        self.half_life_days = half_life_days
+        self.exclude_seen = exclude_seen
+        self.interactions = None  # CSR users × yachts, затухаючі ваги
+        self.user_ids = None
+        self.user_id_to_idx = {}
+        self.instrumentation = recommender.instrumentation
+
+    def _timed(self, name, kind='stage'):
+        if self.instrumentation is None:
+            return nullcontext()
+        return self.instrumentation.timer(kind, name)
+
+    def _count(self, name, value=1):
+        if self.instrumentation is not None:
+            self.instrumentation.increment(name, value)
+
+    @instrumented('warm_fit')
+    def fit(self, events, now=None):
+        """
+        Будує матрицю взаємодій з подій
+
+        Args:
+            events: DataFrame подій (userId, yachtId, weight або type, createdAt)
+                або ітератор chunk-ів (load_events)
+            now: момент, від якого рахується затухання (за замовчуванням — зараз)
+        """
+        self.interactions, self.user_ids = build_interaction_matrix(
+            events, self.recommender.yacht_id_to_idx, half_life_days=self.half_life_days, now=now,
+            n_yachts=len(self.recommender.yacht_ids)
+        )
+        self.user_id_to_idx = {user_id: idx for idx, user_id in enumerate(self.user_ids)}
+
+        print(f"✅ Матриця взаємодій: {self.interactions.shape[0]} користувачів × "
+              f"{self.interactions.shape[1]} яхт, {self.interactions.nnz} пар")
+        return self
+
+    def user_profiles(self, rows):
+        """
+        Профілі користувачів rows: зважене середнє feature рядків їхніх яхт
+        (dense float32, rows × features)
+        """
+        weights = self.interactions[rows]
+        totals = np.asarray(weights.sum(axis=1), dtype=np.float32).ravel()
+        totals[totals == 0] = 1
+        weights = sp.diags(1 / totals) @ weights
+
+        profiles = weights @ self.recommender.feature_matrix_scaled
+        if sp.issparse(profiles):
+            profiles = profiles.toarray()
+        return np.ascontiguousarray(profiles, dtype=np.float32)
+
+    @instrumented('warm_recommend_many')
+    def recommend_many(self, user_ids, top_k=10, block_size=WARM_BLOCK_SIZE):
+        """
+        Top-K яхт для списку користувачів (невідомі ID пропускаються)
+
+        Returns:
+            (user_ids, neighbor_ids, scores): ID знайдених користувачів,
+            масиви shape (n_users, top_k)
+        """
+        if self.interactions is None:
+            raise ValueError("Історія не завантажена! Спочатку викличте .fit()")
+
+        rows = np.array([self.user_id_to_idx[user_id] for user_id in user_ids if user_id in self.user_id_to_idx],
+                        dtype=np.int64)
+        indices, scores = self._score_rows(rows, top_k, block_size)
+        return self.user_ids[rows], self.recommender.yacht_ids[indices], scores
+
+    @instrumented('warm_recommend_all')
+    def recommend_all(self, top_k=10, block_size=WARM_BLOCK_SIZE):
+        """
+        Top-K яхт для всіх користувачів з історією (нічний batch)
+
+        Returns:
+            (user_ids, neighbor_ids, scores)
+        """
+        if self.interactions is None:
+            raise ValueError("Історія не завантажена! Спочатку викличте .fit()")
+
+        rows = np.arange(len(self.user_ids))
+        indices, scores = self._score_rows(rows, top_k, block_size)
+        return self.user_ids, self.recommender.yacht_ids[indices], scores
+
+    def _score_rows(self, rows, top_k, block_size):
+        """
+        Скоринг рядків матриці взаємодій блоками по block_size користувачів
+
+        Пам'ять на блок — один float32 буфер block_size × n_yachts відстаней
+        (+ int64 індекси argpartition того ж розміру); відстані до яхт
+        рахуються по ITEM_BLOCK_SIZE стовпців, тож float64 проміжні
+        результати sklearn (manhattan) не більші за block × ITEM_BLOCK_SIZE.
+        Переглянуті яхти отримують штраф (max відстань рядка + 1) на місці,
+        тому потрапляють у top-K лише коли інших яхт не вистачає; видалені
+        яхти — ніколи.
+        """
+        recommender = self.recommender
+        features = recommender.feature_matrix_scaled
+        metric = recommender.knn_model.metric
+        n_yachts = features.shape[0]
+        top_k = max(min(top_k, n_yachts - recommender.n_removed), 0)
+
+        indices = np.empty((len(rows), top_k), dtype=np.int64)
+        scores = np.empty((len(rows), top_k), dtype=np.float32)
+        if top_k == 0:
+            return indices, scores
+
+        buffer = np.empty((min(block_size, len(rows)), n_yachts), dtype=np.float32)
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            with self._timed('warm_profile'):
+                profiles = self.user_profiles(block)
+
+            with self._timed('neighbor_query'):
+                distances = buffer[:len(block)]
+                for item_start in range(0, n_yachts, ITEM_BLOCK_SIZE):
+                    item_end = min(item_start + ITEM_BLOCK_SIZE, n_yachts)
+                    distances[:, item_start:item_end] = pairwise_distances(
+                        profiles, features[item_start:item_end], metric=metric
+                    )
+
+                if self.exclude_seen:
+                    seen = self.interactions[block]
+                    penalty = distances.max(axis=1) + 1
+                    seen_rows = np.repeat(np.arange(len(block)), np.diff(seen.indptr))
+                    distances[seen_rows, seen.indices] += penalty[seen_rows]
+                if recommender.n_removed:
+                    distances[:, recommender.removed] = np.inf
+
+                top = np.argpartition(distances, top_k - 1, axis=1)[:, :top_k]
+                top_distances = np.take_along_axis(distances, top, axis=1)
+                order = np.argsort(top_distances, axis=1, kind='stable')
+                top = np.take_along_axis(top, order, axis=1)
+                top_distances = np.take_along_axis(top_distances, order, axis=1)
+
+            if self.exclude_seen:
+                # Переглянуті яхти в top-K — у користувача замало непереглянутих;
+                # їхня відстань — без штрафу
+                is_seen = top_distances > penalty[:, None] - 0.5
+                n_seen = int(is_seen.sum())
+                if n_seen:
+                    self._count('warm_seen_fallback', n_seen)
+                    top_distances -= np.where(is_seen, penalty[:, None], 0)
+
+            indices[start:start + len(block)] = top
+            scores[start:start + len(block)] = recommender.distances_to_similarity(top_distances)
+
+        return indices, scores
+
+
+def write_warm_recommendations(engine, user_ids, neighbor_ids, table=WARM_RECOMMENDATIONS_TABLE, mode='swap'):
+    """
+    Bulk-запис warm_recommendations (user_id uuid, warm_recommendations uuid[]) через COPY
+    """
+    return write_recommendations(
+        engine, user_ids, neighbor_ids, table=table, key_column='user_id',
+        value_column='warm_recommendations', mode=mode
+    )
+
+
+# ============================================
+# ВИКОРИСТАННЯ (нічний job)
+# ============================================
+
+if __name__ == "__main__":
+    from similar_yachts import YachtRecommender
+    from model_store import current_model_path
+
+    engine = create_engine(os.getenv("DB_STRING"))
+
+    # Та сама модель, що й у сервісі (mmap, без повторного fit)
+    recommender = YachtRecommender.load_model(current_model_path(os.getenv("MODEL_ROOT", "yacht_recommender_model")))
+
+    # Активні користувачі — події за останні ACTIVE_DAYS днів
+    active_days = int(os.getenv("ACTIVE_DAYS", "180"))
+    since = (pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=active_days)).to_pydatetime()
+
+    warm = WarmUserRecommender(recommender).fit(load_events(engine, since=since))
+
+    print("\n🚀 Генеруємо персональні рекомендації для всіх активних користувачів...")
+    user_ids, neighbor_ids, _ = warm.recommend_all(top_k=10)
+
+    try:
+        write_warm_recommendations(engine, user_ids, neighbor_ids)
+    except Exception as e:
+        print(f"❌ Помилка під час завантаження в базу даних: {e}")